@@ -0,0 +1,423 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import aiohttp
+import aiohttp_socks
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s]: %(message)s",
+    level=logging.INFO
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPOSE = ["docker", "compose", "-f", os.path.join(ROOT, "docker-compose.yml"), "-f", os.path.join(ROOT, "bench", "docker-compose.bench.yml")]
+STACK_SERVICES = ["tor", "haconfig-generator", "haproxy", "metrics"]
+STATS_URL = os.getenv("BENCH_STATS_URL", "http://localhost:1337/;csv")
+PROXY = os.getenv("BENCH_PROXY", "socks5://localhost:8080")
+# the stand-in ignores the destination, any name resolved through the proxy works
+TARGET = os.getenv("BENCH_TARGET", "http://bench.invalid/")
+READY_TIMEOUT = float(os.getenv("BENCH_READY_TIMEOUT", "300"))
+# endpoints hit for every simulated fleet size
+METRICS_ENDPOINTS = (
+    "/dashboard-data",
+    "/dashboard/summary",
+    "/dashboard/hosts?limit=100&detail=summary",
+    "/dashboard/backends?limit=500",
+    "/metrics",
+)
+# endpoints hit on the aggregator for every node count
+FEDERATION_ENDPOINTS = (
+    "/dashboard-data",
+    "/dashboard/summary",
+    "/dashboard/hosts?limit=100&detail=summary",
+    "/fleet/nodes",
+    "/fleet/capacity",
+)
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """nearest-rank p50/p95/p99 in milliseconds"""
+    ordered = sorted(values)
+    if not ordered:
+        return {"p50": None, "p95": None, "p99": None}
+    pick = lambda q: round(ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))] * 1000, 1)
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99)}
+
+def trace_connects() -> aiohttp.TraceConfig:
+    """records when each request's connection, the socks handshake through the proxy included, was established"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_connection_create_end(session, context, params):
+        context.trace_request_ctx["connected"] = time.perf_counter()
+
+    trace.on_connection_create_end.append(on_connection_create_end)
+    return trace
+
+async def run_load(proxy: str, url: str, requests: int, concurrency: int, timeout: float = 60) -> Dict:
+    """requests GETs through a socks proxy, concurrency at a time, with connect and transfer times split"""
+    connects, transfers, totals = [], [], []
+    failures: Dict[str, int] = {}
+    received = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    # a fresh connection per request, so every request pays for its own socks connect like a tor stream does
+    connector = aiohttp_socks.ProxyConnector.from_url(proxy, rdns=True, force_close=True, limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout), trace_configs=[trace_connects()]) as session:
+
+        async def fetch():
+            nonlocal received
+            async with semaphore:
+                timing: Dict[str, float] = {}
+                started = time.perf_counter()
+                try:
+                    async with session.get(url, trace_request_ctx=timing) as response:
+                        body = await response.read()
+                        if response.status != 200:
+                            raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+                except Exception as e:
+                    reason = e.__class__.__name__
+                    failures[reason] = failures.get(reason, 0) + 1
+                    return
+                finished = time.perf_counter()
+                connected = timing.get("connected", started)
+                connects.append(connected - started)
+                transfers.append(finished - connected)
+                totals.append(finished - started)
+                received += len(body)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "ok": len(totals),
+        "failed": sum(failures.values()),
+        "failures": failures,
+        "seconds": round(elapsed, 2),
+        "rps": round(len(totals) / elapsed, 1),
+        "mbps": round(received * 8 / elapsed / 10 ** 6, 2),
+        "connectMs": percentiles(connects),
+        "transferMs": percentiles(transfers),
+        "totalMs": percentiles(totals)
+    }
+
+async def run_http_load(url: str, requests: int, concurrency: int, headers: Optional[Dict[str, str]] = None) -> Dict:
+    """plain http GETs against the metrics api, with status counts and bytes on the wire"""
+    latencies = []
+    statuses: Dict[int, int] = {}
+    received = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120), auto_decompress=False) as session:
+
+        async def fetch():
+            nonlocal received
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.get(url, headers={"Accept-Encoding": "gzip", **(headers or {})}) as response:
+                    body = await response.read()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                received += len(body)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(fetch() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+    return {
+        "rps": round(requests / elapsed, 1),
+        "latencyMs": percentiles(latencies),
+        "statuses": statuses,
+        "bytes": received // max(1, requests)
+    }
+
+def stats_servers(text: str) -> Dict[str, int]:
+    """haproxy server rows in the tor backend groups by status"""
+    counts: Dict[str, int] = {}
+    lines = text.splitlines()
+    header = lines[0].lstrip("# ").split(",")
+    pxname, svname, status = header.index("pxname"), header.index("svname"), header.index("status")
+    for line in lines[1:]:
+        row = line.split(",")
+        if len(row) > status and re.match(r"^tors\d*$", row[pxname]) and row[svname] not in ("BACKEND", "FRONTEND"):
+            counts[row[status]] = counts.get(row[status], 0) + 1
+    return counts
+
+async def wait_ready(expected: int, timeout: float = READY_TIMEOUT):
+    """until haproxy has expected tor servers UP and undrained, so the metrics service has seen their circuits"""
+    deadline = time.monotonic() + timeout
+    counts: Dict[str, int] = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(STATS_URL) as response:
+                    counts = stats_servers(await response.text())
+                if counts.get("UP", 0) >= expected:
+                    return counts
+            except Exception:
+                pass
+            await asyncio.sleep(2)
+    raise TimeoutError(f"only {counts} of {expected} tor servers ready after {timeout}s")
+
+def compose(*args: str, env: Optional[Dict[str, str]] = None):
+    subprocess.run(COMPOSE + list(args), check=True, env={**os.environ, **(env or {})})
+
+async def bench_stack(args) -> List[Dict]:
+    """every balance algorithm against every replica count, a fresh stack per algorithm"""
+    rows = []
+    for algorithm in args.algorithms.split(","):
+        try:
+            for replicas in (int(r) for r in args.replicas.split(",")):
+                env = {"HAPROXY_BALANCE": algorithm, "SOCKS": str(replicas), "TOR_SOCKS_PORTS": str(args.socks_ports)}
+                logging.info(f"bringing up {replicas} stand-in replicas balanced by {algorithm}")
+                compose("up", "-d", "--build", "--scale", f"tor={replicas}", *STACK_SERVICES, env=env)
+                await wait_ready(replicas * args.socks_ports)
+                await run_load(PROXY, TARGET, args.concurrency, args.concurrency)
+                result = await run_load(PROXY, TARGET, args.requests, args.concurrency)
+                rows.append({"algorithm": algorithm, "replicas": replicas, **result})
+                logging.info(f"{algorithm} x{replicas}: {result['rps']} req/s, connect p99 {result['connectMs']['p99']}ms")
+        finally:
+            if not args.keep:
+                compose("down")
+    return rows
+
+class FleetContainer:
+    """a docker container record for one simulated tor host, every one pointing at the shared stand-in controlport"""
+
+    def __init__(self, index: int, socks_ports: int):
+        self.id = self.short_id = f"{index:012x}"
+        self.name = f"multisocks-tor-{index}"
+        self.status = "running"
+        self.image = SimpleNamespace(tags=["multisocks-tor:bench"], short_id="bench")
+        self.attrs = {
+            "Config": {"User": "tor", "Env": [f"TOR_SOCKS_PORTS={socks_ports}"]},
+            "NetworkSettings": {"Networks": {"net_tor": {"IPAddress": "127.0.0.1"}}},
+            "State": {"StartedAt": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")}
+        }
+
+class FleetDocker:
+    """the slice of the docker client the container registry uses, for a fixed simulated fleet"""
+
+    def __init__(self, hosts: int, socks_ports: int):
+        fleet = [FleetContainer(i, socks_ports) for i in range(1, hosts + 1)]
+        self.by_id = {container.id: container for container in fleet}
+        self.containers = SimpleNamespace(list=lambda filters=None: fleet, get=lambda container_id: self.by_id[container_id])
+
+    def events(self, **kwargs):
+        # a fleet that never changes, the registry's watcher just blocks here
+        while True:
+            time.sleep(3600)
+            yield from ()
+
+def serve_metrics(args):
+    """the metrics service against a simulated fleet, run as its own process so its cost is measured apart from the load"""
+    os.environ.update({
+        "HAPROXY_STATS_URL": f"http://127.0.0.1:{args.stats_port}/;csv",
+        "HAPROXY_RUNTIME": "127.0.0.1:1",
+        "WEIGHTING_MODE": "observe",
+        "GEOIP_DATABASE": os.getenv("GEOIP_DATABASE", os.path.join(ROOT, "metrics", "GeoLite2-City.mmdb"))
+    })
+    if args.federate:
+        os.environ.update({"METRICS_MODE": "aggregator", "FEDERATION_NODES": args.federate})
+    sys.path.insert(0, os.path.join(ROOT, "metrics", "app"))
+    import uvicorn
+    import controlpool
+    import main
+    controlpool.CONTROL_PORT = args.control_port
+    main.registry.client_factory = lambda: FleetDocker(args.hosts, args.socks_ports)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+def spawn_node(hosts: int, socks_ports: int, port: int, control_port: int, stats_port: int) -> List[subprocess.Popen]:
+    """a stand-in controlport and stats page with a metrics service in front of them"""
+    standin = subprocess.Popen([sys.executable, os.path.join(ROOT, "bench", "standin.py"), "--control-only", "--bind", "127.0.0.1",
+                                "--control-port", str(control_port), "--stats-port", str(stats_port),
+                                "--stats-servers", str(hosts * socks_ports), "--socks-ports", str(socks_ports)])
+    service = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve-metrics", "--hosts", str(hosts),
+                                "--socks-ports", str(socks_ports), "--control-port", str(control_port),
+                                "--stats-port", str(stats_port), "--port", str(port)])
+    return [service, standin]
+
+def stop_processes(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+async def wait_for_hosts(session: aiohttp.ClientSession, base: str, hosts: int) -> float:
+    """seconds until the service at base serves a snapshot of every host"""
+    started = time.perf_counter()
+    while True:
+        try:
+            async with session.get(f"{base}/dashboard/summary") as response:
+                if response.status == 200 and (await response.json())["counts"]["torHosts"] == hosts:
+                    return time.perf_counter() - started
+        except aiohttp.ClientError:
+            pass
+        if time.perf_counter() - started > READY_TIMEOUT:
+            raise TimeoutError(f"no snapshot of {hosts} hosts from {base} after {READY_TIMEOUT}s")
+        await asyncio.sleep(0.5)
+
+def stage_means(text: str) -> Dict[str, float]:
+    """mean milliseconds per collection stage from the /metrics stage histograms"""
+    sums, counts = {}, {}
+    for match in re.finditer(r'^multisocks_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', text, re.M):
+        (sums if match.group(1) == "sum" else counts)[match.group(2)] = float(match.group(3))
+    return {stage: round(sums[stage] / counts[stage] * 1000, 2) for stage in sorted(counts) if counts[stage]}
+
+async def bench_metrics(args) -> List[Dict]:
+    """the metrics api at each simulated fleet size: time to the first snapshot, then every endpoint under load"""
+    rows = []
+    base = f"http://127.0.0.1:{args.port}"
+    for hosts in (int(n) for n in args.fleet.split(",")):
+        processes = spawn_node(hosts, args.socks_ports, args.port, args.control_port, args.stats_port)
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=READY_TIMEOUT)) as session:
+                first_snapshot = await wait_for_hosts(session, base, hosts)
+                # let a few snapshots build on warm sessions before measuring
+                await asyncio.sleep(args.settle)
+                endpoints = {}
+                for endpoint in METRICS_ENDPOINTS:
+                    endpoints[endpoint] = await run_http_load(f"{base}{endpoint}", args.requests, args.concurrency)
+                async with session.get(f"{base}/dashboard-data") as response:
+                    etag = response.headers.get("ETag")
+                if etag:
+                    endpoints["/dashboard-data (If-None-Match)"] = await run_http_load(f"{base}/dashboard-data", args.requests, args.concurrency, {"If-None-Match": etag})
+                async with session.get(f"{base}/metrics") as response:
+                    stages = stage_means(await response.text())
+            rows.append({"hosts": hosts, "firstSnapshotSeconds": round(first_snapshot, 2), "stageMeanMs": stages, "endpoints": endpoints})
+            logging.info(f"{hosts} hosts: first snapshot after {first_snapshot:.1f}s, snapshot build mean {stages.get('snapshot_build')}ms")
+        finally:
+            stop_processes(processes)
+    return rows
+
+async def bench_federation(args) -> List[Dict]:
+    """an aggregator over growing numbers of local metrics nodes: time to converge, its endpoints, and how soon a lost node shows stale"""
+    rows = []
+    base = f"http://127.0.0.1:{args.port}"
+    for count in (int(n) for n in args.nodes.split(",")):
+        processes = []
+        try:
+            for i in range(count):
+                processes += spawn_node(args.hosts, args.socks_ports, args.port + 1 + i, args.control_port + i, args.stats_port + i)
+            nodes = ",".join(f"node{i}=http://127.0.0.1:{args.port + 1 + i}" for i in range(count))
+            aggregator = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve-metrics", "--federate", nodes, "--port", str(args.port)])
+            processes.insert(0, aggregator)
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=READY_TIMEOUT)) as session:
+                converged = await wait_for_hosts(session, base, count * args.hosts)
+                await asyncio.sleep(args.settle)
+                endpoints = {}
+                for endpoint in FEDERATION_ENDPOINTS:
+                    endpoints[endpoint] = await run_http_load(f"{base}{endpoint}", args.requests, args.concurrency)
+                async with session.get(f"{base}/metrics") as response:
+                    stages = stage_means(await response.text())
+                # take the first node away and time how long until the aggregator reports it stale
+                lost = time.perf_counter()
+                stop_processes(processes[1:3])
+                while True:
+                    async with session.get(f"{base}/fleet/nodes") as response:
+                        if (await response.json())["nodes"][0]["stale"]:
+                            break
+                    await asyncio.sleep(0.1)
+                stale_after = time.perf_counter() - lost
+            rows.append({"hosts": count * args.hosts, "nodes": count, "firstSnapshotSeconds": round(converged, 2),
+                         "staleAfterSeconds": round(stale_after, 2), "stageMeanMs": stages, "endpoints": endpoints})
+            logging.info(f"{count} nodes of {args.hosts} hosts: converged after {converged:.1f}s, lost node stale after {stale_after:.2f}s")
+        finally:
+            stop_processes(processes)
+    return rows
+
+def print_stack(rows: List[Dict]):
+    print(f"{'algorithm':<12} {'replicas':>8} {'ok':>6} {'failed':>6} {'req/s':>8} {'Mbit/s':>8}   connect p50/p95/p99 ms   transfer p50/p95/p99 ms")
+    for row in rows:
+        connect, transfer = row['connectMs'], row['transferMs']
+        print(f"{row['algorithm']:<12} {row['replicas']:>8} {row['ok']:>6} {row['failed']:>6} {row['rps']:>8} {row['mbps']:>8}   "
+              f"{connect['p50']}/{connect['p95']}/{connect['p99']:<14}   {transfer['p50']}/{transfer['p95']}/{transfer['p99']}")
+
+def print_metrics(rows: List[Dict]):
+    for row in rows:
+        nodes = f" on {row['nodes']} nodes, lost node stale after {row['staleAfterSeconds']}s" if 'nodes' in row else ""
+        print(f"\n{row['hosts']} hosts - first snapshot after {row['firstSnapshotSeconds']}s{nodes}")
+        print("  stage means (ms): " + ", ".join(f"{stage} {ms}" for stage, ms in row['stageMeanMs'].items()))
+        print(f"  {'endpoint':<44} {'req/s':>8} {'bytes':>10}   p50/p95/p99 ms")
+        for endpoint, result in row['endpoints'].items():
+            latency = result['latencyMs']
+            print(f"  {endpoint:<44} {result['rps']:>8} {result['bytes']:>10}   {latency['p50']}/{latency['p95']}/{latency['p99']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="multisocks benchmarks against stand-in tor backends")
+    parser.add_argument("--json", help="also write the results to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stack = commands.add_parser("stack", help="haproxy and the metrics service in docker, stand-in tor replicas behind them")
+    stack.add_argument("--algorithms", default="leastconn,roundrobin,static-rr,first")
+    stack.add_argument("--replicas", default="5,20,50")
+    stack.add_argument("--socks-ports", type=int, default=1)
+    stack.add_argument("--requests", type=int, default=1000)
+    stack.add_argument("--concurrency", type=int, default=100)
+    stack.add_argument("--keep", action="store_true", help="leave the last stack running")
+
+    load = commands.add_parser("load", help="load only, against a proxy that is already up")
+    load.add_argument("--proxy", default=PROXY)
+    load.add_argument("--target", default=TARGET)
+    load.add_argument("--requests", type=int, default=1000)
+    load.add_argument("--concurrency", type=int, default=100)
+
+    metrics = commands.add_parser("metrics", help="the metrics api against simulated fleets, no docker needed")
+    metrics.add_argument("--fleet", default="100,1000,4095")
+    metrics.add_argument("--socks-ports", type=int, default=1)
+    metrics.add_argument("--requests", type=int, default=200)
+    metrics.add_argument("--concurrency", type=int, default=20)
+    metrics.add_argument("--settle", type=float, default=10, help="seconds of snapshot builds before measuring")
+    metrics.add_argument("--port", type=int, default=18000)
+    metrics.add_argument("--control-port", type=int, default=19051)
+    metrics.add_argument("--stats-port", type=int, default=11337)
+
+    federation = commands.add_parser("federation", help="an aggregator over several local metrics nodes, no docker needed")
+    federation.add_argument("--nodes", default="2,4,8")
+    federation.add_argument("--hosts", type=int, default=100, help="tor hosts per node")
+    federation.add_argument("--socks-ports", type=int, default=1)
+    federation.add_argument("--requests", type=int, default=200)
+    federation.add_argument("--concurrency", type=int, default=20)
+    federation.add_argument("--settle", type=float, default=10, help="seconds of snapshot builds before measuring")
+    federation.add_argument("--port", type=int, default=18000, help="the aggregator's, nodes take the ports after it")
+    federation.add_argument("--control-port", type=int, default=19051)
+    federation.add_argument("--stats-port", type=int, default=11337)
+
+    serve = commands.add_parser("serve-metrics", help=argparse.SUPPRESS)
+    serve.add_argument("--hosts", type=int, default=0)
+    serve.add_argument("--socks-ports", type=int, default=1)
+    serve.add_argument("--port", type=int, required=True)
+    serve.add_argument("--control-port", type=int, default=0)
+    serve.add_argument("--stats-port", type=int, default=0)
+    serve.add_argument("--federate", help="run as an aggregator over these FEDERATION_NODES")
+
+    args = parser.parse_args()
+    if args.command == "serve-metrics":
+        serve_metrics(args)
+        return
+    if args.command == "stack":
+        rows = asyncio.run(bench_stack(args))
+        print_stack(rows)
+    elif args.command == "load":
+        result = asyncio.run(run_load(args.proxy, args.target, args.requests, args.concurrency))
+        rows = [{"algorithm": "-", "replicas": "-", **result}]
+        print_stack(rows)
+    elif args.command == "federation":
+        rows = asyncio.run(bench_federation(args))
+        print_metrics(rows)
+    else:
+        rows = asyncio.run(bench_metrics(args))
+        print_metrics(rows)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(rows, file, indent=2)
+
+if __name__ == "__main__":
+    main()
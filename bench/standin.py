@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import random
+import struct
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s]: %(message)s",
+    level=logging.INFO
+)
+
+# knobs for the stand-in tor, all in milliseconds except the rates and sizes
+CONNECT_LATENCY = float(os.getenv("BENCH_CONNECT_LATENCY", "150"))
+CONNECT_JITTER = float(os.getenv("BENCH_CONNECT_JITTER", "50"))
+FIRST_BYTE_LATENCY = float(os.getenv("BENCH_FIRST_BYTE_LATENCY", "100"))
+FAILURE_RATE = float(os.getenv("BENCH_FAILURE_RATE", "0"))
+BODY_SIZE = int(os.getenv("BENCH_BODY_SIZE", "16384"))
+BANDWIDTH = int(os.getenv("BENCH_BANDWIDTH", "0"))
+CONTROL_LATENCY = float(os.getenv("BENCH_CONTROL_LATENCY", "0"))
+CIRCUITS = int(os.getenv("BENCH_CIRCUITS", "3"))
+REBUILD_LATENCY = float(os.getenv("BENCH_REBUILD_LATENCY", "500"))
+# streams per second on each controlport connection, each with NEW, SENTCONNECT, SUCCEEDED and CLOSED events
+STREAM_RATE = float(os.getenv("BENCH_STREAM_RATE", "0"))
+ATTACH_LATENCY = float(os.getenv("BENCH_ATTACH_LATENCY", "5"))
+TOR_SOCKS_PORT = 9050
+TOR_CONTROL_PORT = 9051
+CHUNK_SIZE = 16384
+
+# the haproxy csv columns the metrics service reads, in the order haproxy emits them
+STATS_COLUMNS = (
+    "pxname", "svname", "scur", "smax", "stot", "bin", "bout", "ereq", "econ", "eresp", "wretr", "wredis",
+    "status", "weight", "act", "bck", "chkfail", "chkdown", "lastchg", "downtime", "rate", "rate_max",
+    "check_status", "check_code", "check_duration", "hrsp_2xx", "hrsp_3xx", "hrsp_4xx", "hrsp_5xx",
+    "cli_abrt", "srv_abrt", "lastsess", "last_chk", "qtime", "ctime", "rtime", "ttime",
+    "qtime_max", "ctime_max", "rtime_max", "ttime_max", "addr",
+)
+TEXT_COLUMNS = ("pxname", "svname", "status", "check_status", "last_chk", "addr")
+# getinfo keys tor answers in the multi-line form
+MULTILINE_KEYS = ("circuit-status", "ns/all", "ns/id/")
+
+REP_SUCCEEDED = 0x00
+REP_HOST_UNREACHABLE = 0x04
+
+def delay(base: float, jitter: float = 0) -> float:
+    """seconds for a base latency with gaussian jitter, both in milliseconds"""
+    return max(0.0, random.gauss(base, jitter) if jitter else base) / 1000
+
+def fingerprint(seed: str) -> str:
+    return hashlib.sha1(seed.encode()).hexdigest().upper()
+
+def relay_entry(fp: str, nickname: str, address: str, flags: str) -> str:
+    identity = base64.b64encode(bytes.fromhex(fp)).decode().rstrip("=")
+    return f"r {nickname} {identity} ZGRkZGRkZGRkZGRkZGRkZGRkZGQ 2024-01-01 00:00:00 {address} 9001 0\r\ns {flags}"
+
+# a small fixed consensus, circuits are three hops drawn from it
+RELAYS: Dict[str, str] = {}
+for i in range(64):
+    fp = fingerprint(f"relay{i}")
+    flags = "Exit Fast Running Valid" if i % 4 == 3 else "Fast Guard Running Stable Valid"
+    RELAYS[fp] = relay_entry(fp, f"standin{i}", f"10.{i // 250}.{i % 250}.1", flags)
+EXIT_IDS = [fp for fp, entry in RELAYS.items() if "Exit" in entry]
+MIDDLE_IDS = [fp for fp in RELAYS if fp not in EXIT_IDS]
+
+class SocksStandin:
+    """answers socks5 connects after a configurable delay and serves a fixed http response, paced to a bandwidth"""
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            _, nmethods = await reader.readexactly(2)
+            methods = await reader.readexactly(nmethods)
+            if 0x02 in methods:
+                writer.write(b"\x05\x02")
+                _, ulen = await reader.readexactly(2)
+                await reader.readexactly(ulen)
+                plen = (await reader.readexactly(1))[0]
+                await reader.readexactly(plen)
+                writer.write(b"\x01\x00")
+            else:
+                writer.write(b"\x05\x00")
+            _, _, _, atyp = await reader.readexactly(4)
+            if atyp == 0x01:
+                await reader.readexactly(4)
+            elif atyp == 0x04:
+                await reader.readexactly(16)
+            else:
+                await reader.readexactly((await reader.readexactly(1))[0])
+            await reader.readexactly(2)
+            # the circuit extend and exit connect a real tor would do
+            await asyncio.sleep(delay(CONNECT_LATENCY, CONNECT_JITTER))
+            if random.random() < FAILURE_RATE:
+                writer.write(struct.pack("!BBBB", 5, REP_HOST_UNREACHABLE, 0, 1) + bytes(6))
+                await writer.drain()
+                return
+            writer.write(struct.pack("!BBBB", 5, REP_SUCCEEDED, 0, 1) + bytes(6))
+            await writer.drain()
+            await reader.readuntil(b"\r\n\r\n")
+            await asyncio.sleep(delay(FIRST_BYTE_LATENCY, CONNECT_JITTER))
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: {BODY_SIZE}\r\nConnection: close\r\n\r\n".encode())
+            sent = 0
+            while sent < BODY_SIZE:
+                chunk = min(CHUNK_SIZE, BODY_SIZE - sent)
+                writer.write(bytes(chunk))
+                await writer.drain()
+                sent += chunk
+                if BANDWIDTH:
+                    await asyncio.sleep(chunk / BANDWIDTH)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+class ControlStandin:
+    """enough of tor's control protocol for stem and the metrics service: circuits, streams, listeners and relays"""
+
+    def __init__(self, socks_ports: List[int], circuits: int = CIRCUITS):
+        self.socks_ports = socks_ports
+        self.circuits = circuits
+
+    def circuit_line(self, circ_id: int, status: str = "BUILT", created: str = "2024-01-01T00:00:00.000000") -> str:
+        path = random.sample(MIDDLE_IDS, 2) + [random.choice(EXIT_IDS)]
+        hops = ",".join(f"${fp}~{RELAYS[fp].split()[1]}" for fp in path)
+        return f"{circ_id} {status} {hops} BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL TIME_CREATED={created}"
+
+    def getinfo(self, key: str, circuits: Dict[int, str]) -> Optional[str]:
+        lowered = key.lower()
+        if lowered == "circuit-status":
+            return "\r\n".join(circuits.values())
+        if lowered == "stream-status":
+            return ""
+        if lowered == "net/listeners/socks":
+            return " ".join(f'"0.0.0.0:{port}"' for port in self.socks_ports)
+        if lowered == "ns/all":
+            return "\r\n".join(RELAYS.values())
+        if lowered.startswith("ns/id/"):
+            return RELAYS.get(key[6:].lstrip("$").upper())
+        if lowered == "version":
+            return "0.4.8.9"
+        return ""
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        circuits = {i: self.circuit_line(i) for i in range(1, self.circuits + 1)}
+        next_id = self.circuits + 1
+        lock = asyncio.Lock()
+
+        async def send(text: str):
+            async with lock:
+                writer.write(text.encode())
+                await writer.drain()
+
+        async def rebuild(circ_id: int):
+            nonlocal next_id
+            await send(f"650 CIRC {circ_id} CLOSED REASON=REQUESTED\r\n")
+            new_id, next_id = next_id, next_id + 1
+            created = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
+            await send(f"650 CIRC {new_id} LAUNCHED BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL TIME_CREATED={created}\r\n")
+            await asyncio.sleep(delay(REBUILD_LATENCY))
+            circuits[new_id] = self.circuit_line(new_id, created=created)
+            await send(f"650 CIRC {circuits[new_id]}\r\n")
+
+        async def stream(stream_id: int):
+            try:
+                await send(f"650 STREAM {stream_id} NEW 0 bench.invalid:80 SOURCE_ADDR=127.0.0.1:40000 PURPOSE=USER\r\n")
+                await asyncio.sleep(delay(ATTACH_LATENCY))
+                circ_id = random.choice(list(circuits))
+                await send(f"650 STREAM {stream_id} SENTCONNECT {circ_id} bench.invalid:80\r\n")
+                await asyncio.sleep(delay(CONNECT_LATENCY, CONNECT_JITTER))
+                await send(f"650 STREAM {stream_id} SUCCEEDED {circ_id} bench.invalid:80\r\n")
+                await asyncio.sleep(delay(FIRST_BYTE_LATENCY))
+                await send(f"650 STREAM {stream_id} CLOSED {circ_id} bench.invalid:80 REASON=DONE\r\n")
+            except ConnectionError:
+                # the session went away mid-stream
+                pass
+
+        async def streams():
+            stream_id = 1
+            while True:
+                await asyncio.sleep(random.expovariate(STREAM_RATE))
+                if circuits:
+                    asyncio.create_task(stream(stream_id))
+                    stream_id += 1
+
+        streamer = asyncio.create_task(streams()) if STREAM_RATE else None
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode().strip()
+                verb, _, rest = command.partition(" ")
+                verb = verb.upper()
+                if CONTROL_LATENCY:
+                    await asyncio.sleep(delay(CONTROL_LATENCY))
+                if verb == "PROTOCOLINFO":
+                    await send('250-PROTOCOLINFO 1\r\n250-AUTH METHODS=HASHEDPASSWORD\r\n250-VERSION Tor="0.4.8.9"\r\n250 OK\r\n')
+                elif verb == "GETINFO":
+                    lines = []
+                    for key in rest.split():
+                        value = self.getinfo(key, circuits)
+                        if value is None:
+                            lines = None
+                            break
+                        lines.append(f"250+{key}=\r\n{value}\r\n." if key.lower().startswith(MULTILINE_KEYS) else f"250-{key}={value}")
+                    await send("552 Unrecognized key\r\n" if lines is None else "\r\n".join(lines) + "\r\n250 OK\r\n")
+                elif verb == "CLOSECIRCUIT":
+                    circ_id = int(rest.split()[0])
+                    if circuits.pop(circ_id, None) is None:
+                        await send(f"552 Unknown circuit \"{circ_id}\"\r\n")
+                        continue
+                    await send("250 OK\r\n")
+                    asyncio.create_task(rebuild(circ_id))
+                elif verb == "QUIT":
+                    await send("250 closing connection\r\n")
+                    break
+                else:
+                    await send("250 OK\r\n")
+        except ConnectionError:
+            pass
+        finally:
+            if streamer is not None:
+                streamer.cancel()
+            writer.close()
+
+def stats_csv(servers: int, group_size: int = 4000) -> str:
+    """a haproxy stats csv with one UP row per simulated socksport, sharded like gen_conf shards them"""
+    rows = ["# " + ",".join(STATS_COLUMNS)]
+    for group in range((servers + group_size - 1) // group_size):
+        values = {"pxname": "tors" if group == 0 else f"tors{group + 1}", "svname": "BACKEND", "status": "UP"}
+        rows.append(",".join(str(values.get(column, "" if column in TEXT_COLUMNS else 0)) for column in STATS_COLUMNS))
+    for index in range(1, servers + 1):
+        group = (index - 1) // group_size
+        values = {
+            "pxname": "tors" if group == 0 else f"tors{group + 1}", "svname": f"tor{index}", "status": "UP",
+            "scur": random.randint(0, 8), "smax": 16, "stot": random.randint(1000, 9000), "bin": random.randint(10 ** 6, 10 ** 8),
+            "bout": random.randint(10 ** 6, 10 ** 8), "weight": 100, "act": 1, "ctime": random.randint(50, 400),
+            "ttime": random.randint(500, 4000), "check_status": "L4OK", "addr": f"10.{index // 250}.{index % 250}.2:9050"
+        }
+        rows.append(",".join(str(values.get(column, "" if column in TEXT_COLUMNS else 0)) for column in STATS_COLUMNS))
+    return "\n".join(rows) + "\n"
+
+async def serve_stats(port: int, servers: int):
+    body = stats_csv(servers).encode()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", port)
+
+async def main():
+    parser = argparse.ArgumentParser(description="a stand-in tor instance for benchmarks: socksports and a controlport")
+    parser.add_argument("--socks-ports", type=int, default=int(os.getenv("TOR_SOCKS_PORTS", "1") or 1), help="socksports to open, 9050 then 9052 upwards")
+    parser.add_argument("--control-port", type=int, default=TOR_CONTROL_PORT)
+    parser.add_argument("--bind", default="0.0.0.0")
+    parser.add_argument("--control-only", action="store_true", help="only the controlport, shared by a whole simulated fleet")
+    parser.add_argument("--stats-port", type=int, help="also serve a haproxy stats csv on this port")
+    parser.add_argument("--stats-servers", type=int, default=0, help="rows in the simulated haproxy stats csv")
+    args = parser.parse_args()
+
+    socks_ports = [TOR_SOCKS_PORT] + [TOR_SOCKS_PORT + 1 + i for i in range(1, args.socks_ports)]
+    servers = [await asyncio.start_server(ControlStandin(socks_ports).handle, args.bind, args.control_port, limit=2 ** 20)]
+    if not args.control_only:
+        socks = SocksStandin()
+        servers.extend([await asyncio.start_server(socks.handle, args.bind, port) for port in socks_ports])
+    if args.stats_port:
+        servers.append(await serve_stats(args.stats_port, args.stats_servers))
+    logging.info(f"stand-in tor listening, control :{args.control_port}" + ("" if args.control_only else f", socks {socks_ports}"))
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react'
-import { useQuery } from '@tanstack/react-query'
+import { useQuery, keepPreviousData } from '@tanstack/react-query'
 import { QueryClient, QueryClientProvider } from '@tanstack/react-query'
 import { Card, CardContent, CardHeader, CardTitle } from './components/ui/card'
 import { Button } from './components/ui/button'
@@ -9,7 +9,7 @@ import { SystemOverview } from './components/SystemOverview'
 import { NetworkTraffic } from './components/NetworkTraffic'
 import { CircuitMonitor } from './components/CircuitMonitor'
 import { Diagnostics } from './components/Diagnostics'
-import { apiClient } from './lib/api'
+import { apiClient, type DashboardTab } from './lib/api'
 import type { DashboardData } from './types'
 import { RefreshCw, Activity, Globe, Shield, Moon, Sun, AlertTriangle } from 'lucide-react'
 
@@ -28,12 +28,14 @@ function Dashboard() {
   const [activeTab, setActiveTab] = useState('overview')
 
   const { data: dashboardData, isLoading, error, refetch } = useQuery<DashboardData>({
-    queryKey: ['dashboard'],
+    queryKey: ['dashboard', activeTab],
     queryFn: async () => {
-      const data = await apiClient.getDashboardData()
+      const data = await apiClient.getDashboardForTab(activeTab as DashboardTab)
       setLastUpdated(new Date())
       return data
     },
+    // keep showing the last tab's data while the new tab's sections load
+    placeholderData: keepPreviousData,
   })
 
   const handleRefresh = () => {
@@ -63,8 +63,8 @@ export function SystemOverview({ data }: SystemOverviewProps) {
       const result = await apiClient.rebuildAllCircuits()
       addToast({
         type: 'success',
-        title: 'All Circuits Rebuilt',
-        description: `Rebuilt circuits for ${result.results.length} hosts`
+        title: 'Rebuilding All Circuits',
+        description: `Rebuilding ${result.job.total} hosts, ${result.job.concurrency} at a time`
       })
     } catch (error) {
       addToast({
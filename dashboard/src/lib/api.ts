@@ -1,11 +1,22 @@
 import type { 
   TorHost, 
   TorHostWithCircuits, 
-  DashboardData 
+  HAProxyStats,
+  DashboardData,
+  DashboardDelta,
+  DashboardSummaryView,
+  Page,
+  BulkJobProgress,
+  BulkOperation
 } from '../types'
 
+export type DashboardTab = 'overview' | 'traffic' | 'circuits' | 'diagnostics'
+export type HostDetail = 'full' | 'summary' | 'none'
+
 class ApiClient {
   private baseUrl: string
+  // the last body seen per url, replayed when the server answers If-None-Match with 304
+  private etags = new Map<string, { etag: string; body: any }>()
 
   constructor(baseUrl?: string) {
     if (baseUrl) {
@@ -35,8 +46,80 @@ class ApiClient {
     return response.json()
   }
 
+  private async conditional<T>(endpoint: string): Promise<T> {
+    const url = `${this.baseUrl}${endpoint}`
+    const cached = this.etags.get(url)
+    const response = await fetch(url, {
+      headers: cached ? { 'If-None-Match': cached.etag } : {},
+    })
+
+    if (response.status === 304 && cached) {
+      return cached.body
+    }
+    if (!response.ok) {
+      const error = await response.text()
+      throw new Error(`API request failed: ${response.status} ${error}`)
+    }
+
+    const body = await response.json()
+    const etag = response.headers.get('ETag')
+    if (etag) {
+      this.etags.set(url, { etag, body })
+    }
+    return body
+  }
+
+  private async allPages<T>(endpoint: string, params: Record<string, string>): Promise<T[]> {
+    const items: T[] = []
+    let cursor: string | null = null
+    do {
+      const query = new URLSearchParams({ ...params, limit: '1000', ...(cursor ? { cursor } : {}) })
+      const page: Page<T> = await this.conditional<Page<T>>(`${endpoint}?${query}`)
+      items.push(...page.items)
+      cursor = page.nextCursor
+    } while (cursor)
+    return items
+  }
+
   async getDashboardData(): Promise<DashboardData> {
-    return this.request<DashboardData>('/dashboard-data')
+    return this.conditional<DashboardData>('/dashboard-data')
+  }
+
+  async getSummary(): Promise<DashboardSummaryView> {
+    return this.conditional<DashboardSummaryView>('/dashboard/summary')
+  }
+
+  async getHosts(detail: HostDetail = 'full', filters: { state?: string; healthy?: boolean; q?: string } = {}): Promise<TorHostWithCircuits[]> {
+    const params: Record<string, string> = { detail }
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value !== undefined) params[key] = String(value)
+    })
+    return this.allPages<TorHostWithCircuits>('/dashboard/hosts', params)
+  }
+
+  async getBackends(filters: { pxname?: string; status?: string; q?: string } = {}): Promise<HAProxyStats[]> {
+    const params: Record<string, string> = {}
+    Object.entries(filters).forEach(([key, value]) => {
+      if (value !== undefined) params[key] = value
+    })
+    return this.allPages<HAProxyStats>('/dashboard/backends', params)
+  }
+
+  // only the circuits tab draws relay paths and only diagnostics lists haproxy rows,
+  // so the other tabs skip those sections and unchanged pages come back as 304s
+  async getDashboardForTab(tab: DashboardTab): Promise<DashboardData> {
+    const [view, torHosts, haproxyStats] = await Promise.all([
+      this.getSummary(),
+      this.getHosts(tab === 'circuits' ? 'full' : 'summary'),
+      tab === 'diagnostics' ? this.getBackends() : Promise.resolve([] as HAProxyStats[]),
+    ])
+    return {
+      torHosts,
+      haproxyStats,
+      summary: view.summary,
+      lastUpdated: view.lastUpdated,
+      snapshot: view.snapshot,
+    }
   }
 
   async getTorHosts(): Promise<TorHost[]> {
@@ -62,12 +145,24 @@ class ApiClient {
     })
   }
 
-  async rebuildAllCircuits(): Promise<{ success: boolean; results: Array<{ host_id: string; hostname: string; result: any }> }> {
-    return this.request<{ success: boolean; results: Array<{ host_id: string; hostname: string; result: any }> }>('/circuits/rebuild-all', {
+  // returns as soon as the job is queued, bulk_progress and bulk_complete messages follow over the websocket
+  async rebuildAllCircuits(): Promise<{ success: boolean; job: BulkJobProgress }> {
+    return this.request<{ success: boolean; job: BulkJobProgress }>('/circuits/rebuild-all', {
+      method: 'POST',
+    })
+  }
+
+  async startBulkOperation(operation: BulkOperation, options: { hosts?: string[]; concurrency?: number; fraction?: number; stagger?: number } = {}): Promise<BulkJobProgress> {
+    return this.request<BulkJobProgress>(`/bulk/${operation}`, {
       method: 'POST',
+      body: JSON.stringify(options),
     })
   }
 
+  async getBulkJob(jobId: string): Promise<BulkJobProgress & { hosts: Record<string, any> }> {
+    return this.request<BulkJobProgress & { hosts: Record<string, any> }>(`/bulk/${jobId}`)
+  }
+
   async requestNewIdentity(hostId: string): Promise<{ success: boolean; message: string }> {
     return this.request<{ success: boolean; message: string }>(`/tor-hosts/${hostId}/new-identity`, {
       method: 'POST',
@@ -75,14 +170,52 @@ class ApiClient {
   }
 
   // WebSocket connection for real-time updates
+  // the server sends one full dashboard_update then dashboard_delta frames against it,
+  // deltas are folded into the local copy so onMessage always sees a full dashboard_update
   connectWebSocket(onMessage: (data: any) => void): WebSocket {
     const wsUrl = this.baseUrl.replace('http://', 'ws://').replace('https://', 'wss://')
     const ws = new WebSocket(`${wsUrl}/ws`)
-    
+    let state: DashboardData | null = null
+    let version: number | null = null
+    let resyncing = false
+
+    // a delta against a version we never saw, the full snapshot puts us back on the feed
+    const resync = async () => {
+      if (resyncing) return
+      resyncing = true
+      state = null
+      try {
+        const data = await this.getDashboardData()
+        if (state === null) {
+          state = data
+          version = data.snapshot?.version ?? null
+          onMessage({ type: 'dashboard_update', version, data, timestamp: data.lastUpdated })
+        }
+      } catch (error) {
+        console.error('Error resyncing dashboard data:', error)
+      } finally {
+        resyncing = false
+      }
+    }
+
     ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data)
-        onMessage(data)
+        if (data.type === 'dashboard_update') {
+          state = data.data
+          version = data.version
+          onMessage(data)
+        } else if (data.type === 'dashboard_delta') {
+          if (!state || data.baseVersion !== version) {
+            resync()
+            return
+          }
+          state = applyDashboardDelta(state, data)
+          version = data.version
+          onMessage({ type: 'dashboard_update', version, data: state, timestamp: data.timestamp })
+        } else {
+          onMessage(data)
+        }
       } catch (error) {
         console.error('Error parsing WebSocket message:', error)
       }
@@ -100,4 +233,23 @@ class ApiClient {
   }
 }
 
+function applyDashboardDelta(state: DashboardData, delta: DashboardDelta): DashboardData {
+  const hosts = new Map(state.torHosts.map(host => [host.id, host]))
+  delta.hosts.removed.forEach(id => hosts.delete(id))
+  delta.hosts.changed.forEach(host => hosts.set(host.id, host))
+  const order = delta.hosts.order ?? Array.from(hosts.keys())
+  const backendKey = (stat: HAProxyStats) => `${stat.pxname}/${stat.svname}`
+  const backends = new Map(state.haproxyStats.map(stat => [backendKey(stat), stat]))
+  delta.backends.removed.forEach(key => backends.delete(key))
+  delta.backends.changed.forEach(stat => backends.set(backendKey(stat), stat))
+  return {
+    ...state,
+    torHosts: order.map(id => hosts.get(id)).filter((host): host is TorHostWithCircuits => host !== undefined),
+    haproxyStats: Array.from(backends.values()),
+    summary: delta.summary ?? state.summary,
+    lastUpdated: delta.lastUpdated,
+    snapshot: delta.snapshot,
+  }
+}
+
 export const apiClient = new ApiClient()
\ No newline at end of file
@@ -3,6 +3,7 @@ export interface TorHost {
   ip_address: string
   external_ip?: string
   hostname: string
+  socks_ports?: number[]
   image: string
   state: string
 }
@@ -22,12 +23,46 @@ export interface CircuitNode {
 export interface Circuit {
   circuit_id: string
   purpose: string
+  streams?: number
   path: CircuitNode[]
 }
 
 export interface TorHostWithCircuits extends TorHost {
   circuits: Circuit[]
   error?: string
+  stale?: boolean
+  lastCollected?: string | null
+  collectDuration?: number
+  timeToFirstCircuit?: number | null
+  circuitCount?: number
+  node?: string
+  latency?: HostLatency | null
+}
+
+export interface LatencyStats {
+  count: number
+  mean: number | null
+  p50: number | null
+  p95: number | null
+  p99: number | null
+}
+
+// fleet reports also carry their buckets, [upper bound ms or null for overflow, count]
+export interface FleetLatencyStats extends LatencyStats {
+  sum: number
+  buckets: [number | null, number][]
+}
+
+export interface HostLatency {
+  circuitBuild: LatencyStats
+  streamAttach: LatencyStats
+  streamConnect: LatencyStats
+}
+
+export interface FleetLatency {
+  circuitBuild: FleetLatencyStats
+  streamAttach: FleetLatencyStats
+  streamConnect: FleetLatencyStats
 }
 
 export interface HAProxyStats {
@@ -49,6 +84,8 @@ export interface HAProxyStats {
   bck: number
   chkfail: number
   chkdown: number
+  lastchg: number
+  addr?: string
   downtime: number
   rate: number
   rate_max: number
@@ -71,6 +108,10 @@ export interface HAProxyStats {
   ctime_max: number
   rtime_max: number
   ttime_max: number
+  sessRate: number
+  binRate: number
+  boutRate: number
+  node?: string
 }
 
 export interface SystemSummary {
@@ -83,6 +124,51 @@ export interface SystemSummary {
   healthyBackends: number
   totalBackends: number
   uptime: number
+  sessionRate?: number
+  bytesInRate?: number
+  bytesOutRate?: number
+  backendGroups?: BackendGroup[]
+  timeToFirstCircuit?: BootstrapTimes
+  nodes?: FleetNode[]
+  latency?: FleetLatency
+}
+
+export interface FleetNode {
+  name: string
+  url: string
+  connected: boolean
+  version: number | null
+  age: number | null
+  stale: boolean
+  hosts: number
+  backends: number
+  connects: number
+  error: string | null
+}
+
+export interface BootstrapTimes {
+  measured: number
+  waiting: number
+  p50: number | null
+  p95: number | null
+  max: number | null
+}
+
+export interface BackendGroup {
+  name: string
+  status: string | null
+  servers: number
+  up: number
+  scur: number
+  stot: number
+  sessRate: number
+}
+
+export interface SnapshotMeta {
+  version: number
+  buildDuration: number | null
+  stale: boolean
+  error: string | null
 }
 
 export interface DashboardData {
@@ -90,4 +176,57 @@ export interface DashboardData {
   haproxyStats: HAProxyStats[]
   summary: SystemSummary
   lastUpdated: string
+  snapshot?: SnapshotMeta
+}
+
+export interface DashboardSummaryView {
+  summary: SystemSummary
+  counts: { torHosts: number; haproxyStats: number }
+  lastUpdated: string
+  snapshot: SnapshotMeta
+}
+
+export interface Page<T> {
+  items: T[]
+  nextCursor: string | null
+  total: number
+}
+
+export interface DashboardDelta {
+  type: 'dashboard_delta'
+  version: number
+  baseVersion: number
+  hosts: {
+    order: string[] | null
+    changed: TorHostWithCircuits[]
+    removed: string[]
+  }
+  backends: {
+    changed: HAProxyStats[]
+    removed: string[]
+  }
+  summary?: SystemSummary
+  lastUpdated: string
+  snapshot: SnapshotMeta
+  timestamp: string
+}
+
+export type BulkOperation = 'rebuild' | 'newnym' | 'close'
+
+export interface BulkJobProgress {
+  id: string
+  operation: BulkOperation
+  concurrency: number
+  stagger: number
+  created: number
+  finished: number | null
+  total: number
+  counts: Record<string, number>
+}
+
+export interface BulkProgressMessage {
+  type: 'bulk_progress' | 'bulk_complete'
+  job: BulkJobProgress
+  host?: { id: string; hostname: string; status: string; error?: string }
+  timestamp: string
 }
@@ -1,27 +1,39 @@
-import docker
-import re
+import argparse
+import json
+import os
 
-def get_container_ips():
-    client = docker.from_env()
-    containers = client.containers.list(filters={"ancestor": "multisocks-private-tor"})
-    
-    ips = []
-    for container in containers:
-        exec_log = container.exec_run(
-            "curl -s --socks5-hostname localhost:9050 https://cloudflare.com/cdn-cgi/trace",
-            user="root"
-        )
-        result = exec_log.output.decode('utf-8')
-        ip_match = re.search(r'ip=([^\n]+)', result)
-        if ip_match:
-            ips.append((container.id[:12], ip_match.group(1)))
-    
-    return ips
+import requests
+
+METRICS_URL = os.getenv("METRICS_URL", "http://localhost:8000")
+
+def get_exits(hosts=None, refresh=False):
+    """current exits per tor instance, read from their circuits by the metrics service - nothing is fetched through tor"""
+    params = {"refresh": str(refresh).lower()}
+    if hosts:
+        params["hosts"] = ",".join(hosts)
+    response = requests.get(f"{METRICS_URL}/exits", params=params, timeout=60)
+    response.raise_for_status()
+    return response.json()
 
 if __name__ == "__main__":
-    container_ips = get_container_ips()
-    if container_ips:
-        for container_id, ip in container_ips:
-            print(f"Container ID: {container_id}, IP: {ip}")
+    parser = argparse.ArgumentParser(description="list the exit relays each tor instance is using")
+    parser.add_argument("hosts", nargs="*", help="container ids or names, all tor instances if omitted")
+    parser.add_argument("--refresh", action="store_true", help="skip the metrics service's exit cache")
+    parser.add_argument("--all", action="store_true", help="every exit in use per instance, not just the busiest")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    result = get_exits(args.hosts, args.refresh)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif not result["hosts"]:
+        print("No IPs found.")
     else:
-        print("No IPs found.")
\ No newline at end of file
+        for host in result["hosts"]:
+            if host.get("error"):
+                print(f"Container ID: {host['id']}, error: {host['error']}")
+            elif args.all:
+                for entry in host["exits"]:
+                    print(f"Container ID: {host['id']}, IP: {entry['address']}, exit: {entry['nickname']}, circuits: {entry['circuits']}")
+            else:
+                print(f"Container ID: {host['id']}, IP: {host['address']}")
\ No newline at end of file
@@ -1,6 +1,3 @@
-for container in $(docker ps --filter "ancestor=multisocks-private-tor" --format "{{.ID}}"); do
-  docker exec -u root $container \
-  curl -s --socks5-hostname localhost:9050 \
-  https://cloudflare.com/cdn-cgi/trace \
-  | grep ip | sed 's/ip=//'
-done
\ No newline at end of file
+# the busiest exit address of every tor instance, from the metrics service's exit discovery
+curl -s "${METRICS_URL:-http://localhost:8000}/exits" \
+  | jq -r '.hosts[] | .address // empty'
\ No newline at end of file
@@ -1,32 +1,394 @@
 import docker
+import json
+import logging
+import os
 import platform
+import re
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
 from jinja2 import Template
 
-def get_dockernet_hostnames():
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s]: %(message)s",
+    level=logging.INFO
+)
+
+HAPROXY_RUNTIME = os.getenv("HAPROXY_RUNTIME", "haproxy:9999")
+HAPROXY_SERVICE = os.getenv("HAPROXY_SERVICE", "haproxy")
+# haproxy's address on the network only it, the metrics service and this generator share
+HAPROXY_ADMIN_BIND = os.getenv("HAPROXY_ADMIN_BIND", "127.0.0.1")
+HAPROXY_SLOTS = int(os.getenv("HAPROXY_SLOTS", "256"))
+# haproxy caps a backend at 4095 servers, slots past a group's size spill into the next backend group
+GROUP_SIZE = min(4095, int(os.getenv("HAPROXY_GROUP_SIZE", "4000")))
+TIER_WEIGHT_MAX = 256
+NEW_SERVER_STATE = os.getenv("NEW_SERVER_STATE", "drain")
+# balance algorithm inside each backend group, the tier in front of the groups always uses leastconn
+HAPROXY_BALANCE = os.getenv("HAPROXY_BALANCE", "leastconn")
+RESYNC_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "10"))
+DEBOUNCE = float(os.getenv("RECONCILE_DEBOUNCE", "0.5"))
+STATUS_PORT = int(os.getenv("RECONCILER_STATUS_PORT", "8001"))
+
+BACKEND = "tors"
+TIER_BACKEND = "tors-tier"
+SLOT_PREFIX = "tor"
+# free slots park on a placeholder address in maintenance until a container claims them
+SLOT_ADDRESS = "127.0.0.1"
+TOR_SOCKS_PORT = 9050
+SLOT_ENDPOINT = f"{SLOT_ADDRESS}:{TOR_SOCKS_PORT}"
+ADMIN_FORCED_MAINT = 0x01
+ADMIN_FORCED_DRAIN = 0x08
+SERVER_RUNNING = 2
+
+if platform.system() == "Darwin":
+    OUTFILE = "haproxy-valid.cfg"
+else:
+    OUTFILE = '/usr/local/etc/haproxy/haproxy.cfg'
+
+def get_docker_client():
     if platform.system() == "Darwin":
-        client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-    else:
-        client = docker.DockerClient(base_url='unix://tmp/docker.sock')
+        return docker.DockerClient(base_url='unix://var/run/docker.sock')
+    return docker.DockerClient(base_url='unix://tmp/docker.sock')
+
+def natural_key(name: str) -> List:
+    """orders multisocks-tor-2 before multisocks-tor-10 without assuming any naming scheme"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+def socks_ports(container) -> List[int]:
+    """the socksports a tor container opens per its TOR_SOCKS_PORTS, 9050 then 9052 upwards as tor/entrypoint.sh lays them out"""
+    env = dict(item.split("=", 1) for item in container.attrs.get("Config", {}).get("Env") or [] if "=" in item)
+    count = max(1, int(env.get("TOR_SOCKS_PORTS", "1") or 1))
+    return [TOR_SOCKS_PORT] + [TOR_SOCKS_PORT + 1 + i for i in range(1, count)]
+
+def get_dockernet_hosts(client) -> List[Tuple[str, str]]:
+    """(container name, address:socksport) for every socksport of every tor container, naturally sorted by name"""
     network = client.networks.get("net_tor")
     net_tor_id = network.attrs["Id"]
-    containers = client.containers.list()
-    container_names = [
-        container.attrs['Name'][1:]
-        for container in containers
-        if ("net_tor" in container.attrs["NetworkSettings"]["Networks"])
-        and (container.attrs["NetworkSettings"]["Networks"]["net_tor"]["NetworkID"] == net_tor_id)
-        and (container.attrs["Config"]["User"] == "tor")
-    ]
-    sorted_container_names = sorted(container_names, key=lambda x: int(x.split('-')[-1]))
-    return sorted_container_names
+    endpoints = []
+    for container in client.containers.list():
+        net_tor = container.attrs["NetworkSettings"]["Networks"].get("net_tor")
+        if net_tor and net_tor["NetworkID"] == net_tor_id and net_tor["IPAddress"] and container.attrs["Config"]["User"] == "tor":
+            for port in socks_ports(container):
+                endpoints.append((container.attrs['Name'][1:], f"{net_tor['IPAddress']}:{port}"))
+    return sorted(endpoints, key=lambda endpoint: (natural_key(endpoint[0]), int(endpoint[1].rsplit(':', 1)[1])))
 
-if __name__ == "__main__":
-    cihosts = get_dockernet_hostnames()
+def group_name(group: int) -> str:
+    """the first group keeps the original backend name so a single-group config is unchanged"""
+    return BACKEND if group == 0 else f"{BACKEND}{group + 1}"
+
+def group_of(index: int) -> str:
+    return group_name((index - 1) // GROUP_SIZE)
+
+def slot_groups(assigned: Dict[int, str], slots: int) -> List[Dict]:
+    """per backend group, assigned slots as fixed servers and runs of free slots collapsed into server-template ranges"""
+    groups = []
+    for first in range(1, slots + 1, GROUP_SIZE):
+        blocks = []
+        for index in range(first, min(first + GROUP_SIZE, slots + 1)):
+            if index in assigned:
+                blocks.append({"index": index, "address": assigned[index]})
+            elif blocks and "last" in blocks[-1] and blocks[-1]["last"] == index - 1:
+                blocks[-1]["last"] = index
+            else:
+                blocks.append({"first": index, "last": index})
+        groups.append({"name": group_of(first), "blocks": blocks})
+    return groups
+
+def render(assigned: Dict[int, str], slots: int) -> str:
     with open("haproxy.j2", "r") as file:
-        conf = Template(file.read()).render(tor_hosts=cihosts)
-    if platform.system() == "Darwin":
-        outfile = "haproxy-valid.cfg"
-    else:
-        outfile = '/usr/local/etc/haproxy/haproxy.cfg'
-    with open(outfile, "w") as file:
-        file.write(conf)
+        return Template(file.read()).render(groups=slot_groups(assigned, slots), tier=TIER_BACKEND, slot_address=SLOT_ADDRESS, balance=HAPROXY_BALANCE, admin_bind=HAPROXY_ADMIN_BIND)
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+# the same client as metrics/app/haruntime.py, each image carries its own copy
+class HAProxyRuntime:
+    """a client for the haproxy runtime api (stats socket), one short connection per batch of commands"""
+
+    def __init__(self, address: str = HAPROXY_RUNTIME, timeout: float = 5):
+        host, _, port = address.rpartition(':')
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+
+    def execute(self, commands: Iterable[str]) -> str:
+        """run commands in one non-interactive session and return haproxy's combined output"""
+        payload = ";".join(commands)
+        if not payload:
+            return ""
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+            conn.sendall(payload.encode() + b"\n")
+            chunks = []
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks).decode(errors="replace")
+
+    def servers(self) -> List[Dict]:
+        """every server haproxy knows about, parsed from show servers state"""
+        output = self.execute(["show servers state"])
+        servers = []
+        columns = None
+        for line in output.splitlines():
+            if line.startswith("# be_id"):
+                columns = line[2:].split()
+                continue
+            values = line.split()
+            # skips the leading format version line and anything that isn't a full server row
+            if columns is None or len(values) < len(columns):
+                continue
+            row = dict(zip(columns, values))
+            servers.append({
+                "backend": row.get("be_name"),
+                "name": row.get("srv_name"),
+                "address": row.get("srv_addr"),
+                "port": int(row.get("srv_port", 0) or 0),
+                "op_state": int(row.get("srv_op_state", 0)),
+                "admin_state": int(row.get("srv_admin_state", 0)),
+                "weight": int(row.get("srv_uweight", 0))
+            })
+        return servers
+
+class Reconciler:
+    """keeps haproxy's tor server slots matched to the running containers through the runtime api"""
+
+    def __init__(self, client, runtime: HAProxyRuntime):
+        self.client = client
+        self.runtime = runtime
+        self.slots = HAPROXY_SLOTS
+        self.assigned: Dict[int, str] = {}
+        self.changed = threading.Event()
+        self.lock = threading.Lock()
+        self.pending_since: Optional[float] = None
+        self.latencies = deque(maxlen=256)
+        self.reconciles = 0
+        self.moves = 0
+        self.reloads = 0
+        self.unplaced = 0
+        self.hosts = 0
+        self.servers = 0
+        self.last_reconcile: Optional[float] = None
+        self.groups: List[Dict] = []
+        self.last_error: Optional[str] = None
+
+    def current_slots(self) -> Dict[int, Tuple[str, int, int]]:
+        """slot number -> (address:port, admin state, operational state) across every tor backend group"""
+        slots = {}
+        for server in self.runtime.servers():
+            match = re.fullmatch(SLOT_PREFIX + r"(\d+)", server["name"] or "")
+            if match and re.fullmatch(BACKEND + r"\d*", server["backend"] or ""):
+                slots[int(match.group(1))] = (f"{server['address']}:{server['port']}", server["admin_state"], server["op_state"])
+        return slots
+
+    def bootstrap(self):
+        """adopt the running slot layout, or render one with every current container pinned and spare slots free"""
+        try:
+            # a restarted reconciler adopts whatever haproxy is already running with
+            current = self.current_slots()
+            self.assigned = {index: address for index, (address, _, _) in current.items() if address != SLOT_ENDPOINT}
+            self.slots = max(HAPROXY_SLOTS, max(current, default=0))
+            logging.info(f"adopted {len(self.assigned)} assigned slots of {self.slots} from haproxy")
+            return
+        except OSError:
+            pass
+        hosts = get_dockernet_hosts(self.client)
+        self.slots = max(HAPROXY_SLOTS, len(hosts))
+        self.assigned = {index: address for index, (_, address) in enumerate(hosts, start=1)}
+        self.write_config(reload=True)
+        logging.info(f"rendered {len(hosts)} tor socksports into {self.slots} slots")
+
+    def write_config(self, reload: bool = False):
+        """persist the current assignment so a restart comes back as-is, reloading haproxy only if asked"""
+        conf = render(self.assigned, self.slots)
+        if os.path.exists(OUTFILE):
+            with open(OUTFILE) as file:
+                if file.read() == conf:
+                    return
+        with open(OUTFILE, "w") as file:
+            file.write(conf)
+        if reload:
+            self.reload_haproxy()
+
+    def reload_haproxy(self):
+        # the haproxy image runs in master-worker mode, old workers finish their connections after SIGUSR2
+        containers = self.client.containers.list(filters={"label": f"com.docker.compose.service={HAPROXY_SERVICE}"})
+        for container in containers:
+            container.kill(signal="SIGUSR2")
+            self.reloads += 1
+            logging.info(f"reloaded {container.name}")
+
+    def watch(self):
+        backoff = 1
+        while True:
+            try:
+                for event in self.client.events(decode=True, filters={"type": ["container", "network"]}):
+                    backoff = 1
+                    if event.get("Type") == "container" and event.get("Action") not in ("start", "die", "destroy"):
+                        continue
+                    with self.lock:
+                        if self.pending_since is None:
+                            self.pending_since = event.get("timeNano", time.time_ns()) / 1e9
+                    self.changed.set()
+            except Exception as e:
+                logging.warning(f"docker events stream failed, retrying in {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def run(self):
+        while True:
+            try:
+                self.reconcile()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logging.warning(f"reconcile failed: {e}")
+            if self.changed.wait(RESYNC_INTERVAL):
+                time.sleep(DEBOUNCE)
+            self.changed.clear()
+
+    def reconcile(self):
+        with self.lock:
+            pending_since = self.pending_since
+            self.pending_since = None
+        started = time.time()
+        try:
+            hosts = get_dockernet_hosts(self.client)
+            desired = {address: name for name, address in hosts}
+            current = self.current_slots()
+        except Exception:
+            with self.lock:
+                if pending_since is not None and (self.pending_since is None or pending_since < self.pending_since):
+                    self.pending_since = pending_since
+            raise
+        commands = []
+        placed = {}
+        free = []
+        for index, (address, admin_state, _) in sorted(current.items()):
+            if address in desired and address not in placed.values():
+                placed[index] = address
+            elif address == SLOT_ENDPOINT and admin_state & ADMIN_FORCED_MAINT:
+                free.append(index)
+            else:
+                # a container that went away, or a duplicate - park the slot
+                server = f"{group_of(index)}/{SLOT_PREFIX}{index}"
+                commands += [f"set server {server} state maint", f"set server {server} addr {SLOT_ADDRESS} port {TOR_SOCKS_PORT}"]
+                free.append(index)
+                logging.info(f"released {SLOT_PREFIX}{index} ({address})")
+        missing = [address for _, address in hosts if address not in placed.values()]
+        if len(missing) > len(free):
+            # out of slots - regrow the template with everything pinned and let haproxy reload gracefully
+            grown = max(self.slots * 2, len(hosts))
+            spare = free + list(range(self.slots + 1, grown + 1))
+            self.slots = grown
+            self.assigned = {**placed, **dict(zip(spare, missing))}
+            logging.warning(f"{len(missing)} new tor socksports but only {len(free)} free slots, growing to {self.slots}")
+            self.write_config(reload=True)
+        else:
+            for index, address in zip(free, missing):
+                server = f"{group_of(index)}/{SLOT_PREFIX}{index}"
+                ip, port = address.rsplit(':', 1)
+                commands += [f"set server {server} addr {ip} port {port}", f"set server {server} state ready"]
+                # new instances wait in drain until the metrics service sees a built circuit on them
+                if NEW_SERVER_STATE == "drain":
+                    commands.append(f"set server {server} state drain")
+                placed[index] = address
+                logging.info(f"assigned {desired[address]} ({address}) to {SLOT_PREFIX}{index}")
+            commands += self.balance_groups(current, placed)
+            output = self.runtime.execute(commands)
+            if output.strip():
+                logging.warning(f"runtime api: {output.strip()}")
+            self.assigned = placed
+            self.write_config()
+        finished = time.time()
+        self.moves += len(missing)
+        self.unplaced = max(0, len(missing) - len(free))
+        self.hosts = len({name for name, _ in hosts})
+        self.servers = len(hosts)
+        self.reconciles += 1
+        self.last_reconcile = finished
+        if pending_since is not None:
+            self.latencies.append(finished - pending_since)
+            if commands:
+                logging.info(f"reconciled {len(hosts)} tor socksports in {(finished - pending_since) * 1000:.0f}ms from the docker event ({(finished - started) * 1000:.0f}ms applying)")
+
+    def balance_groups(self, current: Dict[int, Tuple[str, int, int]], placed: Dict[int, str]) -> List[str]:
+        """aggregate each backend group and weight it on the tier by its serving servers"""
+        groups = {}
+        for index in range(1, self.slots + 1, GROUP_SIZE):
+            groups[group_of(index)] = {"name": group_of(index), "slots": min(GROUP_SIZE, self.slots - index + 1), "assigned": 0, "up": 0, "serving": 0}
+        for index in placed:
+            group = groups[group_of(index)]
+            group["assigned"] += 1
+            _, admin_state, op_state = current.get(index, (None, ADMIN_FORCED_MAINT, 0))
+            if op_state == SERVER_RUNNING:
+                group["up"] += 1
+                if not admin_state & (ADMIN_FORCED_MAINT | ADMIN_FORCED_DRAIN):
+                    group["serving"] += 1
+        most = max((group["serving"] for group in groups.values()), default=0)
+        commands = []
+        for name, group in groups.items():
+            # groups with nothing serving drop out of the tier, unless none are serving and it has to try somewhere
+            group["weight"] = round(TIER_WEIGHT_MAX * group["serving"] / most) if most else 1
+            if len(groups) > 1:
+                commands.append(f"set server {TIER_BACKEND}/{name} weight {group['weight']}")
+        self.groups = list(groups.values())
+        return commands
+
+    def report(self) -> Dict:
+        latencies = list(self.latencies)
+        return {
+            "slots": self.slots,
+            "groups": self.groups,
+            "assigned": len(self.assigned),
+            "hosts": self.hosts,
+            "servers": self.servers,
+            "unplaced": self.unplaced,
+            "reconciles": self.reconciles,
+            "moves": self.moves,
+            "reloads": self.reloads,
+            "lastReconcile": self.last_reconcile,
+            "latency": {
+                "last": latencies[-1] if latencies else None,
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "max": max(latencies, default=None)
+            },
+            "error": self.last_error
+        }
+
+def serve_status(reconciler: Reconciler):
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(reconciler.report()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("0.0.0.0", STATUS_PORT), StatusHandler).serve_forever()
+
+if __name__ == "__main__":
+    client = get_docker_client()
+    if "--once" in sys.argv:
+        hosts = get_dockernet_hosts(client)
+        with open(OUTFILE, "w") as file:
+            file.write(render({index: address for index, (_, address) in enumerate(hosts, start=1)}, max(HAPROXY_SLOTS, len(hosts))))
+        sys.exit(0)
+    reconciler = Reconciler(client, HAProxyRuntime())
+    reconciler.bootstrap()
+    threading.Thread(target=reconciler.watch, name="docker-events", daemon=True).start()
+    threading.Thread(target=serve_status, args=(reconciler,), name="status", daemon=True).start()
+    reconciler.run()
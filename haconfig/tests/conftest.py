@@ -0,0 +1,5 @@
+import os
+import sys
+
+# gen_conf is a single script, imported the way the image runs it from haconfig/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,137 @@
+import ast
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import gen_conf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def definition(path, name):
+    """the ast of a top-level function or class, so copies can be compared without importing other images"""
+    with open(os.path.join(ROOT, path)) as file:
+        tree = ast.parse(file.read())
+    return next(ast.dump(node) for node in tree.body if getattr(node, "name", None) == name)
+
+@pytest.mark.parametrize("name, paths", [
+    ("socks_ports", ("haconfig/gen_conf.py", "metrics/app/registry.py", "socksrouter/router.py")),
+    ("percentile", ("haconfig/gen_conf.py", "metrics/app/hastats.py")),
+    ("HAProxyRuntime", ("haconfig/gen_conf.py", "metrics/app/haruntime.py")),
+])
+def test_images_share_one_copy_of_each_helper(name, paths):
+    # each image builds from its own directory, so each carries a copy - they have to stay the same one
+    assert len({definition(path, name) for path in paths}) == 1
+
+def container(env=None):
+    return SimpleNamespace(attrs={"Config": {"Env": env}})
+
+def test_socks_ports_follow_the_entrypoint_layout():
+    assert gen_conf.socks_ports(container()) == [9050]
+    assert gen_conf.socks_ports(container(["TOR_SOCKS_PORTS=3", "PATH=/bin"])) == [9050, 9052, 9053]
+    assert gen_conf.socks_ports(container(["TOR_SOCKS_PORTS="])) == [9050]
+    assert gen_conf.socks_ports(SimpleNamespace(attrs={})) == [9050]
+
+STATE_HEADER = "1\n# be_id be_name srv_id srv_name srv_addr srv_op_state srv_admin_state srv_uweight srv_iweight srv_time_since_last_change srv_check_status srv_check_result srv_check_health srv_check_state srv_agent_state bk_f_forced_id srv_f_forced_id srv_fqdn srv_port srvrecord"
+
+class FakeRuntime(gen_conf.HAProxyRuntime):
+    """haproxy's slots as show servers state reports them, updated by the set server commands sent to it"""
+
+    def __init__(self, slots, backends=("tors",)):
+        super().__init__("haproxy:9999")
+        # slot -> [addr, port, op state, admin state]
+        self.state = {index: list(slot) for index, slot in slots.items()}
+        self.backends = backends
+        self.sent = []
+
+    def execute(self, commands):
+        commands = list(commands)
+        if commands == ["show servers state"]:
+            rows = [f"1 {gen_conf.group_of(index)} {index} tor{index} {addr} {op} {admin} 1 1 0 6 3 4 6 0 0 0 - {port} -"
+                    for index, (addr, port, op, admin) in sorted(self.state.items())]
+            rows.append("2 stats 1 FRONTEND 0.0.0.0 2 0 1 1 0 6 3 4 6 0 0 0 - 0 -")
+            return "\n".join([STATE_HEADER] + rows) + "\n"
+        self.sent.extend(commands)
+        for command in commands:
+            words = command.split()
+            index = int(words[2].split("/tor")[1])
+            if words[3] == "addr":
+                self.state[index][0:2] = [words[4], int(words[6])]
+            elif words[4] == "maint":
+                self.state[index][3] = gen_conf.ADMIN_FORCED_MAINT
+            elif words[4] == "ready":
+                self.state[index][3] = 0
+        return ""
+
+class FakeDocker:
+    def __init__(self, tor_containers):
+        self.networks = SimpleNamespace(get=lambda name: SimpleNamespace(attrs={"Id": "net"}))
+        self.tors = tor_containers
+        self.killed = []
+        self.containers = SimpleNamespace(list=self.list)
+
+    def list(self, filters=None):
+        if filters:
+            return [SimpleNamespace(name="haproxy", kill=lambda signal: self.killed.append(signal))]
+        return [SimpleNamespace(attrs={
+            "Name": f"/{name}",
+            "Config": {"User": "tor", "Env": [f"TOR_SOCKS_PORTS={ports}"]},
+            "NetworkSettings": {"Networks": {"net_tor": {"NetworkID": "net", "IPAddress": address}}}
+        }) for name, address, ports in self.tors]
+
+PARKED = ("127.0.0.1", 9050, 0, gen_conf.ADMIN_FORCED_MAINT)
+
+@pytest.fixture
+def reconciler_for(tmp_path, monkeypatch):
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    monkeypatch.setattr(gen_conf, "OUTFILE", str(tmp_path / "haproxy.cfg"))
+    monkeypatch.setattr(gen_conf, "HAPROXY_SLOTS", 4)
+
+    def build(tors, slots):
+        reconciler = gen_conf.Reconciler(FakeDocker(tors), FakeRuntime(slots))
+        reconciler.slots = len(slots)
+        return reconciler
+
+    return build
+
+def test_runtime_servers_and_slots_parse_show_servers_state():
+    reconciler = gen_conf.Reconciler(None, FakeRuntime({1: ("10.0.0.2", 9050, 2, 0), 2: PARKED}))
+    servers = reconciler.runtime.servers()
+    assert servers[0] == {"backend": "tors", "name": "tor1", "address": "10.0.0.2", "port": 9050, "op_state": 2, "admin_state": 0, "weight": 1}
+    assert reconciler.current_slots() == {1: ("10.0.0.2:9050", 0, 2), 2: ("127.0.0.1:9050", gen_conf.ADMIN_FORCED_MAINT, 0)}
+
+def test_reconcile_parks_departed_hosts_and_fills_free_slots(reconciler_for, monkeypatch):
+    monkeypatch.setattr(gen_conf, "NEW_SERVER_STATE", "drain")
+    reconciler = reconciler_for(
+        [("multisocks-tor-1", "10.0.0.2", 1), ("multisocks-tor-3", "10.0.0.4", 2)],
+        {1: ("10.0.0.2", 9050, 2, 0), 2: ("10.0.0.3", 9050, 0, 0), 3: PARKED, 4: ("10.0.0.2", 9050, 2, 0)})
+    reconciler.reconcile()
+    runtime = reconciler.runtime
+    # the departed host and the duplicate are parked, the new host's two socksports take the lowest free slots
+    assert "set server tors/tor2 state maint" in runtime.sent and "set server tors/tor4 state maint" in runtime.sent
+    assert reconciler.assigned == {1: "10.0.0.2:9050", 2: "10.0.0.4:9050", 3: "10.0.0.4:9052"}
+    assert runtime.sent[-3:] == ["set server tors/tor3 addr 10.0.0.4 port 9052", "set server tors/tor3 state ready", "set server tors/tor3 state drain"]
+    assert reconciler.moves == 2 and reconciler.unplaced == 0 and reconciler.hosts == 2 and reconciler.servers == 3
+    # settled, a second pass changes nothing
+    runtime.sent.clear()
+    reconciler.reconcile()
+    assert runtime.sent == []
+
+def test_reconcile_grows_the_template_when_slots_run_out(reconciler_for):
+    reconciler = reconciler_for([(f"multisocks-tor-{n}", f"10.0.0.{n + 1}", 1) for n in range(1, 4)],
+                                {1: ("10.0.0.2", 9050, 2, 0), 2: PARKED})
+    reconciler.reconcile()
+    assert reconciler.slots == 4 and reconciler.client.killed == ["SIGUSR2"]
+    assert reconciler.assigned == {1: "10.0.0.2:9050", 2: "10.0.0.3:9050", 3: "10.0.0.4:9050"}
+    with open(gen_conf.OUTFILE) as file:
+        config = file.read()
+    assert "10.0.0.4:9050" in config and reconciler.runtime.sent == []
+
+def test_groups_are_weighted_by_serving_servers(monkeypatch):
+    monkeypatch.setattr(gen_conf, "GROUP_SIZE", 2)
+    reconciler = gen_conf.Reconciler(None, None)
+    reconciler.slots = 4
+    current = {1: ("a", 0, 2), 2: ("b", 0, 2), 3: ("c", gen_conf.ADMIN_FORCED_DRAIN, 2), 4: ("d", 0, 2)}
+    commands = reconciler.balance_groups(current, {1: "a", 2: "b", 3: "c", 4: "d"})
+    assert commands == ["set server tors-tier/tors weight 256", "set server tors-tier/tors2 weight 128"]
+    assert [(group["name"], group["up"], group["serving"]) for group in reconciler.groups] == [("tors", 2, 2), ("tors2", 2, 1)]
@@ -0,0 +1,37 @@
+from typing import Dict, Optional
+
+from controlpool import ControllerPool, HostSession
+from hastats import percentile
+from registry import ContainerRegistry
+
+def time_to_first_circuit(host: Dict, session: Optional[HostSession]) -> Optional[float]:
+    """seconds from the container starting to tor's first built circuit, None until both are known"""
+    if session is None or session.first_built_at is None or host.get('started_at') is None:
+        return None
+    elapsed = session.first_built_at - host['started_at']
+    # circuits older than the container belong to a session that outlived a restart
+    return round(elapsed, 2) if elapsed >= 0 else None
+
+def bootstrap_report(registry: ContainerRegistry, pool: ControllerPool) -> Dict:
+    hosts = []
+    for host in registry.hosts():
+        session = pool.sessions.get(host['id'])
+        hosts.append({
+            "id": host['id'],
+            "hostname": host['hostname'],
+            "startedAt": host.get('started_at'),
+            "firstBuiltAt": session.first_built_at if session else None,
+            "waiting": bool(session and session.awaiting_first_built),
+            "timeToFirstCircuit": time_to_first_circuit(host, session)
+        })
+    measured = [host['timeToFirstCircuit'] for host in hosts if host['timeToFirstCircuit'] is not None]
+    return {
+        "fleet": {
+            "measured": len(measured),
+            "waiting": sum(1 for host in hosts if host['waiting']),
+            "p50": percentile(measured, 0.5),
+            "p95": percentile(measured, 0.95),
+            "max": max(measured, default=None)
+        },
+        "hosts": hosts
+    }
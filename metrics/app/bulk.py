@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from controlpool import ControllerPool
+from health import session_ready
+from registry import ContainerRegistry
+
+logger = logging.getLogger(__name__)
+
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "16"))
+BULK_MAX_FRACTION = float(os.getenv("BULK_MAX_FRACTION", "0.1"))
+BULK_STAGGER = float(os.getenv("BULK_STAGGER", "0.5"))
+BULK_SETTLE_TIMEOUT = float(os.getenv("BULK_SETTLE_TIMEOUT", "60"))
+BULK_MAX_JOBS = int(os.getenv("BULK_MAX_JOBS", "20"))
+
+OPERATIONS = ("rebuild", "newnym", "close")
+
+class BulkJob:
+    def __init__(self, operation: str, hosts: List[Dict], concurrency: int, stagger: float, settle: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.operation = operation
+        self.hosts = hosts
+        self.concurrency = concurrency
+        self.stagger = stagger
+        self.settle = settle
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.results: Dict[str, Dict] = {host['id']: {"hostname": host['hostname'], "status": "pending"} for host in hosts}
+
+    def progress(self) -> Dict:
+        counts: Dict[str, int] = {}
+        for result in self.results.values():
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        return {
+            "id": self.id,
+            "operation": self.operation,
+            "concurrency": self.concurrency,
+            "stagger": self.stagger,
+            "created": self.created,
+            "finished": self.finished,
+            "total": len(self.hosts),
+            "counts": counts
+        }
+
+    def report(self) -> Dict:
+        return {**self.progress(), "hosts": self.results}
+
+class BulkEngine:
+    """runs rebuild/newnym/close across the fleet a few hosts at a time, so most capacity keeps serving"""
+
+    def __init__(self, registry: ContainerRegistry, pool: ControllerPool, notify: Optional[Callable[[Dict], Awaitable]] = None):
+        self.registry = registry
+        self.pool = pool
+        self.notify = notify
+        self.jobs: "OrderedDict[str, BulkJob]" = OrderedDict()
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, operation: str, hosts: Optional[List[str]] = None, concurrency: Optional[int] = None,
+               fraction: float = BULK_MAX_FRACTION, stagger: float = BULK_STAGGER) -> BulkJob:
+        if operation not in OPERATIONS:
+            raise ValueError(f"unknown operation {operation}, expected one of {', '.join(OPERATIONS)}")
+        tor_hosts = [self.registry.get(key) for key in hosts] if hosts else self.registry.hosts()
+        tor_hosts = [host for host in tor_hosts if host]
+        if not tor_hosts:
+            raise ValueError("no tor hosts to operate on")
+        # a host counts against the budget until it has a built circuit again, not just until the command returns
+        budget = max(1, math.floor(len(tor_hosts) * fraction))
+        job = BulkJob(operation, tor_hosts, min(concurrency or BULK_CONCURRENCY, budget), stagger, settle=operation != "newnym")
+        self.jobs[job.id] = job
+        while len(self.jobs) > BULK_MAX_JOBS:
+            self.jobs.popitem(last=False)
+        self.tasks[job.id] = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: BulkJob):
+        semaphore = asyncio.Semaphore(job.concurrency)
+        started = time.monotonic()
+
+        async def run_host(i: int, host: Dict):
+            # stagger the starts so even the first wave doesn't hit every controlport in the same instant
+            await asyncio.sleep(i * job.stagger if i < job.concurrency else 0)
+            async with semaphore:
+                await self._apply(job, host)
+                await asyncio.sleep(job.stagger)
+
+        try:
+            await asyncio.gather(*(run_host(i, host) for i, host in enumerate(job.hosts)))
+        finally:
+            job.finished = time.time()
+            self.tasks.pop(job.id, None)
+            logger.info(f"bulk {job.operation} {job.id} finished {len(job.hosts)} hosts in {time.monotonic() - started:.1f}s")
+            await self._publish("bulk_complete", job)
+
+    async def _apply(self, job: BulkJob, host: Dict):
+        result = job.results[host['id']]
+        result.update(status="running", started=time.time())
+        await self._publish("bulk_progress", job, host['id'])
+        started = time.monotonic()
+        try:
+            result.update(await asyncio.to_thread(self._execute, job.operation, host))
+            result["commandMs"] = round((time.monotonic() - started) * 1000, 1)
+            if job.settle:
+                result["status"] = "settling"
+                await self._publish("bulk_progress", job, host['id'])
+                settled = await self._settle(host)
+                result["settleMs"] = round((time.monotonic() - started) * 1000, 1)
+                result["status"] = "done" if settled else "unsettled"
+            else:
+                result["status"] = "done"
+        except Exception as e:
+            logger.warning(f"bulk {job.operation} failed on {host['hostname']}: {e}")
+            result.update(status="failed", error=str(e))
+        result["finished"] = time.time()
+        await self._publish("bulk_progress", job, host['id'])
+
+    def _execute(self, operation: str, host: Dict) -> Dict:
+        session = self.pool.session(host)
+        controller = session.connect()
+        closed = 0
+        if operation in ("rebuild", "close"):
+            for circ in session.built_circuits():
+                try:
+                    controller.close_circuit(circ.id)
+                    closed += 1
+                except Exception as e:
+                    logger.warning(f"could not close circuit {circ.id} on {host['hostname']}: {e}")
+        if operation in ("rebuild", "newnym"):
+            controller.signal("NEWNYM")
+        return {"closed": closed}
+
+    async def _settle(self, host: Dict) -> bool:
+        """wait for the host to have a built circuit again"""
+        deadline = time.monotonic() + BULK_SETTLE_TIMEOUT
+        while time.monotonic() < deadline:
+            # the close events land asynchronously, so look only after they've had a moment
+            await asyncio.sleep(0.5)
+            if session_ready(self.pool.sessions.get(host['id'])):
+                return True
+        return False
+
+    async def _publish(self, kind: str, job: BulkJob, host_id: Optional[str] = None):
+        if self.notify is None:
+            return
+        message = {"type": kind, "job": job.progress(), "timestamp": datetime.now().isoformat()}
+        if host_id is not None:
+            message["host"] = {"id": host_id, **job.results[host_id]}
+        try:
+            await self.notify(message)
+        except Exception as e:
+            logger.warning(f"could not publish bulk progress: {e}")
+
+    async def stop(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
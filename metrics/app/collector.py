@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+COLLECT_CONCURRENCY = int(os.getenv("COLLECT_CONCURRENCY", "32"))
+COLLECT_HOST_TIMEOUT = float(os.getenv("COLLECT_HOST_TIMEOUT", "10"))
+
+class CircuitCollector:
+    """fan out a blocking per-host fetch across all tor hosts with a concurrency limit and per-host deadline"""
+
+    def __init__(self, fetch: Callable[[Dict], Dict], concurrency: int = COLLECT_CONCURRENCY, host_timeout: float = COLLECT_HOST_TIMEOUT):
+        self.fetch = fetch
+        self.concurrency = max(1, concurrency)
+        self.host_timeout = host_timeout
+        # twice the limit so a few wedged controlports don't starve the pool while they time out
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix="collector")
+        self.semaphore = None
+        self.last_good: Dict[str, Dict] = {}
+        self.inflight = set()
+
+    async def collect_host(self, host: Dict) -> Dict[str, Any]:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        host_id = host['id']
+        if host_id in self.inflight:
+            telemetry.count("host_collections", "busy")
+            return self._fallback(host, "previous collection still running", 0.0)
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            started = time.monotonic()
+            self.inflight.add(host_id)
+            future = loop.run_in_executor(self.executor, self.fetch, host)
+            future.add_done_callback(lambda _: self.inflight.discard(host_id))
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.host_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"collection for {host['hostname']} exceeded {self.host_timeout}s deadline")
+                telemetry.count("host_collections", "timeout")
+                return self._fallback(host, f"timed out after {self.host_timeout}s", time.monotonic() - started)
+            except Exception as e:
+                logger.warning(f"collection for {host['hostname']} failed: {e}")
+                telemetry.count("host_collections", "error")
+                return self._fallback(host, str(e), time.monotonic() - started)
+        duration = time.monotonic() - started
+        telemetry.observe("host_collect", duration)
+        if 'error' in result:
+            telemetry.count("host_collections", "error")
+            return self._fallback(host, result['error'], duration)
+        entry = {
+            **host,
+            "external_ip": result.get('external_ip'),
+            "circuits": result.get('circuits', []),
+            "latency": result.get('latency'),
+            "stale": False,
+            "lastCollected": datetime.now().isoformat(),
+            "collectDuration": round(duration * 1000, 1)
+        }
+        self.last_good[host_id] = entry
+        telemetry.count("host_collections", "ok")
+        return entry
+
+    def _fallback(self, host: Dict, error: str, duration: float) -> Dict[str, Any]:
+        """serve the last good result for a host, marked stale, alongside the error"""
+        previous = self.last_good.get(host['id'])
+        return {
+            **host,
+            "external_ip": previous.get('external_ip') if previous else None,
+            "circuits": previous['circuits'] if previous else [],
+            "latency": previous.get('latency') if previous else None,
+            "error": error,
+            "stale": True,
+            "lastCollected": previous['lastCollected'] if previous else None,
+            "collectDuration": round(duration * 1000, 1)
+        }
+
+    async def collect(self, hosts: List[Dict]) -> List[Dict[str, Any]]:
+        live = {host['id'] for host in hosts}
+        for host_id in list(self.last_good):
+            if host_id not in live:
+                del self.last_good[host_id]
+        return list(await asyncio.gather(*(self.collect_host(host) for host in hosts)))
@@ -0,0 +1,203 @@
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+from typing import Callable, Dict, List, Optional, Set
+
+from stem import CircStatus, StreamStatus
+from stem.control import Controller, EventType, Listener, State
+
+from latency import HostLatency, LatencySet
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+CONTROL_PORT = 9051
+CONTROL_PASSWORD = os.getenv("TOR_CONTROL_PASSWORD", "log4j2.enableJndiLookup")
+RECONNECT_BACKOFF_MAX = 30
+
+class HostSession:
+    """a long-lived controlport session for one tor instance with an event-maintained circuit table"""
+
+    def __init__(self, host_id: str, address: str, fleet_latency: Optional[LatencySet] = None):
+        self.host_id = host_id
+        self.address = address
+        self.lock = threading.RLock()
+        self.controller: Optional[Controller] = None
+        self.circuits: Dict[str, object] = {}
+        self.streams: Dict[str, str] = {}
+        self.socks_ports: Set[int] = set()
+        self.first_built_at: Optional[float] = None
+        self.awaiting_first_built = False
+        self.listeners: List[Callable] = []
+        self.latency = HostLatency(fleet_latency)
+        self.connected_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.backoff = 1
+        self.next_attempt = 0.0
+
+    def connect(self) -> Controller:
+        half_open = None
+        try:
+            with self.lock:
+                if self.controller is not None and self.controller.is_alive():
+                    return self.controller
+                if time.monotonic() < self.next_attempt:
+                    telemetry.count("controlport_connects", "backoff")
+                    raise ConnectionError(f"controlport {self.address}:{CONTROL_PORT} unavailable: {self.last_error}")
+                started = time.perf_counter()
+                controller = None
+                try:
+                    controller = Controller.from_port(address=self.address, port=CONTROL_PORT)
+                    controller.authenticate(password=CONTROL_PASSWORD)
+                    controller.add_status_listener(self._on_status)
+                    controller.add_event_listener(self._on_circ, EventType.CIRC)
+                    controller.add_event_listener(self._on_stream, EventType.STREAM)
+                    circuits = {circ.id: circ for circ in controller.get_circuits() if circ.status not in (CircStatus.CLOSED, CircStatus.FAILED)}
+                    streams = {stream.id: stream.circ_id for stream in controller.get_streams() if stream.circ_id}
+                    socks_ports = {port for _, port in controller.get_listeners(Listener.SOCKS)}
+                except Exception as e:
+                    telemetry.count("controlport_connects", "failed")
+                    half_open = controller
+                    self.last_error = str(e)
+                    self.next_attempt = time.monotonic() + self.backoff
+                    self.backoff = min(self.backoff * 2, RECONNECT_BACKOFF_MAX)
+                    raise
+                telemetry.observe("controlport_connect", time.perf_counter() - started)
+                telemetry.count("controlport_connects", "ok")
+                self.controller = controller
+                self.latency.reset()
+                self.circuits = circuits
+                self.streams = streams
+                self.socks_ports = socks_ports
+                # a session opened after tor already built circuits can only go by their creation times, if tor reports them
+                built = [circ for circ in circuits.values() if circ.status == CircStatus.BUILT]
+                self.awaiting_first_built = not built
+                self.first_built_at = min((circ.created.replace(tzinfo=timezone.utc).timestamp() for circ in built if circ.created), default=None)
+                self.connected_at = time.time()
+                self.last_error = None
+                self.backoff = 1
+                self.next_attempt = 0.0
+                logger.info(f"controlport session opened for {self.address} with {len(circuits)} circuits")
+                self._notify()
+                return controller
+        finally:
+            # a connect that failed after the socket opened still has stem's threads running, closed outside the lock like close()
+            if half_open is not None:
+                try:
+                    half_open.close()
+                except Exception:
+                    pass
+
+    def close(self):
+        with self.lock:
+            controller = self.controller
+            self.controller = None
+            self.circuits = {}
+            self.streams = {}
+        # closed outside the lock, stem joins its event thread which may be waiting on it
+        if controller is not None:
+            try:
+                controller.close()
+            except Exception:
+                pass
+
+    def _on_status(self, controller, state, timestamp):
+        if state == State.CLOSED:
+            with self.lock:
+                if controller is self.controller:
+                    logger.warning(f"controlport session for {self.address} closed")
+                    self.controller = None
+                    self.circuits = {}
+                    self.streams = {}
+                    self.last_error = "controlport connection closed"
+            self._notify()
+
+    def _on_circ(self, event):
+        self.latency.on_circ(event)
+        with self.lock:
+            if event.status in (CircStatus.CLOSED, CircStatus.FAILED):
+                self.circuits.pop(event.id, None)
+                self.streams = {sid: cid for sid, cid in self.streams.items() if cid != event.id}
+            else:
+                self.circuits[event.id] = event
+                if event.status == CircStatus.BUILT and self.awaiting_first_built:
+                    self.first_built_at = time.time()
+                    self.awaiting_first_built = False
+        self._notify()
+
+    def _on_stream(self, event):
+        self.latency.on_stream(event)
+        with self.lock:
+            if event.status in (StreamStatus.CLOSED, StreamStatus.FAILED, StreamStatus.DETACHED):
+                self.streams.pop(event.id, None)
+            elif event.circ_id:
+                self.streams[event.id] = event.circ_id
+
+    def _notify(self):
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logger.warning(f"session listener failed for {self.address}: {e}")
+
+    def built_circuits(self) -> List[object]:
+        """built circuits from the in-memory table, connecting first if needed"""
+        self.connect()
+        with self.lock:
+            return sorted((c for c in self.circuits.values() if c.status == CircStatus.BUILT), key=lambda c: int(c.id))
+
+    def stream_counts(self) -> Dict[str, int]:
+        with self.lock:
+            counts: Dict[str, int] = {}
+            for circ_id in self.streams.values():
+                counts[circ_id] = counts.get(circ_id, 0) + 1
+            return counts
+
+class ControllerPool:
+    """controlport sessions keyed by container id, reconnecting when a container's address changes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions: Dict[str, HostSession] = {}
+        self.listeners: List[Callable] = []
+        # every session's latencies also land here, so fleet-wide tails cost the same at any fleet size
+        self.latency = LatencySet()
+
+    def session(self, tor_host: Dict) -> HostSession:
+        moved = None
+        with self.lock:
+            session = self.sessions.get(tor_host['id'])
+            if session is not None and session.address != tor_host['ip_address']:
+                moved = session
+                session = None
+            if session is None:
+                session = HostSession(tor_host['id'], tor_host['ip_address'], self.latency)
+                session.listeners = self.listeners
+                self.sessions[tor_host['id']] = session
+        # closing waits on the session's own lock, which a connect can hold for a while - not with every lookup queued behind it
+        if moved is not None:
+            moved.close()
+        return session
+
+    def controller(self, tor_host: Dict) -> Controller:
+        return self.session(tor_host).connect()
+
+    def add_listener(self, listener: Callable):
+        """call listener(session) whenever a session's circuit table or connection state changes"""
+        self.listeners.append(listener)
+
+    def prune(self, live_ids):
+        with self.lock:
+            stale = [host_id for host_id in self.sessions if host_id not in live_ids]
+            removed = [self.sessions.pop(host_id) for host_id in stale]
+        for session in removed:
+            session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            session.close()
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, FrozenSet, List, Optional
+
+from stem import CircStatus
+
+from cache import TTLCache
+from controlpool import ControllerPool, HostSession
+from registry import ContainerRegistry
+from relays import Relay, RelayIndex
+
+logger = logging.getLogger(__name__)
+
+EXIT_CACHE_SIZE = int(os.getenv("EXIT_CACHE_SIZE", "8192"))
+EXIT_CACHE_TTL = float(os.getenv("EXIT_CACHE_TTL", "60"))
+EXIT_CONCURRENCY = int(os.getenv("EXIT_CONCURRENCY", "32"))
+
+def exit_report(host: Dict, circuits: List[object], relays: Dict[str, Optional[Relay]]) -> Dict:
+    """a host's exits from its built circuits, busiest first - only general circuits leave the tor network"""
+    exits: Dict[str, Dict] = {}
+    for circ in circuits:
+        if circ.purpose != "GENERAL" or not circ.path:
+            continue
+        fingerprint, nickname = circ.path[-1]
+        relay = relays.get(fingerprint)
+        entry = exits.get(fingerprint)
+        if entry is None:
+            entry = exits[fingerprint] = {
+                "fingerprint": fingerprint,
+                "nickname": nickname,
+                "address": relay.address if relay else None,
+                "exitFlag": "Exit" in relay.flags if relay else None,
+                "circuits": 0
+            }
+        entry["circuits"] += 1
+    ordered = sorted(exits.values(), key=lambda entry: -entry['circuits'])
+    return {
+        "id": host['id'],
+        "hostname": host['hostname'],
+        "address": next((entry['address'] for entry in ordered if entry['address']), None),
+        "exits": ordered,
+        "discoveredAt": time.time()
+    }
+
+class ExitDiscovery:
+    """each tor host's current exit addresses, read off its built circuits through the controlport - no requests leave the box"""
+
+    def __init__(self, registry: ContainerRegistry, pool: ControllerPool, relay_index: RelayIndex,
+                 concurrency: int = EXIT_CONCURRENCY, cache_size: int = EXIT_CACHE_SIZE, cache_ttl: float = EXIT_CACHE_TTL):
+        self.registry = registry
+        self.pool = pool
+        self.relay_index = relay_index
+        self.concurrency = concurrency
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.built: Dict[str, FrozenSet[str]] = {}
+        pool.add_listener(self._on_session_change)
+
+    def _on_session_change(self, session: HostSession):
+        # fires on every CIRC event, but only a general circuit becoming or ceasing to be BUILT moves the exits -
+        # LAUNCHED and EXTENDED on a busy host would otherwise evict its entry almost continuously
+        with session.lock:
+            built = frozenset(circ_id for circ_id, circ in session.circuits.items() if circ.status == CircStatus.BUILT and circ.purpose == "GENERAL")
+        if self.built.get(session.host_id, frozenset()) != built:
+            # hosts with nothing built aren't kept, so containers that went away don't pile up here
+            if built:
+                self.built[session.host_id] = built
+            else:
+                self.built.pop(session.host_id, None)
+            self.cache.pop(session.host_id)
+
+    def record(self, host: Dict, circuits: List[object], relays: Dict[str, Optional[Relay]]) -> Dict:
+        """cache exits from circuits and relays a caller already resolved, the dashboard collection does this for free"""
+        report = exit_report(host, circuits, relays)
+        self.cache.set(host['id'], report)
+        return report
+
+    def lookup(self, host: Dict) -> Dict:
+        """blocking: read one host's built circuits and resolve their last hops"""
+        session = self.pool.session(host)
+        circuits = session.built_circuits()
+        controller = session.controller
+        self.relay_index.ensure(controller)
+        relays = {circ.path[-1][0]: self.relay_index.resolve(circ.path[-1][0], controller) for circ in circuits if circ.path}
+        return self.record(host, circuits, relays)
+
+    async def discover(self, hosts: Optional[List[str]] = None, refresh: bool = False) -> List[Dict]:
+        """exits for every tor host, or the given ones, from the cache where it's fresh and concurrently otherwise"""
+        tor_hosts = [self.registry.get(key) for key in hosts] if hosts else self.registry.hosts()
+        tor_hosts = [host for host in tor_hosts if host]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def discover_host(host: Dict) -> Dict:
+            cached = None if refresh else self.cache.get(host['id'])
+            if cached is not None:
+                return cached
+            async with semaphore:
+                try:
+                    return await asyncio.to_thread(self.lookup, host)
+                except Exception as e:
+                    logger.warning(f"could not discover exits for {host['hostname']}: {e}")
+                    return {"id": host['id'], "hostname": host['hostname'], "address": None, "exits": [], "error": str(e)}
+
+        return list(await asyncio.gather(*(discover_host(host) for host in tor_hosts)))
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
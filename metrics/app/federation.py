@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import websockets
+
+from latency import merge_reports
+from publisher import backend_key
+
+logger = logging.getLogger(__name__)
+
+# comma separated name=url pairs, or bare urls named by their host and port
+FEDERATION_NODES = os.getenv("FEDERATION_NODES", "")
+FEDERATION_STALE_AFTER = float(os.getenv("FEDERATION_STALE_AFTER", "15"))
+FEDERATION_DROP_AFTER = float(os.getenv("FEDERATION_DROP_AFTER", "300"))
+RECONNECT_BACKOFF_MAX = 30
+
+# summary fields that add up across nodes
+SUMMED_FIELDS = ("totalCircuits", "activeCircuits", "totalSessions", "totalBytesIn", "totalBytesOut",
+                 "healthyBackends", "totalBackends", "sessionRate", "bytesInRate", "bytesOutRate")
+
+def parse_nodes(value: str) -> List[Tuple[str, str]]:
+    """(name, base url) for each node in a FEDERATION_NODES string"""
+    nodes = []
+    for item in (item.strip() for item in value.split(",")):
+        if not item:
+            continue
+        name, _, url = item.rpartition("=") if "=" in item.split("://", 1)[0] else ("", "", item)
+        url = url.rstrip("/")
+        nodes.append((name or url.split("://", 1)[-1], url))
+    return nodes
+
+class NodeFeed:
+    """one node's snapshot as followed over its /ws feed, with ids and backend names prefixed by the node"""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.hosts: Dict[str, Dict] = {}
+        self.backends: Dict[str, Dict] = {}
+        self.summary: Dict = {}
+        self.meta: Dict = {}
+        self.version: Optional[int] = None
+        self.updated_at: Optional[float] = None
+        self.connected = False
+        self.connects = 0
+        self.last_error: Optional[str] = None
+        self._hosts: Optional[Tuple[Any, List[Dict]]] = None
+        self._backends: Optional[Tuple[Any, List[Dict]]] = None
+        self._capacity: Optional[Tuple[Any, Dict]] = None
+
+    def _host(self, host: Dict) -> Dict:
+        return {**host, "id": f"{self.name}/{host['id']}", "hostname": f"{self.name}/{host['hostname']}", "node": self.name}
+
+    def _backend(self, stat: Dict) -> Dict:
+        return {**stat, "pxname": f"{self.name}/{stat['pxname']}", "node": self.name}
+
+    def load(self, frame: Dict):
+        data = frame['data']
+        self.hosts = {host['id']: self._host(host) for host in data.get('torHosts', [])}
+        self.backends = {backend_key(stat): self._backend(stat) for stat in data.get('haproxyStats', [])}
+        self.summary = data.get('summary') or {}
+        self.meta = data.get('snapshot') or {}
+        self._advance(frame['version'])
+
+    def apply(self, frame: Dict):
+        """fold a delta into the node's copy, only the hosts and backends it names are touched"""
+        for host_id in frame['hosts']['removed']:
+            self.hosts.pop(host_id, None)
+        for host in frame['hosts']['changed']:
+            self.hosts[host['id']] = self._host(host)
+        if frame['hosts'].get('order'):
+            self.hosts = {host_id: self.hosts[host_id] for host_id in frame['hosts']['order'] if host_id in self.hosts}
+        for key in frame['backends']['removed']:
+            self.backends.pop(key, None)
+        for stat in frame['backends']['changed']:
+            self.backends[backend_key(stat)] = self._backend(stat)
+        if 'summary' in frame:
+            self.summary = frame['summary'] or {}
+        self.meta = frame.get('snapshot') or self.meta
+        self._advance(frame['version'])
+
+    def _advance(self, version: int):
+        self.version = version
+        self.updated_at = time.monotonic()
+
+    def age(self, now: float) -> Optional[float]:
+        return None if self.updated_at is None else now - self.updated_at
+
+    def stale(self, now: float) -> bool:
+        age = self.age(now)
+        return not self.connected or age is None or age > FEDERATION_STALE_AFTER or bool(self.meta.get('stale'))
+
+    def expired(self, now: float) -> bool:
+        age = self.age(now)
+        return age is None or age > FEDERATION_DROP_AFTER
+
+    def host_list(self, stale: bool) -> List[Dict]:
+        """the node's hosts in order, rebuilt only when the node moved on, marked stale while the node is"""
+        if self._hosts is None or self._hosts[0] != (self.version, stale):
+            hosts = list(self.hosts.values())
+            self._hosts = ((self.version, stale), [{**host, "stale": True} for host in hosts] if stale else hosts)
+        return self._hosts[1]
+
+    def backend_list(self) -> List[Dict]:
+        if self._backends is None or self._backends[0] != self.version:
+            self._backends = (self.version, list(self.backends.values()))
+        return self._backends[1]
+
+    def capacity(self) -> Dict:
+        if self._capacity is None or self._capacity[0] != self.version:
+            hosts = self.hosts.values()
+            servers = [stat for stat in self.backends.values() if stat.get('svname') not in ('BACKEND', 'FRONTEND')]
+            self._capacity = (self.version, {
+                "hosts": len(self.hosts),
+                "healthyHosts": sum(1 for host in hosts if not host.get('error') and host.get('circuits')),
+                "socksPorts": sum(len(host.get('socks_ports') or [None]) for host in hosts),
+                "circuits": self.summary.get('activeCircuits', 0),
+                "backendsUp": sum(1 for stat in servers if stat.get('status') == "UP"),
+                "backends": len(servers),
+                "currentSessions": sum(stat.get('scur', 0) for stat in servers),
+                "sessionRate": self.summary.get('sessionRate', 0)
+            })
+        return self._capacity[1]
+
+    def status(self, now: float) -> Dict:
+        age = self.age(now)
+        return {
+            "name": self.name,
+            "url": self.url,
+            "connected": self.connected,
+            "version": self.version,
+            "age": round(age, 3) if age is not None else None,
+            "stale": self.stale(now),
+            "hosts": len(self.hosts),
+            "backends": len(self.backends),
+            "connects": self.connects,
+            "error": self.last_error
+        }
+
+class Aggregator:
+    """follows other metrics services' snapshot feeds and merges them into one fleet snapshot"""
+
+    def __init__(self, nodes: List[Tuple[str, str]]):
+        if not nodes:
+            raise ValueError("aggregator mode needs FEDERATION_NODES")
+        self.nodes = [NodeFeed(name, url) for name, url in nodes]
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._follow(node)) for node in self.nodes]
+            logger.info(f"aggregating {len(self.nodes)} nodes: {', '.join(node.name for node in self.nodes)}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _follow(self, node: NodeFeed):
+        backoff = 1
+        ws_url = node.url.replace("http://", "ws://", 1).replace("https://", "wss://", 1) + "/ws"
+        while True:
+            try:
+                async with websockets.connect(ws_url, max_size=None, open_timeout=10) as websocket:
+                    node.connected = True
+                    node.connects += 1
+                    node.last_error = None
+                    backoff = 1
+                    async for message in websocket:
+                        frame = json.loads(message)
+                        if frame.get('type') == "dashboard_update":
+                            node.load(frame)
+                        elif frame.get('type') == "dashboard_delta":
+                            if frame['baseVersion'] != node.version:
+                                # a delta against a version we never saw, reconnecting brings a full frame
+                                raise ConnectionError(f"missed versions {node.version} to {frame['baseVersion']}")
+                            node.apply(frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                node.last_error = str(e) or e.__class__.__name__
+                logger.warning(f"feed from {node.name} lost, reconnecting in {backoff}s: {node.last_error}")
+            node.connected = False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def summary(self, live: List[NodeFeed], now: float) -> Dict[str, Any]:
+        summaries = [node.summary for node in live]
+        summary: Dict[str, Any] = {field: sum(s.get(field, 0) for s in summaries) for field in SUMMED_FIELDS}
+        # node histograms carry their buckets, so the fleet's tails are exact rather than an average of tails
+        summary["latency"] = merge_reports(s.get('latency') for s in summaries)
+        summary["averageLatency"] = summary['latency']['streamConnect']['mean']
+        if summary['averageLatency'] is None:
+            sessions = summary['totalSessions']
+            summary["averageLatency"] = round(sum(s.get('averageLatency', 0) * s.get('totalSessions', 0) for s in summaries) / sessions, 1) if sessions else 0
+        summary["uptime"] = min((s['uptime'] for s in summaries if s.get('uptime')), default=0)
+        summary["backendGroups"] = [{**group, "name": f"{node.name}/{group['name']}"} for node in live for group in node.summary.get('backendGroups', [])]
+        bootstraps = [s['timeToFirstCircuit'] for s in summaries if s.get('timeToFirstCircuit')]
+        if bootstraps:
+            # percentiles don't merge, so the fleet reports the slowest node's
+            summary["timeToFirstCircuit"] = {
+                "measured": sum(b['measured'] for b in bootstraps),
+                "waiting": sum(b['waiting'] for b in bootstraps),
+                **{q: max((b[q] for b in bootstraps if b.get(q) is not None), default=None) for q in ("p50", "p95", "max")}
+            }
+        summary["nodes"] = [node.status(now) for node in self.nodes]
+        return summary
+
+    async def build(self) -> Dict[str, Any]:
+        """the fleet snapshot - per node lists are reused until that node's feed moves, so a build is a concatenation"""
+        now = time.monotonic()
+        live = [node for node in self.nodes if node.version is not None and not node.expired(now)]
+        hosts: List[Dict] = []
+        backends: List[Dict] = []
+        for node in live:
+            hosts.extend(node.host_list(node.stale(now)))
+            backends.extend(node.backend_list())
+        return {
+            "torHosts": hosts,
+            "haproxyStats": backends,
+            "summary": self.summary(live, now),
+            "lastUpdated": datetime.now().isoformat()
+        }
+
+    def capacity(self) -> Dict[str, Any]:
+        """per node serving capacity and the share of new work each should take, stale nodes take none"""
+        now = time.monotonic()
+        nodes = []
+        for node in self.nodes:
+            stale = node.stale(now)
+            nodes.append({**node.status(now), **(node.capacity() if node.version is not None else {})})
+            nodes[-1]["serving"] = 0 if stale else nodes[-1].get('backendsUp', 0)
+        serving = sum(node['serving'] for node in nodes)
+        for node in nodes:
+            node["share"] = round(node['serving'] / serving, 4) if serving else 0
+        totals = {field: sum(node.get(field, 0) for node in nodes)
+                  for field in ("hosts", "healthyHosts", "socksPorts", "circuits", "backendsUp", "backends", "currentSessions", "sessionRate")}
+        return {"nodes": nodes, "fleet": {**totals, "serving": serving, "staleNodes": sum(1 for node in nodes if node['stale'])}}
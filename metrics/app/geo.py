@@ -0,0 +1,82 @@
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+import geoip2.database
+import maxminddb
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+GEOIP_DATABASE = os.getenv("GEOIP_DATABASE", "GeoLite2-City.mmdb")
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "8192"))
+GEOIP_CACHE_TTL = int(os.getenv("GEOIP_CACHE_TTL", "86400"))
+# how often a missing database is looked for again, so one dropped in later gets picked up without a restart
+GEOIP_RETRY_INTERVAL = float(os.getenv("GEOIP_RETRY_INTERVAL", "60"))
+
+UNKNOWN_LOCATION = {
+    "country": "unknown",
+    "city": "unknown",
+    "latitude": None,
+    "longitude": None
+}
+
+class GeoLocator:
+    """one process-wide memory-mapped GeoLite2 reader behind a bounded address -> location cache"""
+
+    def __init__(self, path: str = GEOIP_DATABASE, cache_size: int = GEOIP_CACHE_SIZE, cache_ttl: int = GEOIP_CACHE_TTL):
+        self.path = path
+        self.reader: Optional[geoip2.database.Reader] = None
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.tried_at: Optional[float] = None
+
+    def open(self):
+        retry = self.tried_at is not None
+        self.tried_at = time.monotonic()
+        try:
+            self.reader = geoip2.database.Reader(self.path, mode=maxminddb.MODE_MMAP)
+            logger.info(f"opened {self.path} (mmap)")
+        except FileNotFoundError:
+            if not retry:
+                logger.warning(f"{self.path} not found. download from https://dev.maxmind.com/geoip/geoip2/geolite2/")
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def lookup(self, address: str) -> Dict:
+        location = self.cache.get(address)
+        if location is not None:
+            return location
+        if self.reader is None and self.tried_at is not None and time.monotonic() - self.tried_at >= GEOIP_RETRY_INTERVAL:
+            self.open()
+        if self.reader is None:
+            # nothing was looked up, so there's nothing to remember
+            return UNKNOWN_LOCATION
+        location = self._locate(address)
+        self.cache.set(address, location)
+        return location
+
+    def lookup_many(self, addresses: Iterable[str]) -> Dict[str, Dict]:
+        """resolve a batch of addresses, touching the reader once per distinct uncached address"""
+        return {address: self.lookup(address) for address in set(addresses)}
+
+    def _locate(self, address: str) -> Dict:
+        if self.reader is None or not address or address == 'unknown':
+            return UNKNOWN_LOCATION
+        try:
+            response = self.reader.city(address)
+        except Exception:
+            return UNKNOWN_LOCATION
+        return {
+            "country": response.country.name,
+            "city": response.city.name,
+            "latitude": response.location.latitude,
+            "longitude": response.location.longitude
+        }
+
+    def stats(self) -> Dict:
+        return {"database": self.path, "open": self.reader is not None, "cache": self.cache.stats()}
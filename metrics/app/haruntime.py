@@ -0,0 +1,60 @@
+import logging
+import os
+import socket
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+HAPROXY_RUNTIME = os.getenv("HAPROXY_RUNTIME", "haproxy:9999")
+
+ADMIN_FORCED_MAINT = 0x01
+ADMIN_FORCED_DRAIN = 0x08
+
+class HAProxyRuntime:
+    """a client for the haproxy runtime api (stats socket), one short connection per batch of commands"""
+
+    def __init__(self, address: str = HAPROXY_RUNTIME, timeout: float = 5):
+        host, _, port = address.rpartition(':')
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+
+    def execute(self, commands: Iterable[str]) -> str:
+        """run commands in one non-interactive session and return haproxy's combined output"""
+        payload = ";".join(commands)
+        if not payload:
+            return ""
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as conn:
+            conn.sendall(payload.encode() + b"\n")
+            chunks = []
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks).decode(errors="replace")
+
+    def servers(self) -> List[Dict]:
+        """every server haproxy knows about, parsed from show servers state"""
+        output = self.execute(["show servers state"])
+        servers = []
+        columns = None
+        for line in output.splitlines():
+            if line.startswith("# be_id"):
+                columns = line[2:].split()
+                continue
+            values = line.split()
+            # skips the leading format version line and anything that isn't a full server row
+            if columns is None or len(values) < len(columns):
+                continue
+            row = dict(zip(columns, values))
+            servers.append({
+                "backend": row.get("be_name"),
+                "name": row.get("srv_name"),
+                "address": row.get("srv_addr"),
+                "port": int(row.get("srv_port", 0) or 0),
+                "op_state": int(row.get("srv_op_state", 0)),
+                "admin_state": int(row.get("srv_admin_state", 0)),
+                "weight": int(row.get("srv_uweight", 0))
+            })
+        return servers
@@ -0,0 +1,175 @@
+import csv
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+HAPROXY_STATS_URL = os.getenv("HAPROXY_STATS_URL", "http://haproxy:1337/;csv")
+# tor hosts are sharded across backend groups named tors, tors2, tors3...
+HAPROXY_BACKENDS = re.compile(r"^tors\d*,")
+HISTORY_SIZE = int(os.getenv("HAPROXY_HISTORY_SIZE", "60"))
+HISTORY_WINDOW = int(os.getenv("HAPROXY_HISTORY_WINDOW", "30"))
+
+# (field, is_int) in the order they are emitted, everything else in the csv is ignored
+SCHEMA: Tuple[Tuple[str, bool], ...] = (
+    ("pxname", False), ("svname", False), ("status", False),
+    ("scur", True), ("smax", True), ("stot", True), ("bin", True), ("bout", True),
+    ("ereq", True), ("econ", True), ("eresp", True), ("wretr", True), ("wredis", True),
+    ("weight", True), ("act", True), ("bck", True), ("chkfail", True), ("chkdown", True),
+    ("lastchg", True), ("downtime", True), ("rate", True), ("rate_max", True),
+    ("hrsp_2xx", True), ("hrsp_3xx", True), ("hrsp_4xx", True), ("hrsp_5xx", True),
+    ("cli_abrt", True), ("srv_abrt", True), ("lastsess", True),
+    ("qtime", True), ("ctime", True), ("rtime", True), ("ttime", True),
+    ("check_status", False), ("check_code", True), ("check_duration", True), ("last_chk", False),
+    ("qtime_max", True), ("ctime_max", True), ("rtime_max", True), ("ttime_max", True),
+    ("addr", False),
+)
+
+# unassigned server-template slots sit in maintenance on this address, they aren't real backends
+SLOT_ADDRESS = os.getenv("HAPROXY_SLOT_ADDRESS", "127.0.0.1")
+
+# per-sample series kept for every backend row
+SERIES = ("t", "stot", "bin", "bout", "econ", "eresp", "ctime", "ttime")
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class SeriesRing:
+    """fixed-size, array-backed sample history for one backend row"""
+
+    __slots__ = ("size", "count", "head", "series")
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.size = size
+        self.count = 0
+        self.head = 0
+        self.series = {name: array('d', bytes(8 * size)) for name in SERIES}
+
+    def append(self, t: float, row: Dict):
+        for name, values in self.series.items():
+            # columns an older haproxy doesn't emit read as zero
+            values[self.head] = t if name == "t" else row.get(name, 0)
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def recent(self, name: str, n: int) -> List[float]:
+        """the last n samples of a series, oldest first"""
+        n = min(n, self.count)
+        values = self.series[name]
+        return [values[(self.head - n + i) % self.size] for i in range(n)]
+
+    def rate(self, name: str, n: int = 2) -> float:
+        """per-second increase of a counter across the last n samples, ignoring counter resets"""
+        t = self.recent("t", n)
+        v = self.recent(name, n)
+        if len(t) < 2 or t[-1] <= t[0] or v[-1] < v[0]:
+            return 0.0
+        return (v[-1] - v[0]) / (t[-1] - t[0])
+
+class HAProxyStats:
+    """streams the tor backend group rows out of the haproxy csv and keeps a bounded per-backend history"""
+
+    def __init__(self, url: str = HAPROXY_STATS_URL, backends: re.Pattern = HAPROXY_BACKENDS, history_size: int = HISTORY_SIZE):
+        self.url = url
+        self.backends = backends
+        self.history_size = history_size
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.lock = threading.Lock()
+        self.history: Dict[str, SeriesRing] = {}
+
+    def _columns(self, header: str) -> List[Tuple[str, int, bool]]:
+        names = header.lstrip('# ').split(',')
+        index = {name: i for i, name in enumerate(names)}
+        return [(name, index[name], is_int) for name, is_int in SCHEMA if name in index]
+
+    def parse(self, lines: Iterable[str]) -> List[Dict]:
+        lines = iter(lines)
+        header = next(lines, None)
+        if not header:
+            return []
+        columns = self._columns(header)
+        backends = []
+        for row in csv.reader(line for line in lines if self.backends.match(line)):
+            stat = {
+                name: (int(row[i]) if row[i].isdigit() else 0) if is_int else row[i]
+                for name, i, is_int in columns
+            }
+            if stat['status'] == "MAINT" and stat.get('addr', '').startswith(f"{SLOT_ADDRESS}:"):
+                continue
+            backends.append(stat)
+        return backends
+
+    def fetch(self) -> List[Dict]:
+        with self.session.get(self.url, timeout=5, stream=True) as response:
+            response.raise_for_status()
+            return self.parse(response.iter_lines(decode_unicode=True))
+
+    def collect(self) -> Dict:
+        try:
+            backends = self.fetch()
+        except Exception as e:
+            logger.error(f"error getting HAProxy stats: {e}")
+            return {"backends": [], "groups": []}
+        now = time.time()
+        with self.lock:
+            live = set()
+            for stat in backends:
+                key = f"{stat['pxname']}/{stat['svname']}"
+                live.add(key)
+                ring = self.history.get(key)
+                if ring is None:
+                    ring = self.history[key] = SeriesRing(self.history_size)
+                ring.append(now, stat)
+                stat["sessRate"] = round(ring.rate("stot"), 3)
+                stat["binRate"] = round(ring.rate("bin"), 1)
+                stat["boutRate"] = round(ring.rate("bout"), 1)
+            for key in [key for key in self.history if key not in live]:
+                del self.history[key]
+        return {"backends": backends, "groups": self.groups(backends)}
+
+    def groups(self, backends: List[Dict]) -> List[Dict]:
+        """per backend group health, from its aggregate row and its servers"""
+        groups = {}
+        for stat in backends:
+            group = groups.setdefault(stat['pxname'], {"name": stat['pxname'], "status": None, "servers": 0, "up": 0, "scur": 0, "stot": 0, "sessRate": 0.0})
+            if stat['svname'] == "BACKEND":
+                group.update(status=stat['status'], scur=stat['scur'], stot=stat['stot'], sessRate=stat['sessRate'])
+            elif stat['svname'] != "FRONTEND":
+                group["servers"] += 1
+                group["up"] += stat['status'] == "UP"
+        return sorted(groups.values(), key=lambda group: (len(group['name']), group['name']))
+
+    def window(self, key: str, n: int = HISTORY_WINDOW) -> Optional[Dict]:
+        """rates and percentiles over the last n samples of one backend row"""
+        with self.lock:
+            ring = self.history.get(key)
+            if ring is None:
+                return None
+            ctime = ring.recent("ctime", n)
+            ttime = ring.recent("ttime", n)
+            return {
+                "samples": min(n, ring.count),
+                "timestamps": ring.recent("t", n),
+                "sessRate": ring.rate("stot", n),
+                "binRate": ring.rate("bin", n),
+                "boutRate": ring.rate("bout", n),
+                "econRate": ring.rate("econ", n),
+                "erespRate": ring.rate("eresp", n),
+                "ctime": {"p50": percentile(ctime, 0.5), "p95": percentile(ctime, 0.95), "p99": percentile(ctime, 0.99)},
+                "ttime": {"p50": percentile(ttime, 0.5), "p95": percentile(ttime, 0.95), "p99": percentile(ttime, 0.99)}
+            }
+
+    def ring(self, key: str) -> Optional[SeriesRing]:
+        return self.history.get(key)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from stem import CircStatus
+
+from controlpool import ControllerPool, HostSession
+from haruntime import ADMIN_FORCED_DRAIN, ADMIN_FORCED_MAINT, HAProxyRuntime
+from registry import ContainerRegistry
+
+logger = logging.getLogger(__name__)
+
+HEALTH_RESYNC_INTERVAL = float(os.getenv("HEALTH_RESYNC_INTERVAL", "5"))
+HEALTH_DEBOUNCE = float(os.getenv("HEALTH_DEBOUNCE", "0.2"))
+HEALTH_CONNECT_CONCURRENCY = int(os.getenv("HEALTH_CONNECT_CONCURRENCY", "32"))
+HEALTH_BACKOFF_MAX = float(os.getenv("HEALTH_BACKOFF_MAX", "60"))
+
+def session_ready(session: Optional[HostSession], port: Optional[int] = None) -> bool:
+    """a tor socksport is ready once its instance's controlport session is up, tor reports the port
+    as listening and the instance has at least one built circuit"""
+    if session is None or session.controller is None:
+        return False
+    with session.lock:
+        if port is not None and session.socks_ports and port not in session.socks_ports:
+            return False
+        return any(circ.status == CircStatus.BUILT for circ in session.circuits.values())
+
+class HealthDaemon:
+    """tracks circuit readiness from controlport events and pushes ready/drain states into haproxy"""
+
+    def __init__(self, registry: ContainerRegistry, pool: ControllerPool, runtime: HAProxyRuntime):
+        self.registry = registry
+        self.pool = pool
+        self.runtime = runtime
+        self.changed = asyncio.Event()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.task: Optional[asyncio.Task] = None
+        self.servers: Dict[Tuple[str, str], Dict] = {}
+        self.states: Dict[Tuple[str, str], Dict] = {}
+        self.servers_at = 0.0
+        self.connected_at = 0.0
+        self.backoff = 0.0
+        self.last_error: Optional[str] = None
+        pool.add_listener(self._on_session_change)
+
+    def _on_session_change(self, session: HostSession):
+        # called from stem's event threads
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.changed.set)
+
+    def start(self):
+        if self.task is None:
+            self.loop = asyncio.get_running_loop()
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            self.changed.clear()
+            try:
+                await self.reconcile()
+                self.last_error = None
+                self.backoff = 0.0
+            except Exception as e:
+                self.last_error = str(e)
+                self.backoff = min(self.backoff * 2 or 1.0, HEALTH_BACKOFF_MAX)
+                logger.warning(f"health reconcile failed, retrying in {self.backoff:.0f}s: {e}")
+                # circuit events keep arriving while haproxy is unreachable, they wait for the retry
+                await asyncio.sleep(self.backoff)
+                continue
+            try:
+                await asyncio.wait_for(self.changed.wait(), HEALTH_RESYNC_INTERVAL)
+                await asyncio.sleep(HEALTH_DEBOUNCE)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _connect_missing(self):
+        semaphore = asyncio.Semaphore(HEALTH_CONNECT_CONCURRENCY)
+
+        async def connect(host):
+            async with semaphore:
+                try:
+                    await asyncio.to_thread(self.pool.session(host).connect)
+                except Exception:
+                    pass
+
+        missing = [host for host in self.registry.hosts() if self.pool.sessions.get(host['id']) is None or self.pool.sessions[host['id']].controller is None]
+        await asyncio.gather(*(connect(host) for host in missing))
+
+    async def reconcile(self):
+        now = time.monotonic()
+        if now - self.connected_at >= HEALTH_RESYNC_INTERVAL:
+            self.connected_at = now
+            await self._connect_missing()
+        if now - self.servers_at >= HEALTH_RESYNC_INTERVAL or not self.servers:
+            servers = await asyncio.to_thread(self.runtime.servers)
+            self.servers = {(s['backend'], s['name']): s for s in servers}
+            self.servers_at = now
+        pending = {}
+        for key, server in self.servers.items():
+            host = self.registry.by_address.get(server['address'])
+            # unknown addresses are empty or reassigned slots, forced maintenance belongs to whoever set it
+            if host is None or server['admin_state'] & ADMIN_FORCED_MAINT:
+                continue
+            ready = session_ready(self.pool.sessions.get(host['id']), server['port'])
+            desired = "ready" if ready else "drain"
+            # compare against haproxy's own state, slots get re-addressed and reloads reset them behind our back
+            actual = "drain" if server['admin_state'] & ADMIN_FORCED_DRAIN else "ready"
+            previous = self.states.get(key)
+            if actual == desired:
+                if previous is None or previous['state'] != desired or previous['hostname'] != host['hostname'] or previous['port'] != server['port']:
+                    self.states[key] = {"hostname": host['hostname'], "port": server['port'], "state": desired, "since": time.time()}
+                continue
+            pending[key] = {"hostname": host['hostname'], "port": server['port'], "state": desired, "since": time.time()}
+            logger.info(f"{key[0]}/{key[1]} ({host['hostname']}:{server['port']}) -> {desired}")
+        for key in [key for key in self.states if key not in self.servers]:
+            del self.states[key]
+        if pending:
+            await asyncio.to_thread(self.runtime.execute, [f"set server {b}/{n} state {state['state']}" for (b, n), state in pending.items()])
+            for key, state in pending.items():
+                server = self.servers[key]
+                server['admin_state'] = server['admin_state'] | ADMIN_FORCED_DRAIN if state['state'] == "drain" else server['admin_state'] & ~ADMIN_FORCED_DRAIN
+            self.states.update(pending)
+
+    def report(self) -> Dict:
+        return {
+            "servers": [
+                {"backend": backend, "server": name, **state}
+                for (backend, name), state in sorted(self.states.items())
+            ],
+            "ready": sum(1 for state in self.states.values() if state['state'] == "ready"),
+            "draining": sum(1 for state in self.states.values() if state['state'] == "drain"),
+            "error": self.last_error
+        }
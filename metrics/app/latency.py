@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from datetime import timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from stem import CircStatus, StreamStatus
+
+# seconds each histogram window covers, reports span the current and the previous window
+LATENCY_WINDOW = float(os.getenv("LATENCY_WINDOW", "600"))
+# circuits and streams waiting on their next event per host, anything past this goes unmeasured
+LATENCY_PENDING_MAX = int(os.getenv("LATENCY_PENDING_MAX", "1024"))
+
+# milliseconds, four buckets per doubling from 1ms to about two minutes - roughly 19% resolution at any latency
+LATENCY_BUCKETS = tuple(round(2 ** (i / 4), 3) for i in range(69))
+BUCKET_INDEX = {bound: i for i, bound in enumerate(LATENCY_BUCKETS)}
+# circuit LAUNCHED to BUILT, stream NEW to SENTCONNECT (a circuit picked), SENTCONNECT to SUCCEEDED (the exit connected)
+LATENCY_KINDS = ("circuitBuild", "streamAttach", "streamConnect")
+
+class LatencyHistogram:
+    """fixed buckets over the last one to two windows, the same memory however long it runs"""
+
+    def __init__(self, window: float = LATENCY_WINDOW):
+        self.window = window
+        self.current = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.previous = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.current_sum = 0.0
+        self.previous_sum = 0.0
+        self.rotated_at = time.monotonic()
+
+    def _rotate(self):
+        now = time.monotonic()
+        if now - self.rotated_at < self.window:
+            return
+        idle = now - self.rotated_at >= self.window * 2
+        self.previous = [0] * len(self.current) if idle else self.current
+        self.previous_sum = 0.0 if idle else self.current_sum
+        self.current = [0] * len(self.previous)
+        self.current_sum = 0.0
+        self.rotated_at = now
+
+    def observe(self, ms: float):
+        self._rotate()
+        self.current[bisect_left(LATENCY_BUCKETS, ms)] += 1
+        self.current_sum += ms
+
+    def totals(self) -> Tuple[List[int], float]:
+        self._rotate()
+        return [a + b for a, b in zip(self.current, self.previous)], self.current_sum + self.previous_sum
+
+def quantiles(counts: List[int], total: int, qs: Tuple[float, ...]) -> List[Optional[float]]:
+    """quantiles read off bucket counts in one pass, interpolated inside the bucket each falls in"""
+    if not total:
+        return [None] * len(qs)
+    values = []
+    ranks = iter(q * total for q in qs)
+    rank = next(ranks)
+    cumulative = 0
+    for i, count in enumerate(counts):
+        while rank is not None and count and cumulative + count >= rank:
+            lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+            upper = LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)]
+            values.append(round(lower + (upper - lower) * (rank - cumulative) / count, 1))
+            rank = next(ranks, None)
+        cumulative += count
+    return values + [LATENCY_BUCKETS[-1]] * (len(qs) - len(values))
+
+def summarize(counts: List[int], total_ms: float, buckets: bool = False) -> Dict:
+    """count, mean and tail in milliseconds, with the non-empty buckets when the report has to be merged elsewhere"""
+    total = sum(counts)
+    p50, p95, p99 = quantiles(counts, total, (0.5, 0.95, 0.99))
+    report = {"count": total, "mean": round(total_ms / total, 1) if total else None, "p50": p50, "p95": p95, "p99": p99}
+    if buckets:
+        # [upper bound ms, count], the overflow bucket's bound is null
+        report["sum"] = round(total_ms, 1)
+        report["buckets"] = [[LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None, count] for i, count in enumerate(counts) if count]
+    return report
+
+def merge_reports(reports: Iterable[Dict]) -> Dict:
+    """one latency report from several that carry their buckets, e.g. every node's fleet report"""
+    merged = {}
+    reports = [report for report in reports if report]
+    for kind in LATENCY_KINDS:
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        total_ms = 0.0
+        for report in reports:
+            entry = report.get(kind) or {}
+            total_ms += entry.get('sum', 0)
+            for bound, count in entry.get('buckets', []):
+                counts[BUCKET_INDEX.get(bound, len(LATENCY_BUCKETS))] += count
+        merged[kind] = summarize(counts, total_ms, buckets=True)
+    return merged
+
+class LatencySet:
+    """one histogram per latency kind, shared between the controlport event threads that feed it"""
+
+    def __init__(self, window: float = LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.window = window
+        self.histograms = {kind: LatencyHistogram(window) for kind in LATENCY_KINDS}
+        self.observations = 0
+        self._report: Optional[Tuple[Tuple[int, int], Dict]] = None
+
+    def observe(self, kind: str, ms: float):
+        with self.lock:
+            self.histograms[kind].observe(ms)
+            self.observations += 1
+
+    def report(self, buckets: bool = False) -> Dict:
+        """a summary of every kind, cached until something new is observed or a window passes - bucketed ones are built fresh"""
+        with self.lock:
+            key = (self.observations, int(time.monotonic() // self.window))
+            if buckets or self._report is None or self._report[0] != key:
+                report = {kind: summarize(*histogram.totals(), buckets) for kind, histogram in self.histograms.items()}
+                if buckets:
+                    return report
+                self._report = (key, report)
+            return self._report[1]
+
+class HostLatency:
+    """circuit build and stream attach/connect times for one tor instance, timed off its controlport events"""
+
+    def __init__(self, fleet: Optional[LatencySet] = None):
+        self.lock = threading.Lock()
+        self.histograms = LatencySet()
+        self.fleet = fleet
+        self.launched: Dict[str, float] = {}
+        self.opened: Dict[str, float] = {}
+        self.attached: Dict[str, float] = {}
+
+    def reset(self):
+        """a new controlport session can't finish what the old one saw start"""
+        with self.lock:
+            self.launched.clear()
+            self.opened.clear()
+            self.attached.clear()
+
+    def _observe(self, kind: str, started: Optional[float], ended: float):
+        if started is None or ended < started:
+            return
+        ms = (ended - started) * 1000
+        self.histograms.observe(kind, ms)
+        if self.fleet is not None:
+            # fed as events arrive, so the fleet report never has to add up every host's buckets
+            self.fleet.observe(kind, ms)
+
+    @staticmethod
+    def _track(pending: Dict[str, float], key: str, at: float):
+        if len(pending) < LATENCY_PENDING_MAX:
+            pending[key] = at
+
+    def on_circ(self, event):
+        # stem's own arrived_at is whole seconds, so events are timed as their listener sees them
+        arrived = time.time()
+        with self.lock:
+            if event.status == CircStatus.LAUNCHED:
+                self._track(self.launched, event.id, arrived)
+            elif event.status == CircStatus.BUILT:
+                started = self.launched.pop(event.id, None)
+                if started is None and event.created is not None:
+                    # launched before this session, tor's own creation time is the next best start - if the clocks agree
+                    created = event.created.replace(tzinfo=timezone.utc).timestamp()
+                    started = created if arrived - created <= LATENCY_BUCKETS[-1] / 1000 else None
+                self._observe("circuitBuild", started, arrived)
+            elif event.status in (CircStatus.CLOSED, CircStatus.FAILED):
+                self.launched.pop(event.id, None)
+
+    def on_stream(self, event):
+        arrived = time.time()
+        with self.lock:
+            if event.status in (StreamStatus.NEW, StreamStatus.NEWRESOLVE, StreamStatus.DETACHED):
+                # a detached stream waits for another circuit, its next attach is timed from here
+                self.attached.pop(event.id, None)
+                self._track(self.opened, event.id, arrived)
+            elif event.status in (StreamStatus.SENTCONNECT, StreamStatus.SENTRESOLVE):
+                self._observe("streamAttach", self.opened.pop(event.id, None), arrived)
+                self._track(self.attached, event.id, arrived)
+            elif event.status in (StreamStatus.SUCCEEDED, StreamStatus.REMAP) and event.id in self.attached:
+                self._observe("streamConnect", self.attached.pop(event.id), arrived)
+            elif event.status in (StreamStatus.CLOSED, StreamStatus.FAILED):
+                self.opened.pop(event.id, None)
+                self.attached.pop(event.id, None)
+
+    def report(self) -> Dict:
+        return self.histograms.report()
@@ -1,21 +1,32 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from stem import CircStatus
-from stem.control import Controller
-import geoip2.database
-import requests
+from fastapi.responses import Response
+from pydantic import BaseModel
 import os
-from io import StringIO
-import csv
-import docker
 import asyncio
-import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 import logging
-from functools import lru_cache
 import time
+from collector import CircuitCollector
+from controlpool import ControllerPool
+from registry import ContainerRegistry
+from hastats import HAProxyStats, HISTORY_WINDOW
+from haruntime import HAProxyRuntime
+from health import HealthDaemon
+from weighting import WeightingEngine
+from relays import RelayIndex
+from exits import ExitDiscovery
+from federation import Aggregator, FEDERATION_NODES, parse_nodes
+from geo import GeoLocator, UNKNOWN_LOCATION
+from snapshot import SnapshotService, body_meta
+from publisher import SnapshotPublisher
+from prefetch import Prefetcher, PREFETCH_FILE
+from bootstrap import bootstrap_report, time_to_first_circuit
+from bulk import BulkEngine, BULK_MAX_FRACTION, BULK_STAGGER
+from telemetry import CONTENT_TYPE, MetricsExporter, telemetry
+from views import ViewEncoder, VIEW_PAGE_LIMIT, backend_key, filter_backends, filter_hosts, host_view, paginate, parse_fields, project
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -44,168 +55,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def broadcast(self, data: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(data))
-            except:
-                pass
-
-manager = ConnectionManager()
+pool = ControllerPool()
+registry = ContainerRegistry()
+haproxy = HAProxyStats()
+runtime = HAProxyRuntime()
+health = HealthDaemon(registry, pool, runtime)
+weighting = WeightingEngine(registry, pool, haproxy, health, runtime)
+registry.listeners.append(lambda r: pool.prune(r.by_id))
+relay_index = RelayIndex()
+exits = ExitDiscovery(registry, pool, relay_index)
+geo = GeoLocator()
+prefetcher = Prefetcher(registry, pool)
 
 def get_tor_containers():
-    try:
-        client = docker.from_env()
-        containers = client.containers.list(filters={"network": "net_tor"})
-        tor_hosts = []
-        for container in containers:
-            if container.attrs.get('Config', {}).get('User') == 'tor':
-                tor_hosts.append({
-                    "id": container.short_id,
-                    "ip_address": container.attrs['NetworkSettings']['Networks']['net_tor']['IPAddress'],
-                    "hostname": container.name,
-                    "image": container.image.tags[0] if container.image.tags else container.image.short_id,
-                    "state": container.status
-                })
-        return sorted(tor_hosts, key=lambda x: x['hostname'])
-    except Exception as e:
-        logger.error(f"error getting Tor containers: {e}")
-        return []
+    return registry.hosts()
 
 def get_haproxy_stats():
-    try:
-        response = requests.get("http://haproxy:1337/;csv", timeout=5)
-        response.raise_for_status()
-        csv_data = StringIO(response.text)
-        reader = csv.DictReader(csv_data)
-        backends = []
-        for row in reader:
-            if row['# pxname'] == 'tors':
-                backends.append({
-                    "pxname": row['# pxname'],
-                    "svname": row['svname'],
-                    "status": row['status'],
-                    "scur": int(row['scur']) if row['scur'].isdigit() else 0,
-                    "smax": int(row['smax']) if row['smax'].isdigit() else 0,
-                    "stot": int(row['stot']) if row['stot'].isdigit() else 0,
-                    "bin": int(row['bin']) if row['bin'].isdigit() else 0,
-                    "bout": int(row['bout']) if row['bout'].isdigit() else 0,
-                    "ereq": int(row['ereq']) if row['ereq'].isdigit() else 0,
-                    "econ": int(row['econ']) if row['econ'].isdigit() else 0,
-                    "eresp": int(row['eresp']) if row['eresp'].isdigit() else 0,
-                    "wretr": int(row['wretr']) if row['wretr'].isdigit() else 0,
-                    "wredis": int(row['wredis']) if row['wredis'].isdigit() else 0,
-                    "weight": int(row['weight']) if row['weight'].isdigit() else 0,
-                    "act": int(row['act']) if row['act'].isdigit() else 0,
-                    "bck": int(row['bck']) if row['bck'].isdigit() else 0,
-                    "chkfail": int(row['chkfail']) if row['chkfail'].isdigit() else 0,
-                    "chkdown": int(row['chkdown']) if row['chkdown'].isdigit() else 0,
-                    "downtime": int(row['downtime']) if row['downtime'].isdigit() else 0,
-                    "rate": int(row['rate']) if row['rate'].isdigit() else 0,
-                    "rate_max": int(row['rate_max']) if row['rate_max'].isdigit() else 0,
-                    "hrsp_2xx": int(row['hrsp_2xx']) if row['hrsp_2xx'].isdigit() else 0,
-                    "hrsp_3xx": int(row['hrsp_3xx']) if row['hrsp_3xx'].isdigit() else 0,
-                    "hrsp_4xx": int(row['hrsp_4xx']) if row['hrsp_4xx'].isdigit() else 0,
-                    "hrsp_5xx": int(row['hrsp_5xx']) if row['hrsp_5xx'].isdigit() else 0,
-                    "cli_abrt": int(row['cli_abrt']) if row['cli_abrt'].isdigit() else 0,
-                    "srv_abrt": int(row['srv_abrt']) if row['srv_abrt'].isdigit() else 0,
-                    "lastsess": int(row['lastsess']) if row['lastsess'].isdigit() else 0,
-                    "qtime": int(row['qtime']) if row['qtime'].isdigit() else 0,
-                    "ctime": int(row['ctime']) if row['ctime'].isdigit() else 0,
-                    "rtime": int(row['rtime']) if row['rtime'].isdigit() else 0,
-                    "ttime": int(row['ttime']) if row['ttime'].isdigit() else 0,
-                    "check_status": row['check_status'],
-                    "check_code": int(row['check_code']) if row['check_code'].isdigit() else 0,
-                    "check_duration": int(row['check_duration']) if row['check_duration'].isdigit() else 0,
-                    "last_chk": row['last_chk'],
-                    "qtime_max": int(row['qtime_max']) if row['qtime_max'].isdigit() else 0,
-                    "ctime_max": int(row['ctime_max']) if row['ctime_max'].isdigit() else 0,
-                    "rtime_max": int(row['rtime_max']) if row['rtime_max'].isdigit() else 0,
-                    "ttime_max": int(row['ttime_max']) if row['ttime_max'].isdigit() else 0
-                })
-        return {"backends": backends}
-    except Exception as e:
-        logger.error(f"error getting HAProxy stats: {e}")
-        return {"backends": []}
-
-external_ip_cache = {}
-CACHE_DURATION = 300
-@lru_cache(maxsize=128)
-def get_geoip_location(address: str):
-    try:
-        reader = geoip2.database.Reader('GeoLite2-City.mmdb')
-        response = reader.city(address)
-        return {
-            "city": response.city.name,
-            "country": response.country.name,
-            "latitude": float(response.location.latitude),
-            "longitude": float(response.location.longitude)
-        }
-    except FileNotFoundError:
-        logger.warning("GeoLite2-City.mmdb not found. download from https://dev.maxmind.com/geoip/geoip2/geolite2/")
-        return {"city": "Unknown", "country": "Unknown", "latitude": 0, "longitude": 0}
-    except Exception as e:
-        logger.warning(f"GeoIP lookup failed: {e}")
-        return {"city": "Unknown", "country": "Unknown", "latitude": 0, "longitude": 0}
-
-dashboard_cache = {}
-DASHBOARD_CACHE_DURATION = 2
-
-def get_tor_external_ip(host_ip: str):
-    import time
-    cache_key = host_ip
-    if cache_key in external_ip_cache:
-        cached_data = external_ip_cache[cache_key]
-        if time.time() - cached_data['timestamp'] < CACHE_DURATION:
-            return cached_data['ip']
-    try:
-        import requests
-        session = requests.Session()
-        session.proxies = {
-            'http': f'socks5://{host_ip}:9050',
-            'https': f'socks5://{host_ip}:9050'
-        }
-        response = session.get('https://cloudflare.com/cdn-cgi/trace', timeout=5)
-        if response.status_code == 200:
-            for line in response.text.split('\n'):
-                if line.startswith('ip='):
-                    ip = line.split('=')[1]
-                    external_ip_cache[cache_key] = {
-                        'ip': ip,
-                        'timestamp': time.time()
-                    }
-                    return ip
-        return None
-    except Exception as e:
-        logger.warning(f"could not get external IP for {host_ip}: {e}")
-        return None
+    return haproxy.collect()
 
 def get_tor_host_circuits(host_id: str):
-    try:
-        reader = geoip2.database.Reader('GeoLite2-City.mmdb')
-    except FileNotFoundError:
-        logger.error("GeoLite2-City.mmdb not found")
-        return {
-            "error": "GeoLite2-City.mmdb not found. Download from https://dev.maxmind.com/geoip/geoip2/geolite2/ and place it in the app directory."
-        }
-    
-    tor_hosts = get_tor_containers()
-    tor_host = next((host for host in tor_hosts if host['id'] == host_id), None)
+    tor_host = registry.get(host_id)
     
     if not tor_host:
         return {"error": "Tor host not found"}
-    
+    return collect_host_circuits(tor_host)
+
+def collect_host_circuits(tor_host: Dict):
+    host_id = tor_host["id"]
     host_info = {
         "ip_address": tor_host["ip_address"],
         "hostname": tor_host["hostname"],
@@ -213,76 +89,72 @@ def get_tor_host_circuits(host_id: str):
         "state": tor_host["state"],
         "circuits": []
     }
-    max_retries = 3
-    retry_delay = 1
-    for attempt in range(max_retries):
-        try:
-            with Controller.from_port(address=tor_host["ip_address"], port=9051) as controller:
-                controller.authenticate(password="log4j2.enableJndiLookup")
-                for circ in sorted(controller.get_circuits()):
-                    if circ.status != CircStatus.BUILT:
-                        continue
-                    circuit_info = {
-                        "circuit_id": circ.id,
-                        "purpose": circ.purpose,
-                        "path": []
-                    }
-                    for i, entry in enumerate(circ.path):
-                        fingerprint, nickname = entry
-                        desc = controller.get_network_status(fingerprint, None)
-                        address = desc.address if desc else 'unknown'
-                        try:
-                            response = reader.city(address)
-                            location = {
-                                "country": response.country.name,
-                                "city": response.city.name,
-                                "latitude": response.location.latitude,
-                                "longitude": response.location.longitude
-                            }
-                        except Exception:
-                            location = {
-                                "country": "unknown",
-                                "city": "unknown",
-                                "latitude": None,
-                                "longitude": None
-                            }
-                        
-                        circuit_info["path"].append({
-                            "fingerprint": fingerprint,
-                            "nickname": nickname,
-                            "address": address,
-                            "location": location
-                        })
-
-                    host_info["circuits"].append(circuit_info)
-                if host_info["circuits"]:
-                    for circuit in host_info["circuits"]:
-                        if circuit["path"] and len(circuit["path"]) > 0:
-                            exit_node = circuit["path"][-1]
-                            host_info["external_ip"] = exit_node["address"]
-                            break
-                break
-                        
-        except Exception as e:
-            logger.warning(f"Attempt {attempt + 1} failed for {host_id}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2
-            else:
-                logger.error(f"All attempts failed for {host_id}: {e}")
-                host_info["error"] = str(e)
+    try:
+        with telemetry.time("controlport_circuits"):
+            session = pool.session(tor_host)
+            circuits = session.built_circuits()
+            streams = session.stream_counts()
+        host_info["timeToFirstCircuit"] = time_to_first_circuit(tor_host, session)
+        host_info["latency"] = session.latency.report()
+        controller = session.controller
+        with telemetry.time("relay_resolve"):
+            relay_index.ensure(controller)
+            relays = {}
+            for circ in circuits:
+                for fingerprint, nickname in circ.path:
+                    if fingerprint not in relays:
+                        relays[fingerprint] = relay_index.resolve(fingerprint, controller)
+        missing = {fp: relay.address for fp, relay in relays.items() if relay and relay.geo is None}
+        with telemetry.time("geo_lookup"):
+            locations = geo.lookup_many(missing.values())
+        for fingerprint, address in missing.items():
+            relay_index.set_geo(fingerprint, locations[address])
+        for circ in circuits:
+            circuit_info = {
+                "circuit_id": circ.id,
+                "purpose": circ.purpose,
+                "streams": streams.get(circ.id, 0),
+                "path": []
+            }
+            for fingerprint, nickname in circ.path:
+                relay = relays[fingerprint]
+                address = relay.address if relay else 'unknown'
+                location = (relay.geo or locations[address]) if relay else UNKNOWN_LOCATION
+                circuit_info["path"].append({
+                    "fingerprint": fingerprint,
+                    "nickname": nickname,
+                    "address": address,
+                    "location": location
+                })
+
+            host_info["circuits"].append(circuit_info)
+        host_info["external_ip"] = exits.record(tor_host, circuits, relays)["address"]
+    except Exception as e:
+        logger.error(f"could not read circuits for {host_id}: {e}")
+        host_info["error"] = str(e)
     
     return host_info
 
-def calculate_summary(tor_hosts: List[Dict], haproxy_stats: List[Dict]) -> Dict[str, Any]:
+collector = CircuitCollector(collect_host_circuits)
+
+def calculate_summary(tor_hosts: List[Dict], haproxy_stats: List[Dict], latency: Dict[str, Dict]) -> Dict[str, Any]:
+    servers = [stat for stat in haproxy_stats if stat.get('svname') not in ('BACKEND', 'FRONTEND')]
+    aggregates = [stat for stat in haproxy_stats if stat.get('svname') == 'BACKEND']
     total_circuits = sum(len(host.get('circuits', [])) for host in tor_hosts)
     active_circuits = sum(len([c for c in host.get('circuits', []) if c.get('purpose') != 'CLOSED']) for host in tor_hosts)
-    total_sessions = sum(stat.get('stot', 0) for stat in haproxy_stats)
-    total_bytes_in = sum(stat.get('bin', 0) for stat in haproxy_stats)
-    total_bytes_out = sum(stat.get('bout', 0) for stat in haproxy_stats)
-    average_latency = 999999  #TODO
-    healthy_backends = len([stat for stat in haproxy_stats if stat.get('status') == 'UP'])
-    total_backends = len(haproxy_stats)
+    total_sessions = sum(stat.get('stot', 0) for stat in servers)
+    total_bytes_in = sum(stat.get('bin', 0) for stat in servers)
+    total_bytes_out = sum(stat.get('bout', 0) for stat in servers)
+    # stream connect time as tor reports it, until a stream has been seen haproxy's ttime - the mean over each
+    # server's last 1024 sessions, weighted by how many each served
+    average_latency = latency['streamConnect']['mean']
+    if average_latency is None:
+        weighted = [(stat.get('ttime', 0), min(stat.get('stot', 0), 1024)) for stat in servers if stat.get('stot', 0) > 0]
+        weight = sum(w for _, w in weighted)
+        average_latency = round(sum(t * w for t, w in weighted) / weight, 1) if weight else 0
+    healthy_backends = len([stat for stat in servers if stat.get('status') == 'UP'])
+    total_backends = len(servers)
+    uptime = min((stat.get('lastchg', 0) for stat in aggregates if stat.get('status') == 'UP'), default=0)
     return {
         "totalCircuits": total_circuits,
         "activeCircuits": active_circuits,
@@ -290,31 +162,32 @@ def calculate_summary(tor_hosts: List[Dict], haproxy_stats: List[Dict]) -> Dict[
         "totalBytesIn": total_bytes_in,
         "totalBytesOut": total_bytes_out,
         "averageLatency": average_latency,
+        "latency": latency,
         "healthyBackends": healthy_backends,
         "totalBackends": total_backends,
-        "uptime": 0 #TODO
+        "uptime": uptime,
+        "sessionRate": round(sum(stat.get('sessRate', 0) for stat in servers), 3),
+        "bytesInRate": round(sum(stat.get('binRate', 0) for stat in servers), 1),
+        "bytesOutRate": round(sum(stat.get('boutRate', 0) for stat in servers), 1)
     }
 
 def rebuild_circuits_for_host(host_id: str):
     """Rebuild all circuits for a specific Tor host"""
     try:
-        tor_hosts = get_tor_containers()
-        tor_host = next((host for host in tor_hosts if host['id'] == host_id), None)
+        tor_host = registry.get(host_id)
         if not tor_host:
             return {"error": "tor host not found"}
         
-        with Controller.from_port(address=tor_host["ip_address"], port=9051) as controller:
-            controller.authenticate(password="log4j2.enableJndiLookup")
-            circuits = controller.get_circuits()
-            for circ in circuits:
-                if circ.status == CircStatus.BUILT:
-                    try:
-                        controller.close_circuit(circ.id)
-                    except Exception as e:
-                        logger.warning(f"could not close circuit {circ.id}: {e}")
-
-            controller.signal("NEWNYM")            
-            return {"success": True, "message": f"rebuilding circuits for {tor_host['hostname']}"}
+        session = pool.session(tor_host)
+        controller = session.connect()
+        for circ in session.built_circuits():
+            try:
+                controller.close_circuit(circ.id)
+            except Exception as e:
+                logger.warning(f"could not close circuit {circ.id}: {e}")
+
+        controller.signal("NEWNYM")            
+        return {"success": True, "message": f"rebuilding circuits for {tor_host['hostname']}"}
             
     except Exception as e:
         logger.error(f"error rebuilding circuits for host {host_id}: {e}")
@@ -323,42 +196,50 @@ def rebuild_circuits_for_host(host_id: str):
 def close_circuit(host_id: str, circuit_id: str):
     """close a specific circuit"""
     try:
-        tor_hosts = get_tor_containers()
-        tor_host = next((host for host in tor_hosts if host['id'] == host_id), None)
+        tor_host = registry.get(host_id)
         
         if not tor_host:
             return {"error": "Tor host not found"}
         
-        with Controller.from_port(address=tor_host["ip_address"], port=9051) as controller:
-            controller.authenticate(password="log4j2.enableJndiLookup")
-            circuit = next((c for c in controller.get_circuits() if c.id == circuit_id), None)
-            if not circuit:
-                return {"error": "circuit not found"}
-            controller.close_circuit(circuit_id)
-            return {"success": True, "message": f"closed circuit {circuit_id}"}
+        session = pool.session(tor_host)
+        controller = session.connect()
+        if circuit_id not in session.circuits:
+            return {"error": "circuit not found"}
+        controller.close_circuit(circuit_id)
+        return {"success": True, "message": f"closed circuit {circuit_id}"}
             
     except Exception as e:
         logger.error(f"error closing circuit {circuit_id} on host {host_id}: {e}")
         return {"error": str(e)}
 
-def rebuild_all_circuits():
-    """rebuild circuits for all Tor hosts"""
-    try:
-        tor_hosts = get_tor_containers()
-        results = []
-        for host in tor_hosts:
-            result = rebuild_circuits_for_host(host['id'])
-            results.append({
-                "host_id": host['id'],
-                "hostname": host['hostname'],
-                "result": result
-            })
-        
-        return {"success": True, "results": results}
-        
-    except Exception as e:
-        logger.error(f"Error rebuilding all circuits: {e}")
-        return {"error": str(e)}
+@app.on_event("startup")
+async def start_background_services():
+    if aggregator is not None:
+        aggregator.start()
+        snapshots.start()
+        publisher.start()
+        return
+    registry.start()
+    geo.open()
+    snapshots.start()
+    publisher.start()
+    health.start()
+    weighting.start()
+    if PREFETCH_FILE:
+        asyncio.create_task(prefetcher.load_file(PREFETCH_FILE))
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await bulk.stop()
+    await weighting.stop()
+    await health.stop()
+    await publisher.stop()
+    await snapshots.stop()
+    if aggregator is not None:
+        await aggregator.stop()
+    registry.stop()
+    pool.close_all()
+    geo.close()
 
 @app.get("/")
 async def root():
@@ -368,58 +249,177 @@ async def root():
 def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/health/backends")
+def get_backend_health():
+    return health.report()
+
+@app.get("/weights")
+def get_backend_weights():
+    return weighting.report()
+
 @app.get("/tor-hosts")
 def list_tor_hosts():
     tor_hosts = get_tor_containers()
     return tor_hosts
 
+@app.get("/registry")
+def get_registry_stats():
+    return registry.stats()
+
+@app.get("/bootstrap")
+def get_bootstrap_times():
+    """time from each tor container starting to its first built circuit"""
+    return bootstrap_report(registry, pool)
+
 @app.get("/haproxy-stats")
 def get_haproxy_stats_endpoint():
     return get_haproxy_stats()
 
+@app.get("/relays")
+def get_relay_index_stats():
+    return {**relay_index.stats(), "geo": geo.stats()}
+
+@app.get("/haproxy-stats/{pxname}/{svname}/history")
+def get_haproxy_backend_history(pxname: str, svname: str, samples: int = HISTORY_WINDOW):
+    window = haproxy.window(f"{pxname}/{svname}", samples)
+    if window is None:
+        raise HTTPException(status_code=404, detail="backend not found")
+    return window
+
+@app.get("/exits")
+async def get_exits(hosts: Optional[str] = None, refresh: bool = False):
+    """current exit relays per tor host from their built circuits, hosts is a comma separated list of ids or names"""
+    started = time.monotonic()
+    found = await exits.discover(hosts.split(",") if hosts else None, refresh)
+    return {
+        "hosts": found,
+        "addresses": sorted({entry['address'] for host in found for entry in host['exits'] if entry['address']}),
+        "duration": round(time.monotonic() - started, 3),
+        "cache": exits.stats()
+    }
+
+@app.get("/tor-hosts/{host_id}/exits")
+async def get_tor_host_exits(host_id: str, refresh: bool = False):
+    found = await exits.discover([host_id], refresh)
+    if not found:
+        raise HTTPException(status_code=404, detail="Tor host not found")
+    return found[0]
+
 @app.get("/tor-hosts/{host_id}/circuits")
 def get_tor_host_circuits_endpoint(host_id: str):
     return get_tor_host_circuits(host_id)
 
 
-@app.get("/dashboard-data")
-def get_dashboard_data():
-    cache_key = "dashboard_data"
-    current_time = time.time()
-    if cache_key in dashboard_cache:
-        cached_data, timestamp = dashboard_cache[cache_key]
-        if current_time - timestamp < DASHBOARD_CACHE_DURATION:
-            return cached_data
-    tor_hosts = get_tor_containers()
-    haproxy_data = get_haproxy_stats()
+async def build_dashboard_data():
+    with telemetry.time("containers"):
+        tor_hosts = get_tor_containers()
+    with telemetry.time("haproxy_stats"):
+        haproxy_data = await asyncio.to_thread(get_haproxy_stats)
     haproxy_stats = haproxy_data.get('backends', [])
-    tor_hosts_with_circuits = []
-    for host in tor_hosts:
-        circuits_data = get_tor_host_circuits(host['id'])
-        if 'error' in circuits_data:
-            tor_hosts_with_circuits.append({
-                **host,
-                "circuits": [],
-                "error": circuits_data['error']
-            })
-        else:
-            tor_hosts_with_circuits.append({
-                **host,
-                "external_ip": circuits_data.get('external_ip'),
-                "circuits": circuits_data.get('circuits', [])
-            })
+    with telemetry.time("circuits"):
+        tor_hosts_with_circuits = await collector.collect(tor_hosts)
     
-    summary = calculate_summary(tor_hosts_with_circuits, haproxy_stats)
+    summary = calculate_summary(tor_hosts_with_circuits, haproxy_stats, pool.latency.report(buckets=True))
+    summary["backendGroups"] = haproxy_data.get('groups', [])
+    summary["timeToFirstCircuit"] = bootstrap_report(registry, pool)["fleet"]
     
-    result = {
+    return {
         "torHosts": tor_hosts_with_circuits,
         "haproxyStats": haproxy_stats,
         "summary": summary,
         "lastUpdated": datetime.now().isoformat()
     }
-    dashboard_cache[cache_key] = (result, current_time)
+
+# node serves its own tor hosts, aggregator serves the merged feeds of the FEDERATION_NODES
+METRICS_MODE = os.getenv("METRICS_MODE", "node")
+aggregator = Aggregator(parse_nodes(FEDERATION_NODES)) if METRICS_MODE == "aggregator" else None
+
+snapshots = SnapshotService(aggregator.build if aggregator is not None else build_dashboard_data)
+publisher = SnapshotPublisher(snapshots)
+bulk = BulkEngine(registry, pool, publisher.broadcast)
+
+views = ViewEncoder()
+
+async def current_snapshot() -> Dict:
+    result = await snapshots.get()
+    if result is None:
+        raise HTTPException(status_code=503, detail=snapshots.last_error or "dashboard snapshot not ready")
     return result
 
+def snapshot_headers(data: Dict) -> Dict[str, str]:
+    meta = data['snapshot']
+    return {"X-Snapshot-Version": str(meta['version']), "X-Snapshot-Age": str(meta['age']), "X-Snapshot-Stale": str(meta['stale']).lower()}
+
+@app.get("/dashboard-data")
+async def get_dashboard_data(request: Request):
+    data = await current_snapshot()
+    return views.respond(request, (data['snapshot']['version'], data['snapshot']['stale']), lambda: {**data, "snapshot": body_meta(data['snapshot'])}, snapshot_headers(data))
+
+@app.get("/dashboard/summary")
+async def get_dashboard_summary(request: Request):
+    """the summary and section sizes, without any hosts or backends"""
+    data = await current_snapshot()
+    return views.respond(request, (data['snapshot']['version'], data['snapshot']['stale']), lambda: {
+        "summary": data['summary'],
+        "counts": {"torHosts": len(data['torHosts']), "haproxyStats": len(data['haproxyStats'])},
+        "lastUpdated": data['lastUpdated'],
+        "snapshot": body_meta(data['snapshot'])
+    }, snapshot_headers(data))
+
+@app.get("/dashboard/hosts")
+async def get_dashboard_hosts(request: Request, cursor: Optional[str] = None, limit: int = VIEW_PAGE_LIMIT, fields: Optional[str] = None,
+                              detail: str = "full", state: Optional[str] = None, healthy: Optional[bool] = None, q: Optional[str] = None):
+    """a page of tor hosts - detail=summary drops circuit paths, detail=none drops circuits, fields projects top-level keys"""
+    if detail not in ("full", "summary", "none"):
+        raise HTTPException(status_code=400, detail="detail must be full, summary or none")
+    data = await current_snapshot()
+
+    def build():
+        hosts = filter_hosts(data['torHosts'], state, healthy, q)
+        page, next_cursor = paginate(hosts, lambda host: host['hostname'], cursor, limit)
+        projection = parse_fields(fields)
+        return {"items": [host_view(host, projection, detail) for host in page], "nextCursor": next_cursor, "total": len(hosts)}
+
+    return views.respond(request, data['snapshot']['version'], build, snapshot_headers(data))
+
+@app.get("/dashboard/backends")
+async def get_dashboard_backends(request: Request, cursor: Optional[str] = None, limit: int = VIEW_PAGE_LIMIT, fields: Optional[str] = None,
+                                 pxname: Optional[str] = None, status: Optional[str] = None, q: Optional[str] = None):
+    """a page of haproxy rows across every backend group, fields projects columns"""
+    data = await current_snapshot()
+
+    def build():
+        backends = filter_backends(data['haproxyStats'], pxname, status, q)
+        page, next_cursor = paginate(backends, backend_key, cursor, limit)
+        projection = parse_fields(fields)
+        return {"items": [project(stat, projection) for stat in page], "nextCursor": next_cursor, "total": len(backends)}
+
+    return views.respond(request, data['snapshot']['version'], build, snapshot_headers(data))
+
+def require_aggregator() -> Aggregator:
+    if aggregator is None:
+        raise HTTPException(status_code=404, detail="not running in aggregator mode")
+    return aggregator
+
+@app.get("/fleet/nodes")
+def get_fleet_nodes():
+    now = time.monotonic()
+    return {"nodes": [node.status(now) for node in require_aggregator().nodes]}
+
+@app.get("/fleet/capacity")
+def get_fleet_capacity():
+    return require_aggregator().capacity()
+
+exporter = MetricsExporter()
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    """prometheus text exposition of haproxy servers, tor hosts and collection stage timings"""
+    await snapshots.get()
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    body = exporter.render(snapshots.snapshot, snapshots.meta(), compress)
+    return Response(content=body, media_type=CONTENT_TYPE, headers={"Content-Encoding": "gzip"} if compress else {})
+
 @app.post("/tor-hosts/{host_id}/rebuild-circuits")
 def rebuild_host_circuits(host_id: str):
     """rebuild all circuits for a specific Tor host"""
@@ -437,41 +437,92 @@ def close_circuit_endpoint(circuit_id: str, host_id: str):
     return result
 
 @app.post("/circuits/rebuild-all")
-def rebuild_all_circuits_endpoint():
-    """rebuild circuits for all Tor hosts"""
-    result = rebuild_all_circuits()
-    if "error" in result:
-        raise HTTPException(status_code=500, detail=result["error"])
-    return result
+async def rebuild_all_circuits_endpoint():
+    """rebuild circuits for all Tor hosts, a fraction of the fleet at a time - progress streams over /ws"""
+    try:
+        job = bulk.submit("rebuild")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "job": job.progress()}
+
+class BulkRequest(BaseModel):
+    hosts: Optional[List[str]] = None
+    concurrency: Optional[int] = None
+    fraction: float = BULK_MAX_FRACTION
+    stagger: float = BULK_STAGGER
+
+@app.post("/bulk/{operation}")
+async def start_bulk_operation(operation: str, request: BulkRequest):
+    """rebuild, newnym or close across many hosts with bounded concurrency"""
+    try:
+        job = bulk.submit(operation, request.hosts, request.concurrency, request.fraction, request.stagger)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.progress()
+
+@app.get("/bulk")
+def list_bulk_jobs():
+    return {"jobs": [job.progress() for job in reversed(bulk.jobs.values())]}
+
+@app.get("/bulk/{job_id}")
+def get_bulk_job(job_id: str):
+    job = bulk.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="bulk job not found")
+    return job.report()
 
 @app.post("/tor-hosts/{host_id}/new-identity")
 def new_identity(host_id: str):
     """request new identity for a Tor host (triggers circuit rebuild)"""
     try:
-        tor_hosts = get_tor_containers()
-        tor_host = next((host for host in tor_hosts if host['id'] == host_id), None)
+        tor_host = registry.get(host_id)
         if not tor_host:
             raise HTTPException(status_code=404, detail="Tor host not found")
-        with Controller.from_port(address=tor_host["ip_address"], port=9051) as controller:
-            controller.authenticate(password="log4j2.enableJndiLookup")
-            controller.signal("NEWNYM")
-            return {"success": True, "message": f"New identity requested for {tor_host['hostname']}"}
+        pool.controller(tor_host).signal("NEWNYM")
+        return {"success": True, "message": f"New identity requested for {tor_host['hostname']}"}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error requesting new identity for host {host_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class PrefetchRequest(BaseModel):
+    targets: List[str]
+    hosts: Optional[List[str]] = None
+    connect: bool = True
+
+@app.post("/prefetch")
+async def start_prefetch(request: PrefetchRequest):
+    """fetch descriptors and build rendezvous circuits for onions ahead of traffic"""
+    try:
+        job = prefetcher.submit(request.targets, request.hosts, request.connect)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.report(detail=False)
+
+@app.get("/prefetch")
+def list_prefetch_jobs():
+    return {"jobs": [job.report(detail=False) for job in reversed(prefetcher.jobs.values())]}
+
+@app.get("/prefetch/{job_id}")
+def get_prefetch_job(job_id: str):
+    job = prefetcher.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="prefetch job not found")
+    return job.report()
+
+@app.get("/ws/stats")
+def websocket_stats():
+    return {**publisher.stats(), "views": views.stats()}
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    client = await publisher.connect(websocket)
     try:
         while True:
-            dashboard_data = get_dashboard_data()
-            await manager.broadcast({
-                "type": "dashboard_update",
-                "data": dashboard_data,
-                "timestamp": datetime.now().isoformat()
-            })
-            await asyncio.sleep(5)
+            await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        publisher.disconnect(client)
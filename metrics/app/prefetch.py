@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import re
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from controlpool import ControllerPool
+from registry import ContainerRegistry
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_FILE = os.getenv("PREFETCH_FILE")
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "16"))
+PREFETCH_TIMEOUT = float(os.getenv("PREFETCH_TIMEOUT", "60"))
+PREFETCH_MAX_JOBS = int(os.getenv("PREFETCH_MAX_JOBS", "20"))
+TOR_SOCKS_PORT = 9050
+
+ONION_PATTERN = re.compile(r"^(?:[a-z0-9-]+\.)*([a-z2-7]{56})\.onion$")
+
+def parse_target(target: str) -> Optional[Tuple[str, int]]:
+    """(service id, port) from an onion address or url, None if it isn't a v3 onion"""
+    target = target.strip().lower()
+    scheme, _, rest = target.rpartition("://")
+    hostport = rest.split("/", 1)[0]
+    host, _, port = hostport.partition(":")
+    match = ONION_PATTERN.match(host)
+    if not match:
+        return None
+    default_port = 443 if scheme == "https" else 80
+    return match.group(1), int(port) if port.isdigit() else default_port
+
+async def socks_connect(address: str, socks_port: int, onion: str, port: int) -> None:
+    """open and drop a stream to the onion through one tor socksport so the rendezvous circuit gets built"""
+    reader, writer = await asyncio.open_connection(address, socks_port)
+    try:
+        writer.write(b"\x05\x01\x00")
+        await writer.drain()
+        if await reader.readexactly(2) != b"\x05\x00":
+            raise ConnectionError("socksport refused no-auth")
+        host = f"{onion}.onion".encode()
+        writer.write(b"\x05\x01\x00\x03" + bytes([len(host)]) + host + struct.pack(">H", port))
+        await writer.drain()
+        reply = await reader.readexactly(4)
+        if reply[1] != 0x00:
+            raise ConnectionError(f"socks connect failed with reply {reply[1]:#04x}")
+    finally:
+        writer.close()
+
+class PrefetchJob:
+    def __init__(self, targets: List[Tuple[str, int]], hosts: List[Dict], connect: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.targets = targets
+        self.hosts = hosts
+        self.connect = connect
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.results: Dict[str, Dict[str, Dict]] = {onion: {} for onion, _ in targets}
+
+    def report(self, detail: bool = True) -> Dict:
+        targets = []
+        for onion, port in self.targets:
+            results = self.results[onion]
+            warm = [r for r in results.values() if r['status'] == "warm"]
+            fetches = sorted(r['descriptorMs'] for r in warm if r.get('descriptorMs') is not None)
+            connects = sorted(r['connectMs'] for r in warm if r.get('connectMs') is not None)
+            entry = {
+                "target": f"{onion}.onion",
+                "port": port,
+                "status": "warm" if warm and len(warm) == len(self.hosts) else "partial" if warm else "pending" if len(results) < len(self.hosts) else "cold",
+                "warmHosts": len(warm),
+                "descriptorMs": {"median": fetches[len(fetches) // 2], "max": fetches[-1]} if fetches else None,
+                "connectMs": {"median": connects[len(connects) // 2], "max": connects[-1]} if connects else None
+            }
+            if detail:
+                entry["hosts"] = results
+            targets.append(entry)
+        return {
+            "id": self.id,
+            "created": self.created,
+            "finished": self.finished,
+            "hosts": len(self.hosts),
+            "done": sum(len(r) for r in self.results.values()),
+            "total": len(self.targets) * len(self.hosts),
+            "targets": targets
+        }
+
+class Prefetcher:
+    """warms onion services across tor instances: descriptor fetch over the controlport, then a throwaway stream"""
+
+    def __init__(self, registry: ContainerRegistry, pool: ControllerPool, concurrency: int = PREFETCH_CONCURRENCY):
+        self.registry = registry
+        self.pool = pool
+        self.concurrency = concurrency
+        self.jobs: "OrderedDict[str, PrefetchJob]" = OrderedDict()
+
+    def submit(self, targets: List[str], hosts: Optional[List[str]] = None, connect: bool = True) -> PrefetchJob:
+        parsed = list(OrderedDict.fromkeys(t for t in (parse_target(target) for target in targets) if t))
+        if not parsed:
+            raise ValueError("no valid v3 onion addresses in targets")
+        tor_hosts = [self.registry.get(key) for key in hosts] if hosts else self.registry.hosts()
+        tor_hosts = [host for host in tor_hosts if host]
+        if not tor_hosts:
+            raise ValueError("no tor hosts to prefetch through")
+        job = PrefetchJob(parsed, tor_hosts, connect)
+        self.jobs[job.id] = job
+        while len(self.jobs) > PREFETCH_MAX_JOBS:
+            self.jobs.popitem(last=False)
+        asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: PrefetchJob):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        await asyncio.gather(*(self._warm(job, semaphore, onion, port, host) for onion, port in job.targets for host in job.hosts))
+        job.finished = time.time()
+        logger.info(f"prefetch {job.id} warmed {len(job.targets)} targets across {len(job.hosts)} hosts in {time.monotonic() - started:.1f}s")
+
+    async def _warm(self, job: PrefetchJob, semaphore: asyncio.Semaphore, onion: str, port: int, host: Dict):
+        async with semaphore:
+            result: Dict = {"hostname": host['hostname']}
+            stage = "descriptor"
+            try:
+                controller = await asyncio.to_thread(self.pool.controller, host)
+                started = time.monotonic()
+                # no default, so a failed or timed out fetch raises instead of coming back as None
+                await asyncio.to_thread(controller.get_hidden_service_descriptor, onion, servers=None, await_result=True, timeout=PREFETCH_TIMEOUT)
+                result["descriptorMs"] = round((time.monotonic() - started) * 1000, 1)
+                if job.connect:
+                    stage = "connect"
+                    started = time.monotonic()
+                    # socksports are isolated from each other, so each one needs its own rendezvous
+                    await asyncio.wait_for(asyncio.gather(*(
+                        socks_connect(host['ip_address'], socks_port, onion, port)
+                        for socks_port in host.get('socks_ports') or [TOR_SOCKS_PORT]
+                    )), PREFETCH_TIMEOUT)
+                    result["connectMs"] = round((time.monotonic() - started) * 1000, 1)
+                result["status"] = "warm"
+            except Exception as e:
+                result.update(status="cold", failedAt=stage, error=str(e) or e.__class__.__name__)
+            job.results[onion][host['id']] = result
+
+    async def load_file(self, path: str, wait: float = 60) -> Optional[PrefetchJob]:
+        """submit the onions listed in a file, one per line, once the registry has seen some tor hosts"""
+        with open(path) as file:
+            targets = [line for line in file if line.strip() and not line.lstrip().startswith("#")]
+        deadline = time.monotonic() + wait
+        while not self.registry.hosts() and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+        try:
+            job = self.submit(targets)
+        except ValueError as e:
+            logger.warning(f"prefetch file {path} skipped: {e}")
+            return None
+        logger.info(f"prefetching {len(job.targets)} onions from {path} as job {job.id}")
+        return job
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from fastapi import WebSocket
+
+from snapshot import SnapshotService, body_meta
+
+logger = logging.getLogger(__name__)
+
+WS_PUBLISH_INTERVAL = float(os.getenv("WS_PUBLISH_INTERVAL", "2"))
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "4"))
+# out-of-band messages like bulk job progress can't be coalesced, so they get their own, larger allowance
+WS_MESSAGE_QUEUE_SIZE = int(os.getenv("WS_MESSAGE_QUEUE_SIZE", "1024"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+# timing fields that move on every collection, they ride along with hosts that changed otherwise
+VOLATILE_HOST_FIELDS = ("lastCollected", "collectDuration")
+
+def backend_key(stat: Dict) -> str:
+    return f"{stat['pxname']}/{stat['svname']}"
+
+def host_signature(host: Dict) -> Dict:
+    return {k: v for k, v in host.items() if k not in VOLATILE_HOST_FIELDS}
+
+class PublishedState:
+    """one published snapshot, indexed for diffing, with its full frame serialized at most once"""
+
+    def __init__(self, version: int, snapshot: Dict, meta: Dict):
+        self.version = version
+        self.snapshot = snapshot
+        self.meta = meta
+        self.hosts = {host['id']: host for host in snapshot.get('torHosts', [])}
+        self.signatures = {host_id: host_signature(host) for host_id, host in self.hosts.items()}
+        self.backends = {backend_key(stat): stat for stat in snapshot.get('haproxyStats', [])}
+        self._full_frame: Optional[str] = None
+
+    def full_frame(self) -> str:
+        if self._full_frame is None:
+            self._full_frame = json.dumps({
+                "type": "dashboard_update",
+                "version": self.version,
+                "data": {**self.snapshot, "snapshot": self.meta},
+                "timestamp": datetime.now().isoformat()
+            })
+        return self._full_frame
+
+    def delta_frame(self, previous: "PublishedState") -> str:
+        changed_hosts = [self.hosts[host_id] for host_id, sig in self.signatures.items() if previous.signatures.get(host_id) != sig]
+        removed_hosts = [host_id for host_id in previous.hosts if host_id not in self.hosts]
+        order = list(self.hosts)
+        changed_backends = [stat for key, stat in self.backends.items() if previous.backends.get(key) != stat]
+        removed_backends = [key for key in previous.backends if key not in self.backends]
+        frame: Dict[str, Any] = {
+            "type": "dashboard_delta",
+            "version": self.version,
+            "baseVersion": previous.version,
+            "hosts": {"order": order if order != list(previous.hosts) else None, "changed": changed_hosts, "removed": removed_hosts},
+            "backends": {"changed": changed_backends, "removed": removed_backends},
+            "lastUpdated": self.snapshot.get('lastUpdated'),
+            "snapshot": self.meta,
+            "timestamp": datetime.now().isoformat()
+        }
+        if self.snapshot.get('summary') != previous.snapshot.get('summary'):
+            frame["summary"] = self.snapshot.get('summary')
+        return json.dumps(frame)
+
+class Client:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # (is a snapshot frame, frame) - the publisher bounds each kind itself
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.snapshot_frames = 0
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.connected_at = time.time()
+
+class SnapshotPublisher:
+    """a single producer that fans each snapshot out to every websocket client as one serialized delta"""
+
+    def __init__(self, snapshots: SnapshotService, interval: float = WS_PUBLISH_INTERVAL):
+        self.snapshots = snapshots
+        self.interval = interval
+        self.clients: Set[Client] = set()
+        self.state: Optional[PublishedState] = None
+        self.updated = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.evicted = 0
+        snapshots.listeners.append(lambda _: self.updated.set())
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for client in list(self.clients):
+            self.disconnect(client)
+
+    async def connect(self, websocket: WebSocket) -> Client:
+        await websocket.accept()
+        client = Client(websocket)
+        self.clients.add(client)
+        client.task = asyncio.create_task(self._send_loop(client))
+        # before the first publish the producer loop sends everyone a full frame
+        if self.state is not None:
+            self._enqueue(client, self.state.full_frame())
+        return client
+
+    def disconnect(self, client: Client):
+        if client in self.clients:
+            self.clients.discard(client)
+            if client.task is not None and client.task is not asyncio.current_task():
+                client.task.cancel()
+
+    def _advance(self) -> Optional[PublishedState]:
+        """index the latest snapshot, returning the state it replaces"""
+        previous = self.state
+        self.state = PublishedState(self.snapshots.version, self.snapshots.snapshot, body_meta(self.snapshots.meta()))
+        return previous
+
+    async def _run(self):
+        while True:
+            await self.updated.wait()
+            self.updated.clear()
+            if self.snapshots.snapshot is not None and (self.state is None or self.state.version != self.snapshots.version):
+                previous = self._advance()
+                if self.clients:
+                    frame = self.state.delta_frame(previous) if previous is not None else self.state.full_frame()
+                    for client in list(self.clients):
+                        self._enqueue(client, frame)
+            await asyncio.sleep(self.interval)
+
+    def _enqueue(self, client: Client, frame: str):
+        if client.snapshot_frames >= WS_QUEUE_SIZE:
+            # a slow client can't apply deltas it never received, so its snapshot backlog coalesces into one full frame -
+            # out-of-band messages aren't superseded by it and stay queued in order
+            kept = []
+            while not client.queue.empty():
+                item = client.queue.get_nowait()
+                if item[0]:
+                    client.dropped += 1
+                else:
+                    kept.append(item)
+            for item in kept:
+                client.queue.put_nowait(item)
+            client.snapshot_frames = 0
+            frame = self.state.full_frame()
+        client.queue.put_nowait((True, frame))
+        client.snapshot_frames += 1
+
+    async def _send_loop(self, client: Client):
+        try:
+            while True:
+                snapshot, frame = await client.queue.get()
+                if snapshot:
+                    client.snapshot_frames -= 1
+                await asyncio.wait_for(client.websocket.send_text(frame), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"evicting websocket client: {e!r}")
+            self.evicted += 1
+            self.disconnect(client)
+            try:
+                await client.websocket.close()
+            except Exception:
+                pass
+
+    async def broadcast(self, message: Dict):
+        """send an out-of-band message to every client, serialized once"""
+        frame = json.dumps(message)
+        for client in list(self.clients):
+            if client.queue.qsize() - client.snapshot_frames >= WS_MESSAGE_QUEUE_SIZE:
+                client.dropped += 1
+            else:
+                client.queue.put_nowait((False, frame))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self.clients),
+            "version": self.state.version if self.state else None,
+            "evicted": self.evicted,
+            "dropped": sum(client.dropped for client in self.clients)
+        }
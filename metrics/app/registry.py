@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import docker
+
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+TOR_NETWORK = "net_tor"
+TOR_SOCKS_PORT = 9050
+RECONNECT_BACKOFF_MAX = 30
+
+def socks_ports(container) -> List[int]:
+    """the socksports a tor container opens per its TOR_SOCKS_PORTS, 9050 then 9052 upwards as tor/entrypoint.sh lays them out"""
+    env = dict(item.split("=", 1) for item in container.attrs.get("Config", {}).get("Env") or [] if "=" in item)
+    count = max(1, int(env.get("TOR_SOCKS_PORTS", "1") or 1))
+    return [TOR_SOCKS_PORT] + [TOR_SOCKS_PORT + 1 + i for i in range(1, count)]
+
+def parse_docker_time(value: Optional[str]) -> Optional[float]:
+    """epoch seconds from docker's nanosecond RFC 3339 timestamps, None for the zero time"""
+    if not value or value.startswith("0001-"):
+        return None
+    stamp, _, fraction = value.rstrip('Z').partition('.')
+    started = datetime.strptime(stamp, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    return started + float(f"0.{fraction}") if fraction.isdigit() else started
+
+def describe_container(container, network: str = TOR_NETWORK) -> Optional[Dict]:
+    """the host record for a tor container on network, or None if it isn't one"""
+    if container.attrs.get('Config', {}).get('User') != 'tor':
+        return None
+    networks = container.attrs.get('NetworkSettings', {}).get('Networks') or {}
+    if network not in networks:
+        return None
+    return {
+        "id": container.short_id,
+        "ip_address": networks[network]['IPAddress'],
+        "hostname": container.name,
+        "socks_ports": socks_ports(container),
+        "started_at": parse_docker_time(container.attrs.get('State', {}).get('StartedAt')),
+        "image": container.image.tags[0] if container.image.tags else container.image.short_id,
+        "state": container.status
+    }
+
+class ContainerRegistry:
+    """tor containers on net_tor, seeded once and kept current from the docker events stream"""
+
+    def __init__(self, client_factory: Callable = docker.from_env, network: str = TOR_NETWORK):
+        self.client_factory = client_factory
+        self.network = network
+        self.lock = threading.Lock()
+        self.by_id: Dict[str, Dict] = {}
+        self.by_hostname: Dict[str, Dict] = {}
+        self.by_address: Dict[str, Dict] = {}
+        # sorted lazily, a scale-up of many containers shouldn't re-sort the fleet once per event
+        self.sorted_hosts: Optional[List[Dict]] = []
+        self.listeners: List[Callable] = []
+        self.client = None
+        self.stream = None
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+        self.synced_at: Optional[float] = None
+        self.events_seen = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._watch, name="container-registry", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except Exception:
+                pass
+
+    def seed(self):
+        """replace the registry with a full containers.list from the daemon"""
+        with telemetry.time("docker_list"):
+            containers = self.client.containers.list(filters={"network": self.network})
+        hosts = [host for host in (describe_container(c, self.network) for c in containers) if host]
+        with self.lock:
+            self.by_id = {host['id']: host for host in hosts}
+            self.by_hostname = {host['hostname']: host for host in hosts}
+            self.by_address = {host['ip_address']: host for host in hosts}
+            self.sorted_hosts = None
+        self.synced_at = time.time()
+        logger.info(f"container registry seeded with {len(hosts)} tor containers")
+        self._notify()
+
+    def _watch(self):
+        backoff = 1
+        while self.running:
+            try:
+                self.client = self.client_factory()
+                since = int(time.time())
+                self.seed()
+                self.stream = self.client.events(decode=True, since=since, filters={"type": ["container", "network"]})
+                backoff = 1
+                for event in self.stream:
+                    self.events_seen += 1
+                    self._apply(event)
+            except Exception as e:
+                if not self.running:
+                    break
+                logger.warning(f"docker events stream failed, resyncing in {backoff}s: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def _apply(self, event: Dict):
+        action = event.get('Action') or event.get('status', '')
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        if event.get('Type') == 'network':
+            if attributes.get('name') != self.network or 'container' not in attributes:
+                return
+            container_id = attributes['container']
+            if action == 'disconnect':
+                self._remove(container_id)
+            elif action == 'connect':
+                self._refresh(container_id)
+            return
+        container_id = event.get('Actor', {}).get('ID') or event.get('id', '')
+        if action in ('die', 'destroy'):
+            self._remove(container_id)
+        elif action in ('start', 'restart', 'unpause', 'pause', 'rename', 'kill', 'stop'):
+            # kill fires for any signal, a HUP leaves tor running - inspecting drops it only if it really exited
+            self._refresh(container_id)
+
+    def _refresh(self, container_id: str):
+        try:
+            with telemetry.time("docker_inspect"):
+                container = self.client.containers.get(container_id)
+        except Exception as e:
+            logger.warning(f"could not inspect container {container_id[:12]}: {e}")
+            return
+        host = describe_container(container, self.network)
+        if host is None or container.status not in ('running', 'paused'):
+            self._remove(container_id)
+            return
+        with self.lock:
+            previous = self.by_id.get(host['id'])
+            if previous is not None:
+                # a rename or a new address leaves stale keys behind unless the old record is unindexed first
+                self._unindex(previous)
+            self._index(host)
+        self._notify()
+
+    def _remove(self, container_id: str):
+        with self.lock:
+            host = self.by_id.get(container_id[:12])
+            if host is None:
+                return
+            self._unindex(host)
+        self._notify()
+
+    def _index(self, host: Dict):
+        self.by_id[host['id']] = host
+        self.by_hostname[host['hostname']] = host
+        self.by_address[host['ip_address']] = host
+        self.sorted_hosts = None
+
+    def _unindex(self, host: Dict):
+        self.by_id.pop(host['id'], None)
+        # a name or address may already belong to a newer container, only this host's own entries go
+        if self.by_hostname.get(host['hostname']) is host:
+            del self.by_hostname[host['hostname']]
+        if self.by_address.get(host['ip_address']) is host:
+            del self.by_address[host['ip_address']]
+        self.sorted_hosts = None
+
+    def _notify(self):
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logger.warning(f"registry listener failed: {e}")
+
+    def hosts(self) -> List[Dict]:
+        with self.lock:
+            if self.sorted_hosts is None:
+                self.sorted_hosts = sorted(self.by_id.values(), key=lambda x: x['hostname'])
+            return list(self.sorted_hosts)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """look a tor host up by container id or hostname"""
+        return self.by_id.get(key) or self.by_hostname.get(key)
+
+    def stats(self) -> Dict:
+        return {
+            "containers": len(self.by_id),
+            "syncedAt": self.synced_at,
+            "eventsSeen": self.events_seen,
+            "watching": self.stream is not None and self.running
+        }
@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from stem.control import Controller, EventType
+
+from geo import UNKNOWN_LOCATION
+
+logger = logging.getLogger(__name__)
+
+class Relay(NamedTuple):
+    address: str
+    nickname: str
+    flags: Tuple[str, ...]
+    geo: Optional[Dict]
+
+class RelayIndex:
+    """a fingerprint -> relay table loaded once from the consensus and shared by every tor host"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.relays: Dict[str, Relay] = {}
+        self.source: Optional[Controller] = None
+        self.loaded_at: Optional[float] = None
+        self.misses = 0
+
+    def ensure(self, controller: Controller):
+        """load the consensus through controller unless a live controller already feeds the index"""
+        if self.source is not None and self.source.is_alive():
+            return
+        with self.lock:
+            if self.source is not None and self.source.is_alive():
+                return
+            started = time.monotonic()
+            self._replace(controller.get_network_statuses())
+            controller.add_event_listener(self._on_consensus, EventType.NEWCONSENSUS)
+            self.source = controller
+            logger.info(f"relay index loaded {len(self.relays)} relays in {time.monotonic() - started:.2f}s")
+
+    def _on_consensus(self, event):
+        self._replace(event.desc)
+        logger.info(f"relay index refreshed with {len(self.relays)} relays")
+
+    def _replace(self, entries):
+        previous = self.relays
+        relays = {}
+        for entry in entries:
+            old = previous.get(entry.fingerprint)
+            geo = old.geo if old is not None and old.address == entry.address else None
+            relays[entry.fingerprint] = Relay(entry.address, entry.nickname, tuple(entry.flags), geo)
+        self.relays = relays
+        self.loaded_at = time.time()
+
+    def resolve(self, fingerprint: str, controller: Optional[Controller] = None) -> Optional[Relay]:
+        """look a relay up, falling back to a single controlport query for relays newer than the index"""
+        relay = self.relays.get(fingerprint)
+        if relay is not None or controller is None:
+            return relay
+        self.misses += 1
+        desc = controller.get_network_status(fingerprint, None)
+        if desc is None:
+            return None
+        relay = Relay(desc.address, desc.nickname, tuple(desc.flags), None)
+        self.relays[fingerprint] = relay
+        return relay
+
+    def set_geo(self, fingerprint: str, geo: Dict):
+        relay = self.relays.get(fingerprint)
+        # the fallback isn't an answer, the relay is looked up again until the database has one
+        if relay is not None and geo is not UNKNOWN_LOCATION:
+            self.relays[fingerprint] = relay._replace(geo=geo)
+
+    def stats(self) -> Dict:
+        return {
+            "relays": len(self.relays),
+            "loadedAt": self.loaded_at,
+            "misses": self.misses
+        }
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_REFRESH_INTERVAL = float(os.getenv("DASHBOARD_REFRESH_INTERVAL", "2"))
+DASHBOARD_MAX_AGE = float(os.getenv("DASHBOARD_MAX_AGE", str(DASHBOARD_REFRESH_INTERVAL * 3)))
+
+def body_meta(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """snapshot metadata for bodies that are cached or replayed - age would freeze there, so it only goes out as X-Snapshot-Age"""
+    return {k: v for k, v in meta.items() if k != "age"}
+
+class SnapshotService:
+    """build dashboard snapshots one at a time in the background and always serve the last good one"""
+
+    def __init__(self, build: Callable[[], Awaitable[Dict]], interval: float = DASHBOARD_REFRESH_INTERVAL, max_age: float = DASHBOARD_MAX_AGE):
+        self.build = build
+        self.interval = interval
+        self.max_age = max_age
+        self.snapshot: Optional[Dict] = None
+        self.version = 0
+        self.built_at: Optional[float] = None
+        self.build_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.inflight: Optional[asyncio.Task] = None
+        self.task: Optional[asyncio.Task] = None
+        self.listeners = []
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # the build runs apart from the loop that started it, so it's cancelled on its own - no collection outlives shutdown
+        tasks = [task for task in (self.task, self.inflight) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+        self.inflight = None
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self):
+        """build a new snapshot, or join the build already in flight"""
+        if self.inflight is None:
+            self.inflight = asyncio.create_task(self._build())
+        await asyncio.shield(self.inflight)
+
+    async def _build(self):
+        started = time.monotonic()
+        try:
+            snapshot = await self.build()
+        except Exception as e:
+            logger.error(f"error building dashboard snapshot: {e}")
+            self.last_error = str(e)
+            return
+        finally:
+            self.inflight = None
+        self.snapshot = snapshot
+        self.version += 1
+        self.built_at = time.monotonic()
+        self.build_duration = self.built_at - started
+        telemetry.observe("snapshot_build", self.build_duration)
+        self.last_error = None
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logger.warning(f"snapshot listener failed: {e}")
+
+    def age(self) -> Optional[float]:
+        return None if self.built_at is None else time.monotonic() - self.built_at
+
+    def meta(self) -> Dict[str, Any]:
+        age = self.age()
+        return {
+            "version": self.version,
+            "age": round(age, 3) if age is not None else None,
+            "buildDuration": round(self.build_duration, 3) if self.build_duration is not None else None,
+            "stale": age is None or age > self.max_age,
+            "error": self.last_error
+        }
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        """the latest snapshot with its age and build metadata, or None if none could be built yet"""
+        if self.snapshot is None:
+            await self.refresh()
+        elif self.age() > self.max_age and self.inflight is None:
+            self.inflight = asyncio.create_task(self._build())
+        if self.snapshot is None:
+            return None
+        return {**self.snapshot, "snapshot": self.meta()}
@@ -0,0 +1,178 @@
+import gzip
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from a cached relay lookup up to a controlport that hits the collection deadline
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (metric suffix, haproxy csv field, type, help) exported for every haproxy server row
+SERVER_METRICS: Tuple[Tuple[str, str, str, str], ...] = (
+    ("current_sessions", "scur", "gauge", "current sessions"),
+    ("max_sessions", "smax", "gauge", "highest concurrent sessions"),
+    ("sessions_total", "stot", "counter", "sessions handled"),
+    ("bytes_in_total", "bin", "counter", "bytes received from clients"),
+    ("bytes_out_total", "bout", "counter", "bytes sent to clients"),
+    ("connection_errors_total", "econ", "counter", "failed connections to the tor socksport"),
+    ("response_errors_total", "eresp", "counter", "aborted or failed responses"),
+    ("retry_warnings_total", "wretr", "counter", "connection retries"),
+    ("redispatch_warnings_total", "wredis", "counter", "sessions redispatched to another server"),
+    ("check_failures_total", "chkfail", "counter", "failed health checks"),
+    ("downtime_seconds_total", "downtime", "counter", "seconds spent down"),
+    ("weight", "weight", "gauge", "effective weight"),
+    ("connect_time_average_seconds", "ctime", "gauge", "mean connect time over the last 1024 sessions"),
+    ("total_time_average_seconds", "ttime", "gauge", "mean session time over the last 1024 sessions"),
+)
+# haproxy reports these in milliseconds
+MILLISECOND_FIELDS = ("ctime", "ttime")
+# (summary latency kind, metric name) and (quantile label, report field) for the controlport event timings
+LATENCY_METRICS = (("circuitBuild", "circuit_build"), ("streamAttach", "stream_attach"), ("streamConnect", "stream_connect"))
+LATENCY_QUANTILES = (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def family(name: str, kind: str, help: str, samples: Iterable[Tuple[str, float]]) -> List[str]:
+    """one metric family in the text exposition format, samples as (label string, value)"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}" for labels, value in samples)
+    return lines
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels: str) -> List[Tuple[str, str, float]]:
+        """(suffix, labels, value) rows with cumulative buckets"""
+        rows = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            rows.append(("_bucket", f'{labels},le="{"+Inf" if bound == float("inf") else bound}"', cumulative))
+        rows.append(("_sum", labels, round(self.sum, 6)))
+        rows.append(("_count", labels, self.count))
+        return rows
+
+class Telemetry:
+    """time spent in each collection stage and counts of how collection went, shared by every module on the path"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, str], int] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count(self, name: str, result: str, n: int = 1):
+        with self.lock:
+            self.counters[(name, result)] = self.counters.get((name, result), 0) + n
+
+    def render(self) -> List[str]:
+        with self.lock:
+            rows = [(stage, suffix, labels, value) for stage, histogram in sorted(self.stages.items())
+                    for suffix, labels, value in histogram.samples(f'stage="{escape(stage)}"')]
+            counters = sorted(self.counters.items())
+        lines = ["# HELP multisocks_stage_duration_seconds time spent in each collection stage",
+                 "# TYPE multisocks_stage_duration_seconds histogram"]
+        lines.extend(f"multisocks_stage_duration_seconds{suffix}{{{labels}}} {value}" for _, suffix, labels, value in rows)
+        names = sorted({name for (name, _), _ in counters})
+        for name in names:
+            lines.extend(family(f"multisocks_{name}_total", "counter", f"{name.replace('_', ' ')} by result",
+                                ((f'result="{escape(result)}"', value) for (n, result), value in counters if n == name)))
+        return lines
+
+telemetry = Telemetry()
+
+def latency_samples(labels: str, entry: Optional[Dict]) -> List[Tuple[str, float]]:
+    """quantile samples in seconds from a latency report, leaving out the ones nothing was measured for"""
+    return [(f'{labels},quantile="{q}"' if labels else f'quantile="{q}"', entry[field] / 1000)
+            for q, field in LATENCY_QUANTILES if entry and entry.get(field) is not None]
+
+def render_snapshot(snapshot: Dict) -> List[str]:
+    """per haproxy server, per tor host and fleet metrics from one dashboard snapshot"""
+    servers = [stat for stat in snapshot.get('haproxyStats', []) if stat.get('svname') not in ('BACKEND', 'FRONTEND')]
+    # label strings are built once and shared by every family, which is most of the cost at thousands of servers
+    server_labels = [f'backend="{escape(stat["pxname"])}",server="{escape(stat["svname"])}"' for stat in servers]
+    lines = family("multisocks_haproxy_server_up", "gauge", "1 if haproxy reports the server UP",
+                   ((labels, int(stat.get('status') == "UP")) for labels, stat in zip(server_labels, servers)))
+    for suffix, field, kind, help in SERVER_METRICS:
+        scale = 1000 if field in MILLISECOND_FIELDS else 1
+        lines.extend(family(f"multisocks_haproxy_server_{suffix}", kind, help,
+                            ((labels, stat.get(field, 0) / scale if scale != 1 else stat.get(field, 0)) for labels, stat in zip(server_labels, servers))))
+
+    groups = snapshot.get('summary', {}).get('backendGroups', [])
+    group_labels = [f'backend="{escape(group["name"])}"' for group in groups]
+    lines.extend(family("multisocks_haproxy_group_servers", "gauge", "servers in each backend group",
+                        zip(group_labels, (group['servers'] for group in groups))))
+    lines.extend(family("multisocks_haproxy_group_servers_up", "gauge", "servers UP in each backend group",
+                        zip(group_labels, (group['up'] for group in groups))))
+
+    hosts = snapshot.get('torHosts', [])
+    host_labels = [f'host="{escape(host["hostname"])}"' for host in hosts]
+    lines.extend(family("multisocks_tor_circuits", "gauge", "built circuits per tor host",
+                        ((labels, len(host.get('circuits', []))) for labels, host in zip(host_labels, hosts))))
+    lines.extend(family("multisocks_tor_streams", "gauge", "attached streams per tor host",
+                        ((labels, sum(c.get('streams', 0) for c in host.get('circuits', []))) for labels, host in zip(host_labels, hosts))))
+    lines.extend(family("multisocks_tor_collection_stale", "gauge", "1 if the host's circuits are from an earlier collection",
+                        ((labels, int(bool(host.get('stale')))) for labels, host in zip(host_labels, hosts))))
+    lines.extend(family("multisocks_tor_collection_duration_seconds", "gauge", "duration of the host's last collection",
+                        ((labels, (host.get('collectDuration') or 0) / 1000) for labels, host in zip(host_labels, hosts))))
+    # windowed, so exported as gauges - a histogram's counts would have to only ever go up
+    latency = snapshot.get('summary', {}).get('latency') or {}
+    for kind, metric in LATENCY_METRICS:
+        lines.extend(family(f"multisocks_tor_{metric}_seconds", "gauge", f"{metric.replace('_', ' ')} time per tor host over the latency window",
+                            (sample for labels, host in zip(host_labels, hosts) for sample in latency_samples(labels, (host.get('latency') or {}).get(kind)))))
+        lines.extend(family(f"multisocks_fleet_{metric}_seconds", "gauge", f"{metric.replace('_', ' ')} time across the fleet over the latency window",
+                            latency_samples("", latency.get(kind))))
+        lines.extend(family(f"multisocks_fleet_{metric}_samples", "gauge", f"{metric.replace('_', ' ')} times measured in the latency window",
+                            [("", (latency.get(kind) or {}).get('count', 0))]))
+    lines.extend(family("multisocks_tor_hosts", "gauge", "tor hosts known to the metrics service", [("", len(hosts))]))
+    return lines
+
+class MetricsExporter:
+    """renders /metrics, the snapshot part once per snapshot version and the stage part on every scrape"""
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.body = b""
+        self.compressed = b""
+
+    def render(self, snapshot: Optional[Dict], meta: Dict, compress: bool = False) -> bytes:
+        if snapshot is not None and meta['version'] != self.version:
+            self.body = ("\n".join(render_snapshot(snapshot)) + "\n").encode()
+            self.compressed = gzip.compress(self.body, 5)
+            self.version = meta['version']
+        lines = family("multisocks_snapshot_version", "gauge", "dashboard snapshot version", [("", meta['version'])])
+        lines.extend(family("multisocks_snapshot_age_seconds", "gauge", "age of the dashboard snapshot served", [("", meta['age'] if meta['age'] is not None else "NaN")]))
+        lines.extend(family("multisocks_snapshot_build_seconds", "gauge", "duration of the last snapshot build", [("", meta['buildDuration'] if meta['buildDuration'] is not None else "NaN")]))
+        lines.extend(telemetry.render())
+        tail = ("\n".join(lines) + "\n").encode()
+        # concatenated gzip members are one valid gzip stream, so only the small tail is compressed per scrape
+        if compress:
+            return self.compressed + gzip.compress(tail, 5)
+        return self.body + tail
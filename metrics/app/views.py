@@ -0,0 +1,110 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import msgpack
+from fastapi import HTTPException, Request, Response
+
+from cache import TTLCache
+from publisher import VOLATILE_HOST_FIELDS, backend_key
+
+VIEW_PAGE_LIMIT = int(os.getenv("VIEW_PAGE_LIMIT", "100"))
+VIEW_PAGE_LIMIT_MAX = int(os.getenv("VIEW_PAGE_LIMIT_MAX", "1000"))
+VIEW_CACHE_SIZE = int(os.getenv("VIEW_CACHE_SIZE", "256"))
+VIEW_CACHE_TTL = float(os.getenv("VIEW_CACHE_TTL", "30"))
+GZIP_MIN_SIZE = 1000
+
+MSGPACK_TYPE = "application/msgpack"
+
+def natural_key(value: str) -> List:
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', value)]
+
+def encode_cursor(key: str) -> str:
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    return [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+
+def paginate(items: List[Dict], key: Callable[[Dict], str], cursor: Optional[str], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """a page of items ordered naturally by key, starting after the key the cursor points at"""
+    limit = max(1, min(limit, VIEW_PAGE_LIMIT_MAX))
+    ordered = sorted(items, key=lambda item: natural_key(key(item)))
+    if cursor:
+        after = natural_key(decode_cursor(cursor))
+        ordered = [item for item in ordered if natural_key(key(item)) > after]
+    page = ordered[:limit]
+    return page, encode_cursor(key(page[-1])) if len(ordered) > limit else None
+
+def host_view(host: Dict, fields: Optional[List[str]], detail: str) -> Dict:
+    """one host with volatile collection fields dropped unless asked for, and circuits cut down to the detail level"""
+    view = {k: v for k, v in host.items() if k not in VOLATILE_HOST_FIELDS or (fields and k in fields)}
+    circuits = host.get('circuits', [])
+    view["circuitCount"] = len(circuits)
+    if detail == "summary":
+        view["circuits"] = [{"circuit_id": c['circuit_id'], "purpose": c['purpose'], "streams": c.get('streams', 0), "path": []} for c in circuits]
+    elif detail == "none":
+        view.pop("circuits", None)
+    return {k: v for k, v in view.items() if k in fields or k == "id"} if fields else view
+
+def filter_hosts(hosts: List[Dict], state: Optional[str], healthy: Optional[bool], q: Optional[str]) -> List[Dict]:
+    if state:
+        hosts = [host for host in hosts if host.get('state') == state]
+    if healthy is not None:
+        hosts = [host for host in hosts if (not host.get('error') and bool(host.get('circuits'))) == healthy]
+    if q:
+        q = q.lower()
+        hosts = [host for host in hosts if q in host.get('hostname', '').lower() or q in (host.get('ip_address') or '') or q in (host.get('external_ip') or '')]
+    return hosts
+
+def filter_backends(backends: List[Dict], pxname: Optional[str], status: Optional[str], q: Optional[str]) -> List[Dict]:
+    if pxname:
+        backends = [stat for stat in backends if stat.get('pxname') == pxname]
+    if status:
+        backends = [stat for stat in backends if stat.get('status') == status]
+    if q:
+        q = q.lower()
+        backends = [stat for stat in backends if q in stat.get('svname', '').lower() or q in stat.get('addr', '')]
+    return backends
+
+def project(item: Dict, fields: Optional[List[str]]) -> Dict:
+    return {k: v for k, v in item.items() if k in fields} if fields else item
+
+class ViewEncoder:
+    """encodes each view once per snapshot version and hands the same bytes, gzip and etag to every poller"""
+
+    def __init__(self, maxsize: int = VIEW_CACHE_SIZE, ttl: float = VIEW_CACHE_TTL):
+        self.cache = TTLCache(maxsize, ttl)
+
+    def respond(self, request: Request, version: Any, build: Callable[[], Any], headers: Optional[Dict[str, str]] = None) -> Response:
+        binary = request.query_params.get("format") == "msgpack" or MSGPACK_TYPE in request.headers.get("accept", "")
+        params = tuple(sorted((k, v) for k, v in request.query_params.items() if k != "format"))
+        key = (version, request.url.path, params, binary)
+        entry = self.cache.get(key)
+        if entry is None:
+            payload = build()
+            body = msgpack.packb(payload, use_bin_type=True) if binary else json.dumps(payload, separators=(",", ":")).encode()
+            # the etag is over content, so an unchanged section answers 304 even across snapshot versions
+            etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+            entry = (etag, body, gzip.compress(body, 5) if len(body) >= GZIP_MIN_SIZE else None)
+            self.cache.set(key, entry)
+        etag, body, compressed = entry
+        headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+        if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers=headers)
+        media_type = MSGPACK_TYPE if binary else "application/json"
+        if compressed is not None and "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(content=compressed, media_type=media_type, headers={**headers, "Content-Encoding": "gzip"})
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
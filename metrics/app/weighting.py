@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from stem import CircStatus
+
+from controlpool import ControllerPool
+from hastats import HAProxyStats, percentile
+from haruntime import HAProxyRuntime
+from health import HealthDaemon
+from registry import ContainerRegistry
+
+logger = logging.getLogger(__name__)
+
+WEIGHTING_MODE = os.getenv("WEIGHTING_MODE", "apply")
+WEIGHT_INTERVAL = float(os.getenv("WEIGHT_INTERVAL", "10"))
+WEIGHT_MAX = int(os.getenv("WEIGHT_MAX", "100"))
+WEIGHT_MIN = int(os.getenv("WEIGHT_MIN", "1"))
+WEIGHT_DEADBAND = int(os.getenv("WEIGHT_DEADBAND", "10"))
+WEIGHT_HOLD = int(os.getenv("WEIGHT_HOLD", "2"))
+WEIGHT_TARGET_CIRCUITS = int(os.getenv("WEIGHT_TARGET_CIRCUITS", "3"))
+WEIGHT_WINDOW = int(os.getenv("WEIGHT_WINDOW", "15"))
+
+def built_circuits(pool: ControllerPool, host_id: str) -> int:
+    session = pool.sessions.get(host_id)
+    if session is None or session.controller is None:
+        return 0
+    with session.lock:
+        return sum(1 for circ in session.circuits.values() if circ.status == CircStatus.BUILT)
+
+class WeightingEngine:
+    """scores each tor backend on latency, errors and circuit depth and pushes damped weights into haproxy"""
+
+    def __init__(self, registry: ContainerRegistry, pool: ControllerPool, stats: HAProxyStats, health: HealthDaemon, runtime: HAProxyRuntime):
+        self.registry = registry
+        self.pool = pool
+        self.stats = stats
+        self.health = health
+        self.runtime = runtime
+        self.task: Optional[asyncio.Task] = None
+        self.decisions: Dict[Tuple[str, str], Dict] = {}
+        self.fleet: Dict = {}
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(WEIGHT_INTERVAL)
+            try:
+                commands = self.evaluate()
+                if commands and WEIGHTING_MODE == "apply":
+                    await asyncio.to_thread(self.runtime.execute, commands)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"weighting round failed: {e}")
+
+    def _window(self, key: str) -> Optional[Dict]:
+        ring = self.stats.ring(key)
+        if ring is None or ring.count < 2:
+            return None
+        sessions = ring.rate("stot", WEIGHT_WINDOW)
+        errors = ring.rate("econ", WEIGHT_WINDOW) + ring.rate("eresp", WEIGHT_WINDOW)
+        return {
+            "ctime": percentile(ring.recent("ctime", WEIGHT_WINDOW), 0.95) or 0.0,
+            "ttime": percentile(ring.recent("ttime", WEIGHT_WINDOW), 0.95) or 0.0,
+            "errorRatio": errors / sessions if sessions > 0 else (1.0 if errors > 0 else 0.0)
+        }
+
+    def evaluate(self) -> List[str]:
+        """score every server, returning the runtime commands for weights that cleared the deadband and hold"""
+        candidates = {}
+        for key, server in self.health.servers.items():
+            host = self.registry.by_address.get(server['address'])
+            window = self._window(f"{key[0]}/{key[1]}")
+            if host is None or window is None:
+                continue
+            candidates[key] = (host, server, window)
+        if not candidates:
+            return []
+        fleet_ctime = percentile([w['ctime'] for _, _, w in candidates.values()], 0.5) or 0.0
+        fleet_ttime = percentile([w['ttime'] for _, _, w in candidates.values()], 0.5) or 0.0
+        self.fleet = {
+            "ctimeP50": fleet_ctime,
+            "ctimeP95": percentile([w['ctime'] for _, _, w in candidates.values()], 0.95),
+            "ttimeP50": fleet_ttime,
+            "ttimeP95": percentile([w['ttime'] for _, _, w in candidates.values()], 0.95),
+            "evaluatedAt": time.time()
+        }
+        commands = []
+        for key, (host, server, window) in candidates.items():
+            # a host's circuits are shared out between its socksports, each port being one server
+            circuits = built_circuits(self.pool, host['id']) / len(host.get('socks_ports') or [None])
+            circuit_factor = min(1.0, circuits / WEIGHT_TARGET_CIRCUITS)
+            # slower than the fleet median costs weight, faster never earns more than full weight
+            connect_factor = min(1.0, (fleet_ctime + 1) / (window['ctime'] + 1))
+            session_factor = min(1.0, (fleet_ttime + 1) / (window['ttime'] + 1))
+            error_factor = max(0.0, 1.0 - 2 * window['errorRatio'])
+            score = circuit_factor * max(0.25, connect_factor) * max(0.25, session_factor) * error_factor
+            target = max(WEIGHT_MIN, min(WEIGHT_MAX, round(WEIGHT_MAX * score)))
+            decision = self.decisions.get(key) or {"weight": server['weight'], "pending": None, "held": 0, "changedAt": None}
+            if abs(target - decision['weight']) < WEIGHT_DEADBAND:
+                decision.update(pending=None, held=0)
+            elif decision['pending'] is not None and abs(target - decision['pending']) < WEIGHT_DEADBAND:
+                decision['held'] += 1
+            else:
+                decision.update(pending=target, held=1)
+            if decision['pending'] is not None and decision['held'] >= WEIGHT_HOLD:
+                commands.append(f"set server {key[0]}/{key[1]} weight {target}")
+                logger.info(f"{key[0]}/{key[1]} ({host['hostname']}) weight {decision['weight']} -> {target}")
+                decision.update(weight=target, pending=None, held=0, changedAt=time.time())
+            decision.update(
+                hostname=host['hostname'], port=server['port'], target=target, score=round(score, 3), circuits=round(circuits, 2),
+                factors={"circuits": round(circuit_factor, 3), "connect": round(connect_factor, 3), "session": round(session_factor, 3), "errors": round(error_factor, 3)},
+                window=window
+            )
+            self.decisions[key] = decision
+        for key in [key for key in self.decisions if key not in candidates]:
+            del self.decisions[key]
+        return commands
+
+    def report(self) -> Dict:
+        return {
+            "mode": WEIGHTING_MODE,
+            "fleet": self.fleet,
+            "servers": [{"backend": backend, "server": name, **decision} for (backend, name), decision in sorted(self.decisions.items())],
+            "error": self.last_error
+        }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the service imports its modules flat, the way uvicorn runs it from metrics/app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
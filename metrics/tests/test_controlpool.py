@@ -0,0 +1,55 @@
+import pytest
+
+import controlpool
+from controlpool import ControllerPool, HostSession
+
+class FakeController:
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+        self.closed = False
+
+    def authenticate(self, password=None):
+        if self.fail_on == "authenticate":
+            raise ValueError("wrong password")
+
+    def add_status_listener(self, listener):
+        pass
+
+    def add_event_listener(self, listener, *events):
+        pass
+
+    def get_circuits(self):
+        if self.fail_on == "get_circuits":
+            raise ValueError("tor went away")
+        return []
+
+    def get_streams(self):
+        return []
+
+    def get_listeners(self, listener_type):
+        return [("0.0.0.0", 9050)]
+
+    def is_alive(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+@pytest.mark.parametrize("fail_on", ["authenticate", "get_circuits"])
+def test_failed_connect_closes_the_controller(monkeypatch, fail_on):
+    opened = []
+    monkeypatch.setattr(controlpool.Controller, "from_port", lambda **kwargs: opened.append(FakeController(fail_on)) or opened[-1])
+    session = HostSession("a" * 64, "10.0.0.2")
+    with pytest.raises(ValueError):
+        session.connect()
+    assert opened[0].closed
+    assert session.controller is None and session.next_attempt > 0
+
+def test_pool_reconnects_a_moved_host(monkeypatch):
+    opened = []
+    monkeypatch.setattr(controlpool.Controller, "from_port", lambda **kwargs: opened.append(FakeController(None)) or opened[-1])
+    pool = ControllerPool()
+    first = pool.controller({"id": "a" * 64, "ip_address": "10.0.0.2"})
+    assert pool.controller({"id": "a" * 64, "ip_address": "10.0.0.2"}) is first
+    moved = pool.controller({"id": "a" * 64, "ip_address": "10.0.0.3"})
+    assert moved is not first and first.closed and not moved.closed
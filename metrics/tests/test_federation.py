@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import federation
+from latency import LATENCY_KINDS
+from federation import Aggregator, NodeFeed, parse_nodes
+
+def host(n, circuits=1):
+    return {"id": f"h{n}", "hostname": f"multisocks-tor-{n}", "circuits": [{"circuit_id": str(i)} for i in range(circuits)], "socks_ports": [9050]}
+
+def backend(svname, status="UP", scur=0):
+    return {"pxname": "tors", "svname": svname, "status": status, "scur": scur}
+
+def latency(ms, count):
+    return {kind: {"count": count, "sum": ms * count, "buckets": [[ms, count]]} for kind in LATENCY_KINDS}
+
+def full_frame(version, hosts, backends, **summary):
+    return {"type": "dashboard_update", "version": version,
+            "data": {"torHosts": hosts, "haproxyStats": backends, "summary": summary, "snapshot": {"version": version, "stale": False}}}
+
+def test_parse_nodes():
+    assert parse_nodes(" eu=http://eu:8000/, http://10.0.0.5:8000,,") == [("eu", "http://eu:8000"), ("10.0.0.5:8000", "http://10.0.0.5:8000")]
+
+def test_node_feed_prefixes_and_applies_deltas():
+    node = NodeFeed("eu", "http://eu:8000")
+    node.load(full_frame(1, [host(1), host(2)], [backend("tor1"), backend("tor2")]))
+    assert [h['id'] for h in node.host_list(False)] == ["eu/h1", "eu/h2"]
+    assert node.host_list(False)[0]['hostname'] == "eu/multisocks-tor-1"
+    node.apply({"version": 2, "hosts": {"removed": ["h1"], "changed": [host(3)], "order": ["h3", "h2"]},
+                "backends": {"removed": ["tors/tor1"], "changed": [backend("tor2", "DOWN")]}, "summary": {"activeCircuits": 1}})
+    assert node.version == 2
+    assert [h['id'] for h in node.host_list(False)] == ["eu/h3", "eu/h2"]
+    assert node.backend_list() == [{**backend("tor2", "DOWN"), "pxname": "eu/tors", "node": "eu"}]
+    assert all(h['stale'] for h in node.host_list(True))
+
+def test_node_staleness(monkeypatch):
+    node = NodeFeed("eu", "http://eu:8000")
+    assert node.stale(0) and node.expired(0)
+    node.connected = True
+    node.load(full_frame(1, [], []))
+    now = node.updated_at
+    assert not node.stale(now) and not node.expired(now)
+    assert node.stale(now + federation.FEDERATION_STALE_AFTER + 1)
+    assert node.expired(now + federation.FEDERATION_DROP_AFTER + 1)
+
+def test_aggregator_merges_live_nodes():
+    aggregator = Aggregator([("eu", "http://eu:8000"), ("us", "http://us:8000"), ("ap", "http://ap:8000")])
+    eu, us, ap = aggregator.nodes
+    eu.load(full_frame(1, [host(1)], [backend("tor1", scur=2)], totalSessions=10, activeCircuits=1, averageLatency=100, latency=latency(64, 1)))
+    us.load(full_frame(1, [host(1), host(2, circuits=0)], [backend("tor1"), backend("tor2", "DOWN")], totalSessions=30, activeCircuits=3, latency=latency(128, 3)))
+    eu.connected = us.connected = True
+    data = asyncio.run(aggregator.build())
+    assert [h['id'] for h in data['torHosts']] == ["eu/h1", "us/h1", "us/h2"]
+    assert data['summary']['totalSessions'] == 40 and data['summary']['activeCircuits'] == 4
+    # the fleet tail comes off the merged buckets
+    assert data['summary']['latency']['streamConnect']['count'] == 4
+    assert data['summary']['averageLatency'] == data['summary']['latency']['streamConnect']['mean'] == 112.0
+    assert [node['name'] for node in data['summary']['nodes']] == ["eu", "us", "ap"]
+
+    capacity = aggregator.capacity()
+    shares = {node['name']: (node['serving'], node['share']) for node in capacity['nodes']}
+    assert shares == {"eu": (1, 0.5), "us": (1, 0.5), "ap": (0, 0)}
+    assert capacity['fleet']['hosts'] == 3 and capacity['fleet']['healthyHosts'] == 2 and capacity['fleet']['staleNodes'] == 1
+
+def test_feed_reconnects_on_a_missed_version(caplog):
+    import websockets
+
+    async def run():
+        connections = []
+
+        async def serve(websocket, *args):
+            connections.append(websocket)
+            await websocket.send(json.dumps(full_frame(len(connections), [host(1)], [])))
+            if len(connections) == 1:
+                await websocket.send(json.dumps({"type": "dashboard_delta", "version": 6, "baseVersion": 5}))
+            await websocket.wait_closed()
+
+        async with websockets.serve(serve, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            aggregator = Aggregator([("eu", f"http://127.0.0.1:{port}")])
+            node = aggregator.nodes[0]
+            aggregator.start()
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                if node.version == 2:
+                    break
+            await aggregator.stop()
+            return node
+
+    node = asyncio.run(run())
+    # the full frame on reconnect puts the feed back on track
+    assert node.connects == 2 and node.version == 2 and node.last_error is None
+    assert "missed versions 1 to 5" in caplog.text
@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+import geo
+from geo import UNKNOWN_LOCATION, GeoLocator
+
+LOCATION = {"country": "Iceland", "city": "Reykjavik", "latitude": 64.1, "longitude": -21.9}
+
+class FakeReader:
+    def city(self, address):
+        return SimpleNamespace(country=SimpleNamespace(name=LOCATION["country"]), city=SimpleNamespace(name=LOCATION["city"]),
+                               location=SimpleNamespace(latitude=LOCATION["latitude"], longitude=LOCATION["longitude"]))
+
+def test_missing_database_isnt_cached_and_is_picked_up_later(tmp_path, monkeypatch):
+    locator = GeoLocator(str(tmp_path / "missing.mmdb"))
+    locator.open()
+    assert locator.lookup("198.51.100.7") is UNKNOWN_LOCATION
+    assert locator.cache.get("198.51.100.7") is None
+    # the database turns up, the next retry opens it
+    monkeypatch.setattr(geo, "GEOIP_RETRY_INTERVAL", 0)
+    monkeypatch.setattr(geo.geoip2.database, "Reader", lambda path, mode: FakeReader())
+    assert locator.lookup("198.51.100.7") == LOCATION
+    assert locator.cache.get("198.51.100.7") == LOCATION
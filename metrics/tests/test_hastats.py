@@ -0,0 +1,65 @@
+import hastats
+from hastats import HAProxyStats, SeriesRing, percentile
+
+HEADER = "# pxname,svname,qcur,scur,smax,stot,bin,bout,status,weight,addr,"
+
+def row(pxname, svname, stot=0, bin_=0, status="UP", addr="10.0.0.2:9050", scur=0):
+    return f"{pxname},{svname},0,{scur},0,{stot},{bin_},0,{status},1,{addr},"
+
+def test_parse_keeps_tor_groups_and_skips_idle_slots():
+    stats = HAProxyStats()
+    rows = stats.parse([
+        HEADER,
+        row("stats", "FRONTEND"),
+        row("tors", "tor1", stot=5, bin_=100),
+        row("tors2", "tor2", status="MAINT", addr="127.0.0.1:9050"),
+        row("tors2", "tor3", status="MAINT", addr="10.0.0.3:9050"),
+        row("tors", "BACKEND", stot=5, addr=""),
+    ])
+    assert [(stat['pxname'], stat['svname']) for stat in rows] == [("tors", "tor1"), ("tors2", "tor3"), ("tors", "BACKEND")]
+    # columns the csv lacks are left out, present ones are typed
+    assert rows[0]['stot'] == 5 and rows[0]['bin'] == 100 and rows[0]['status'] == "UP"
+    assert "ctime" not in rows[0]
+    assert stats.parse([]) == []
+
+def test_series_ring_rates_ignore_counter_resets():
+    ring = SeriesRing(3)
+    for t, stot in ((0, 0), (10, 50), (20, 150), (30, 250)):
+        ring.append(t, {name: stot for name in hastats.SERIES})
+    assert ring.recent("t", 5) == [10, 20, 30]
+    assert ring.rate("stot") == 10.0
+    assert ring.rate("stot", 3) == 10.0
+    ring.append(40, {name: 0 for name in hastats.SERIES})
+    assert ring.rate("stot") == 0.0
+
+def test_collect_rates_groups_and_prunes_history(monkeypatch):
+    stats = HAProxyStats()
+    samples = iter([
+        [HEADER, row("tors", "tor1", stot=10), row("tors", "tor2", stot=0, status="DOWN"), row("tors", "BACKEND", stot=10, scur=2)],
+        [HEADER, row("tors", "tor1", stot=30), row("tors", "BACKEND", stot=30, scur=1)],
+    ])
+    clock = iter([100.0, 110.0])
+    monkeypatch.setattr(stats, "fetch", lambda: stats.parse(next(samples)))
+    monkeypatch.setattr(hastats.time, "time", lambda: next(clock))
+    first = stats.collect()
+    assert first['groups'] == [{"name": "tors", "status": "UP", "servers": 2, "up": 1, "scur": 2, "stot": 10, "sessRate": 0.0}]
+    second = stats.collect()
+    assert second['backends'][0]['sessRate'] == 2.0
+    assert set(stats.history) == {"tors/tor1", "tors/BACKEND"}
+    window = stats.window("tors/tor1")
+    assert window['samples'] == 2 and window['sessRate'] == 2.0
+    assert stats.window("tors/tor2") is None
+
+def test_collect_survives_an_unreachable_haproxy(monkeypatch):
+    stats = HAProxyStats()
+
+    def fail():
+        raise ConnectionError("refused")
+
+    monkeypatch.setattr(stats, "fetch", fail)
+    assert stats.collect() == {"backends": [], "groups": []}
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(list(range(101)), 0.95) == 95
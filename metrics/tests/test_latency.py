@@ -0,0 +1,103 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from stem import CircStatus, StreamStatus
+
+import latency
+from latency import HostLatency, LatencyHistogram, LatencySet, merge_reports, quantiles, summarize
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def circ(circ_id, status, created=None):
+    return SimpleNamespace(id=circ_id, status=status, created=created)
+
+def stream(stream_id, status):
+    return SimpleNamespace(id=stream_id, status=status)
+
+def test_quantiles_interpolate_inside_buckets():
+    counts = [0] * (len(latency.LATENCY_BUCKETS) + 1)
+    counts[latency.BUCKET_INDEX[64.0]] = 100
+    p50, p99 = quantiles(counts, 100, (0.5, 0.99))
+    assert latency.LATENCY_BUCKETS[latency.BUCKET_INDEX[64.0] - 1] < p50 < p99 <= 64.0
+    assert quantiles(counts, 0, (0.5,)) == [None]
+
+def test_histogram_windows_rotate_and_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(latency.time, "monotonic", clock)
+    histogram = LatencyHistogram(window=10)
+    histogram.observe(5)
+    clock.now += 10
+    histogram.observe(50)
+    counts, total = histogram.totals()
+    assert sum(counts) == 2 and total == 55
+    clock.now += 10
+    assert sum(histogram.totals()[0]) == 1
+    clock.now += 25
+    assert histogram.totals() == ([0] * (len(latency.LATENCY_BUCKETS) + 1), 0.0)
+
+def test_merged_reports_match_one_histogram():
+    one, two, both = LatencySet(), LatencySet(), LatencySet()
+    for ms, target in ((3, one), (40, one), (900, two), (200000, two)):
+        target.observe("streamConnect", ms)
+        both.observe("streamConnect", ms)
+    merged = merge_reports([one.report(buckets=True), two.report(buckets=True), None])
+    expected = summarize(*both.histograms["streamConnect"].totals(), buckets=True)
+    assert merged["streamConnect"] == expected
+    assert merged["streamConnect"]["buckets"][-1] == [None, 1]
+    assert merged["circuitBuild"]["count"] == 0
+
+def test_report_is_cached_until_something_is_observed():
+    latencies = LatencySet()
+    first = latencies.report()
+    assert latencies.report() is first
+    latencies.observe("circuitBuild", 10)
+    assert latencies.report()["circuitBuild"]["count"] == 1
+
+def test_host_events_time_circuits_and_streams(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(latency.time, "time", clock)
+    fleet = LatencySet()
+    host = HostLatency(fleet)
+    host.on_circ(circ("1", CircStatus.LAUNCHED))
+    clock.now += 0.5
+    host.on_circ(circ("1", CircStatus.BUILT))
+    host.on_stream(stream("7", StreamStatus.NEW))
+    clock.now += 0.01
+    host.on_stream(stream("7", StreamStatus.SENTCONNECT))
+    clock.now += 0.2
+    host.on_stream(stream("7", StreamStatus.SUCCEEDED))
+    report = host.report()
+    assert report["circuitBuild"]["count"] == 1 and 420 < report["circuitBuild"]["mean"] <= 500
+    assert report["streamAttach"]["count"] == 1 and report["streamConnect"]["count"] == 1
+    assert fleet.report()["streamConnect"]["count"] == 1
+    assert not host.launched and not host.opened and not host.attached
+
+def test_host_events_use_creation_time_for_circuits_launched_before_the_session(monkeypatch):
+    clock = Clock(datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp())
+    monkeypatch.setattr(latency.time, "time", clock)
+    host = HostLatency()
+    created = datetime(2026, 1, 1)
+    clock.now += 2
+    host.on_circ(circ("1", CircStatus.BUILT, created))
+    # a creation time from a clock far off is ignored rather than counted as a huge build
+    host.on_circ(circ("2", CircStatus.BUILT, datetime(2025, 1, 1)))
+    assert host.report()["circuitBuild"]["count"] == 1
+
+def test_host_events_drop_closed_and_reset_state(monkeypatch):
+    host = HostLatency()
+    host.on_circ(circ("1", CircStatus.LAUNCHED))
+    host.on_circ(circ("1", CircStatus.FAILED))
+    host.on_stream(stream("7", StreamStatus.NEW))
+    host.on_stream(stream("7", StreamStatus.CLOSED))
+    host.on_stream(stream("8", StreamStatus.NEW))
+    host.reset()
+    assert not host.launched and not host.opened
+    monkeypatch.setattr(latency, "LATENCY_PENDING_MAX", 2)
+    for n in range(5):
+        host.on_circ(circ(str(n), CircStatus.LAUNCHED))
+    assert len(host.launched) == 2
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+import stem
+import stem.response
+import stem.version
+from stem.control import Controller, EventType
+
+import prefetch
+from prefetch import Prefetcher
+
+ONION = "duckduckgogg42xjoc72x3sjasowoarfbgcmvfimaftt6twagswzczad"
+
+class FakeController(Controller):
+    """stem's own get_hidden_service_descriptor over a scripted control connection"""
+
+    def __init__(self, descriptor=None, hsfetch_reply="250 OK"):
+        # no socket, only the calls get_hidden_service_descriptor makes are answered
+        self.sent = []
+        self.listeners = {}
+        self.descriptor = descriptor
+        self.hsfetch_reply = hsfetch_reply
+
+    def get_version(self, *args, **kwargs):
+        return stem.version.Version("0.4.8.9")
+
+    def add_event_listener(self, listener, *events):
+        for event_type in events:
+            self.listeners[event_type] = listener
+
+    def remove_event_listener(self, listener):
+        self.listeners = {k: v for k, v in self.listeners.items() if v is not listener}
+
+    def msg(self, message):
+        self.sent.append(message)
+        if message.startswith("HSFETCH") and self.descriptor is not None:
+            self.listeners[EventType.HS_DESC_CONTENT](SimpleNamespace(address=ONION, descriptor=self.descriptor))
+        return stem.response.ControlMessage.from_str(f"{self.hsfetch_reply}\r\n")
+
+class FakePool:
+    def __init__(self, controller):
+        self._controller = controller
+
+    def controller(self, host):
+        return self._controller
+
+class FakeRegistry:
+    def __init__(self, hosts):
+        self._hosts = hosts
+
+    def hosts(self):
+        return self._hosts
+
+    def get(self, key):
+        return next((host for host in self._hosts if host['id'] == key), None)
+
+HOST = {"id": "abc", "hostname": "multisocks-tor-1", "ip_address": "127.0.0.1", "socks_ports": [9050]}
+
+def run_job(controller):
+    async def run():
+        prefetcher = Prefetcher(FakeRegistry([HOST]), FakePool(controller))
+        job = prefetcher.submit([f"{ONION}.onion"], connect=False)
+        while job.finished is None:
+            await asyncio.sleep(0.01)
+        return job.report()
+    return asyncio.run(run())
+
+def test_descriptor_fetch_sends_hsfetch_and_warms():
+    controller = FakeController(descriptor="descriptor")
+    report = run_job(controller)
+    assert controller.sent == [f"HSFETCH {ONION}"]
+    assert report["targets"][0]["status"] == "warm"
+
+def test_descriptor_timeout_is_cold(monkeypatch):
+    monkeypatch.setattr(prefetch, "PREFETCH_TIMEOUT", 0.05)
+    controller = FakeController()
+    report = run_job(controller)
+    assert controller.sent == [f"HSFETCH {ONION}"]
+    target = report["targets"][0]
+    assert target["status"] == "cold"
+    assert target["hosts"]["abc"]["failedAt"] == "descriptor"
+
+def test_refused_hsfetch_is_cold():
+    controller = FakeController(hsfetch_reply="552 Unrecognized command")
+    report = run_job(controller)
+    assert report["targets"][0]["status"] == "cold"
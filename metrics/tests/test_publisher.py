@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import publisher
+from publisher import Client, SnapshotPublisher
+
+class FakeSnapshots:
+    def __init__(self):
+        self.listeners = []
+        self.version = 0
+        self.snapshot = None
+
+    def publish(self, hosts):
+        self.version += 1
+        self.snapshot = {"torHosts": hosts, "haproxyStats": [], "summary": {}, "lastUpdated": str(self.version)}
+
+    def meta(self):
+        return {"version": self.version, "age": 0.0, "stale": False}
+
+def queued(client):
+    items = []
+    while not client.queue.empty():
+        items.append(json.loads(client.queue.get_nowait()[1]))
+    return items
+
+def test_coalescing_keeps_out_of_band_messages_in_order():
+    async def run():
+        snapshots = FakeSnapshots()
+        feed = SnapshotPublisher(snapshots)
+        client = Client(None)
+        feed.clients.add(client)
+        snapshots.publish([])
+        feed._advance()
+        feed._enqueue(client, feed.state.full_frame())
+        await feed.broadcast({"type": "bulk_progress", "n": 1})
+        for n in range(publisher.WS_QUEUE_SIZE):
+            snapshots.publish([{"id": str(n)}])
+            previous = feed._advance()
+            feed._enqueue(client, feed.state.delta_frame(previous))
+        await feed.broadcast({"type": "bulk_complete", "n": 2})
+        return snapshots, client, queued(client)
+
+    snapshots, client, frames = asyncio.run(run())
+    # the snapshot backlog is one full frame of the latest version, the bulk messages all survive in order
+    assert [frame['type'] for frame in frames] == ["bulk_progress", "dashboard_update", "bulk_complete"]
+    assert frames[1]['version'] == snapshots.version
+    assert client.dropped == publisher.WS_QUEUE_SIZE and client.snapshot_frames == 1
+
+def test_out_of_band_messages_have_their_own_bound(monkeypatch):
+    monkeypatch.setattr(publisher, "WS_MESSAGE_QUEUE_SIZE", 2)
+
+    async def run():
+        feed = SnapshotPublisher(FakeSnapshots())
+        client = Client(None)
+        feed.clients.add(client)
+        for n in range(3):
+            await feed.broadcast({"type": "bulk_progress", "n": n})
+        return client, queued(client)
+
+    client, frames = asyncio.run(run())
+    assert [frame['n'] for frame in frames] == [0, 1] and client.dropped == 1
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+from registry import ContainerRegistry
+
+class FakeContainer:
+    def __init__(self, container_id: str, name: str, address: str, status: str = "running", user: str = "tor"):
+        self.id = container_id
+        self.short_id = container_id[:12]
+        self.name = name
+        self.status = status
+        self.image = SimpleNamespace(tags=["multisocks-tor:latest"], short_id="sha256:abc")
+        self.attrs = {
+            "Config": {"User": user, "Env": []},
+            "NetworkSettings": {"Networks": {"net_tor": {"IPAddress": address}}},
+            "State": {"StartedAt": "2024-01-01T00:00:00.000000000Z"}
+        }
+
+class FakeDocker:
+    """containers.list and containers.get over a dict the test edits between events"""
+
+    def __init__(self, *containers: FakeContainer):
+        self.by_id = {container.id: container for container in containers}
+        self.containers = SimpleNamespace(list=lambda filters=None: list(self.by_id.values()), get=self.get)
+
+    def get(self, container_id: str) -> FakeContainer:
+        return next(c for c in self.by_id.values() if c.id.startswith(container_id))
+
+def event(action: str, container_id: str) -> dict:
+    return {"Type": "container", "Action": action, "Actor": {"ID": container_id, "Attributes": {}}}
+
+def container_id(n: int) -> str:
+    return f"{n:012x}" + "f" * 52
+
+def registry_for(docker: FakeDocker) -> ContainerRegistry:
+    registry = ContainerRegistry(client_factory=lambda: docker)
+    registry.client = docker
+    registry.seed()
+    return registry
+
+def test_seed_indexes_tor_containers_only():
+    docker = FakeDocker(FakeContainer(container_id(2), "multisocks-tor-2", "10.0.0.2"),
+                        FakeContainer(container_id(1), "multisocks-tor-1", "10.0.0.1"),
+                        FakeContainer(container_id(3), "multisocks-haproxy-1", "10.0.0.3", user="haproxy"))
+    registry = registry_for(docker)
+    assert [host['hostname'] for host in registry.hosts()] == ["multisocks-tor-1", "multisocks-tor-2"]
+    assert registry.get("multisocks-tor-2")['ip_address'] == "10.0.0.2"
+    assert registry.by_address["10.0.0.1"]['id'] == container_id(1)[:12]
+
+def test_start_and_die_update_every_index():
+    docker = FakeDocker(FakeContainer(container_id(1), "multisocks-tor-1", "10.0.0.1"))
+    registry = registry_for(docker)
+    docker.by_id[container_id(2)] = FakeContainer(container_id(2), "multisocks-tor-2", "10.0.0.2")
+    registry._apply(event("start", container_id(2)))
+    assert [host['hostname'] for host in registry.hosts()] == ["multisocks-tor-1", "multisocks-tor-2"]
+    assert registry.get(container_id(2)[:12])['hostname'] == "multisocks-tor-2"
+
+    registry._apply(event("die", container_id(1)))
+    assert [host['hostname'] for host in registry.hosts()] == ["multisocks-tor-2"]
+    assert registry.get("multisocks-tor-1") is None
+    assert "10.0.0.1" not in registry.by_address
+
+def test_rename_drops_the_old_name():
+    docker = FakeDocker(FakeContainer(container_id(1), "multisocks-tor-1", "10.0.0.1"))
+    registry = registry_for(docker)
+    docker.by_id[container_id(1)].name = "multisocks-tor-renamed"
+    registry._apply(event("rename", container_id(1)))
+    assert registry.get("multisocks-tor-1") is None
+    assert registry.get("multisocks-tor-renamed")['ip_address'] == "10.0.0.1"
+    assert [host['hostname'] for host in registry.hosts()] == ["multisocks-tor-renamed"]
+
+def test_reused_address_survives_the_old_container_dying():
+    docker = FakeDocker(FakeContainer(container_id(1), "multisocks-tor-1", "10.0.0.1"))
+    registry = registry_for(docker)
+    docker.by_id[container_id(2)] = FakeContainer(container_id(2), "multisocks-tor-2", "10.0.0.1")
+    registry._apply(event("start", container_id(2)))
+    registry._apply(event("die", container_id(1)))
+    assert registry.by_address["10.0.0.1"]['hostname'] == "multisocks-tor-2"
+
+def test_resync_replaces_state_missed_between_events():
+    docker = FakeDocker(FakeContainer(container_id(1), "multisocks-tor-1", "10.0.0.1"),
+                        FakeContainer(container_id(2), "multisocks-tor-2", "10.0.0.2"))
+    registry = registry_for(docker)
+    # events lost while the stream was down: one container gone, another started
+    del docker.by_id[container_id(1)]
+    docker.by_id[container_id(3)] = FakeContainer(container_id(3), "multisocks-tor-3", "10.0.0.3")
+    notified = []
+    registry.listeners.append(notified.append)
+    registry.seed()
+    assert [host['hostname'] for host in registry.hosts()] == ["multisocks-tor-2", "multisocks-tor-3"]
+    assert registry.get("multisocks-tor-1") is None and "10.0.0.1" not in registry.by_address
+    assert notified == [registry]
+
+def test_stopped_container_refresh_removes_it():
+    docker = FakeDocker(FakeContainer(container_id(1), "multisocks-tor-1", "10.0.0.1"))
+    registry = registry_for(docker)
+    docker.by_id[container_id(1)].status = "exited"
+    registry._apply(event("restart", container_id(1)))
+    assert registry.hosts() == []
+
+def test_kill_signal_to_a_running_container_keeps_it():
+    docker = FakeDocker(FakeContainer(container_id(1), "multisocks-tor-1", "10.0.0.1"))
+    registry = registry_for(docker)
+    registry._apply(event("kill", container_id(1)))
+    assert [host['hostname'] for host in registry.hosts()] == ["multisocks-tor-1"]
+    docker.by_id[container_id(1)].status = "exited"
+    registry._apply(event("kill", container_id(1)))
+    assert registry.hosts() == []
@@ -0,0 +1,17 @@
+from types import SimpleNamespace
+
+from geo import UNKNOWN_LOCATION
+from relays import RelayIndex
+
+LOCATION = {"country": "Iceland", "city": "Reykjavik", "latitude": 64.1, "longitude": -21.9}
+
+def test_relays_only_keep_real_locations():
+    index = RelayIndex()
+    index._replace([SimpleNamespace(fingerprint="A" * 40, address="198.51.100.7", nickname="relay", flags=["Fast"])])
+    index.set_geo("A" * 40, UNKNOWN_LOCATION)
+    assert index.relays["A" * 40].geo is None
+    index.set_geo("A" * 40, LOCATION)
+    assert index.relays["A" * 40].geo == LOCATION
+    # a consensus that keeps the address keeps the location
+    index._replace([SimpleNamespace(fingerprint="A" * 40, address="198.51.100.7", nickname="relay", flags=["Fast", "Stable"])])
+    assert index.relays["A" * 40].geo == LOCATION
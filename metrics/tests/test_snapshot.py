@@ -0,0 +1,27 @@
+import asyncio
+
+from snapshot import SnapshotService
+
+def test_stop_cancels_the_build_in_flight():
+    cancelled = asyncio.Event()
+
+    async def build():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def run():
+        snapshots = SnapshotService(build, interval=60)
+        snapshots.start()
+        await asyncio.sleep(0.01)
+        assert snapshots.inflight is not None
+        await snapshots.stop()
+        # checked before asyncio.run tears down whatever stop left running
+        assert cancelled.is_set()
+        return snapshots
+
+    snapshots = asyncio.run(run())
+    assert snapshots.inflight is None and snapshots.task is None
+    assert snapshots.snapshot is None
@@ -0,0 +1,71 @@
+import gzip
+import json
+
+import msgpack
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from views import ViewEncoder, decode_cursor, encode_cursor, filter_hosts, host_view, paginate, project
+
+def request(path="/dashboard/hosts", query="", headers=None):
+    return Request({
+        "type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    })
+
+HOSTS = [{"id": f"h{n}", "hostname": f"multisocks-tor-{n}", "ip_address": f"10.0.0.{n}", "state": "ready",
+          "lastCollected": 1.0, "circuits": [{"circuit_id": "1", "purpose": "GENERAL", "streams": 2, "path": ["a", "b", "c"]}]}
+         for n in (1, 2, 10, 11)]
+
+def test_pagination_walks_in_natural_order():
+    keys = []
+    cursor = None
+    while True:
+        page, cursor = paginate(list(reversed(HOSTS)), lambda host: host['hostname'], cursor, 3)
+        keys.extend(host['hostname'] for host in page)
+        if cursor is None:
+            break
+    assert keys == ["multisocks-tor-1", "multisocks-tor-2", "multisocks-tor-10", "multisocks-tor-11"]
+    assert decode_cursor(encode_cursor("multisocks-tor-2")) == "multisocks-tor-2"
+    with pytest.raises(HTTPException):
+        decode_cursor("_w")
+
+def test_host_view_detail_and_projection():
+    full = host_view(HOSTS[0], None, "full")
+    assert "lastCollected" not in full and full['circuitCount'] == 1 and full['circuits'][0]['path'] == ["a", "b", "c"]
+    assert host_view(HOSTS[0], None, "summary")['circuits'][0]['path'] == []
+    assert "circuits" not in host_view(HOSTS[0], None, "none")
+    assert host_view(HOSTS[0], ["hostname", "lastCollected"], "full") == {"id": "h1", "hostname": "multisocks-tor-1", "lastCollected": 1.0}
+    assert project({"a": 1, "b": 2}, ["b"]) == {"b": 2}
+
+def test_filter_hosts():
+    hosts = HOSTS + [{"id": "h3", "hostname": "multisocks-tor-3", "ip_address": "10.0.0.3", "state": "starting", "error": "refused", "circuits": []}]
+    assert [host['id'] for host in filter_hosts(hosts, "starting", None, None)] == ["h3"]
+    assert [host['id'] for host in filter_hosts(hosts, None, False, None)] == ["h3"]
+    assert [host['id'] for host in filter_hosts(hosts, None, None, "TOR-1")] == ["h1", "h10", "h11"]
+
+def test_encoder_builds_once_per_version_and_answers_304():
+    encoder = ViewEncoder()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {"items": HOSTS}
+
+    first = encoder.respond(request(), 1, build, {"X-Snapshot-Age": "0.5"})
+    etag = first.headers["etag"]
+    assert json.loads(first.body) == {"items": HOSTS} and first.headers["x-snapshot-age"] == "0.5"
+    assert encoder.respond(request(), 1, build).headers["etag"] == etag
+    assert len(builds) == 1
+    # a new version re-encodes, but unchanged content keeps its etag
+    assert encoder.respond(request(headers={"If-None-Match": etag}), 2, build).status_code == 304
+    assert len(builds) == 2
+
+def test_encoder_gzip_and_msgpack():
+    encoder = ViewEncoder()
+    zipped = encoder.respond(request(headers={"Accept-Encoding": "gzip"}), 1, lambda: {"items": HOSTS * 10})
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(zipped.body)) == {"items": HOSTS * 10}
+    packed = encoder.respond(request(query="format=msgpack"), 1, lambda: {"items": HOSTS})
+    assert packed.media_type == "application/msgpack" and msgpack.unpackb(packed.body) == {"items": HOSTS}
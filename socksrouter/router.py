@@ -0,0 +1,312 @@
+import asyncio
+import bisect
+import hashlib
+import heapq
+import ipaddress
+import logging
+import os
+import platform
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import docker
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s]: %(message)s",
+    level=logging.INFO
+)
+
+ROUTER_PORT = int(os.getenv("ROUTER_PORT", "8081"))
+# the tor image always opens its first socksport here, the rest follow from TOR_SOCKS_PORTS
+TOR_SOCKS_PORT = 9050
+VNODES = int(os.getenv("ROUTER_VNODES", "128"))
+FANOUT = int(os.getenv("ROUTER_FANOUT", "1"))
+MAX_FANOUT = int(os.getenv("ROUTER_MAX_FANOUT", "4"))
+# backends tried after the preferred ones before a connect is given up on
+FALLBACKS = int(os.getenv("ROUTER_FALLBACKS", "3"))
+HOT_THRESHOLD = int(os.getenv("ROUTER_HOT_THRESHOLD", "32"))
+HASH_ALL = os.getenv("ROUTER_HASH_ALL", "false").lower() == "true"
+REFRESH_INTERVAL = float(os.getenv("ROUTER_REFRESH_INTERVAL", "10"))
+FAILURE_COOLDOWN = float(os.getenv("ROUTER_FAILURE_COOLDOWN", "10"))
+# covers tor's reply too, so the exit connect - and for an onion the descriptor fetch and rendezvous - has to fit
+CONNECT_TIMEOUT = float(os.getenv("ROUTER_CONNECT_TIMEOUT", "30"))
+STATS_INTERVAL = float(os.getenv("ROUTER_STATS_INTERVAL", "60"))
+
+SOCKS_VERSION = 5
+NO_AUTH = 0x00
+USERNAME_PASSWORD = 0x02
+NO_ACCEPTABLE_METHODS = 0xFF
+CMD_CONNECT = 0x01
+ATYP_IPV4 = 0x01
+ATYP_DOMAIN = 0x03
+ATYP_IPV6 = 0x04
+REP_GENERAL_FAILURE = 0x01
+REP_HOST_UNREACHABLE = 0x04
+REP_COMMAND_NOT_SUPPORTED = 0x07
+
+def socks_ports(container) -> List[int]:
+    """the socksports a tor container opens per its TOR_SOCKS_PORTS, 9050 then 9052 upwards as tor/entrypoint.sh lays them out"""
+    env = dict(item.split("=", 1) for item in container.attrs.get("Config", {}).get("Env") or [] if "=" in item)
+    count = max(1, int(env.get("TOR_SOCKS_PORTS", "1") or 1))
+    return [TOR_SOCKS_PORT] + [TOR_SOCKS_PORT + 1 + i for i in range(1, count)]
+
+def get_tor_backends() -> List[str]:
+    """every socksport of every tor container as host:port, each isolated socksport is its own backend"""
+    if platform.system() == "Darwin":
+        client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+    else:
+        client = docker.DockerClient(base_url='unix://tmp/docker.sock')
+    containers = client.containers.list(filters={"network": "net_tor"})
+    return sorted(
+        f"{container.name}:{port}" for container in containers
+        if container.attrs["Config"]["User"] == "tor"
+        for port in socks_ports(container)
+    )
+
+def ring_hash(key: str) -> int:
+    return struct.unpack(">Q", hashlib.blake2b(key.encode(), digest_size=8).digest())[0]
+
+def affinity_key(host: str) -> str:
+    """onion subdomains share a descriptor and rendezvous, so they hash as their service"""
+    labels = host.lower().rstrip('.').split('.')
+    if labels[-1] == "onion" and len(labels) > 2:
+        return ".".join(labels[-2:])
+    return host.lower()
+
+class UpstreamRefused(ConnectionError):
+    """a backend answered the connect with a socks error"""
+
+    def __init__(self, code: int):
+        super().__init__(f"upstream replied {code:#04x}")
+        self.code = code
+
+class HashRing:
+    """a consistent hash ring over tor backends, adding or removing one only remaps its own arcs"""
+
+    def __init__(self, backends: List[str], vnodes: int = VNODES):
+        self.backends = list(backends)
+        points = sorted((ring_hash(f"{backend}#{i}"), backend) for backend in backends for i in range(vnodes))
+        # neighbouring vnodes of the same backend collapse into the last of their run - a key lands on the next point
+        # clockwise, so that's the one still bounding the arc the run owned and every key keeps its backend
+        distinct = [point for i, point in enumerate(points) if i == len(points) - 1 or point[1] != points[i + 1][1]]
+        # keys past the last point wrap to the first, so a last run owned by the same backend adds nothing
+        if len(distinct) > 1 and distinct[0][1] == distinct[-1][1]:
+            distinct.pop()
+        self.hashes = [point for point, _ in distinct]
+        self.owners = [backend for _, backend in distinct]
+
+    def successors(self, key: str, count: int, skip: Optional[Set[str]] = None) -> List[str]:
+        """the first count distinct backends clockwise from key, passing over any in skip"""
+        if not self.hashes:
+            return []
+        found: List[str] = []
+        seen: Set[str] = set(skip or ())
+        start = bisect.bisect(self.hashes, ring_hash(key))
+        for i in range(len(self.owners)):
+            backend = self.owners[(start + i) % len(self.owners)]
+            if backend not in seen:
+                seen.add(backend)
+                found.append(backend)
+                if len(found) == count or len(seen) == len(self.backends):
+                    break
+        return found
+
+class Router:
+    def __init__(self):
+        self.ring = HashRing([])
+        self.active: Dict[str, int] = {}
+        self.destinations: Dict[str, int] = {}
+        self.failed_until: Dict[str, float] = {}
+        self.routed = 0
+        self.failures = 0
+
+    def update_backends(self, backends: List[str]):
+        if backends != self.ring.backends:
+            logging.info(f"routing across {len(backends)} tor backends")
+            self.ring = HashRing(backends)
+            self.active = {backend: self.active.get(backend, 0) for backend in backends}
+
+    def candidates(self, host: str) -> List[str]:
+        """backends to try for a destination, best first - the preferred ones, then a few fallbacks"""
+        now = time.monotonic()
+        for backend in [b for b, until in self.failed_until.items() if until <= now]:
+            del self.failed_until[backend]
+        # with every backend failing, try them anyway rather than refuse the connect
+        failed = set(self.failed_until) if len(self.failed_until) < len(self.ring.backends) else set()
+        if host.endswith(".onion") or HASH_ALL:
+            key = affinity_key(host)
+            # hot destinations widen onto more backends, a step per HOT_THRESHOLD concurrent streams
+            fanout = min(MAX_FANOUT, FANOUT + self.destinations.get(key, 0) // HOT_THRESHOLD)
+            ordered = self.ring.successors(key, fanout + FALLBACKS, failed)
+            preferred = sorted(ordered[:fanout], key=lambda b: self.active.get(b, 0))
+            return preferred + ordered[fanout:]
+        return heapq.nsmallest(1 + FALLBACKS, (b for b in self.ring.backends if b not in failed), key=lambda b: self.active.get(b, 0))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        upstream_writer = None
+        try:
+            greeting, method, auth = await self.negotiate(reader, writer)
+            if method is None:
+                return
+            header = await reader.readexactly(4)
+            version, command, _, atyp = header
+            address, raw_address = await self.read_address(reader, atyp)
+            raw_port = await reader.readexactly(2)
+            request = header + raw_address + raw_port
+            if command != CMD_CONNECT:
+                await self.reply(writer, REP_COMMAND_NOT_SUPPORTED)
+                return
+            key = affinity_key(address)
+            refused = REP_HOST_UNREACHABLE
+            for backend in self.candidates(address):
+                try:
+                    upstream_reader, upstream_writer, reply = await asyncio.wait_for(
+                        self.open_upstream(backend, greeting, method, auth, request), CONNECT_TIMEOUT)
+                except Exception as e:
+                    if isinstance(e, UpstreamRefused):
+                        refused = e.code
+                    self.failures += 1
+                    self.failed_until[backend] = time.monotonic() + FAILURE_COOLDOWN
+                    logging.warning(f"backend {backend} failed for {address}: {e or e.__class__.__name__}")
+                    continue
+                break
+            else:
+                # the client hears why the last backend refused, or that none could be reached
+                await self.reply(writer, refused)
+                return
+            writer.write(reply)
+            await writer.drain()
+            self.routed += 1
+            self.active[backend] = self.active.get(backend, 0) + 1
+            self.destinations[key] = self.destinations.get(key, 0) + 1
+            try:
+                await asyncio.gather(self.pipe(reader, upstream_writer), self.pipe(upstream_reader, writer))
+            finally:
+                self.active[backend] = self.active.get(backend, 1) - 1
+                self.destinations[key] -= 1
+                if not self.destinations[key]:
+                    del self.destinations[key]
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.warning(f"connection failed: {e}")
+        finally:
+            for w in (writer, upstream_writer):
+                if w is not None:
+                    w.close()
+
+    async def negotiate(self, reader, writer) -> Tuple[bytes, Optional[int], bytes]:
+        """accept the client's method, relaying username/password auth untouched so tor can isolate on it"""
+        version, nmethods = await reader.readexactly(2)
+        methods = await reader.readexactly(nmethods)
+        if version != SOCKS_VERSION:
+            return b"", None, b""
+        if USERNAME_PASSWORD in methods:
+            writer.write(bytes([SOCKS_VERSION, USERNAME_PASSWORD]))
+            await writer.drain()
+            auth_version, ulen = await reader.readexactly(2)
+            username = await reader.readexactly(ulen)
+            plen = (await reader.readexactly(1))[0]
+            password = await reader.readexactly(plen)
+            writer.write(bytes([auth_version, 0x00]))
+            await writer.drain()
+            auth = bytes([auth_version, ulen]) + username + bytes([plen]) + password
+            return bytes([SOCKS_VERSION, 1, USERNAME_PASSWORD]), USERNAME_PASSWORD, auth
+        if NO_AUTH in methods:
+            writer.write(bytes([SOCKS_VERSION, NO_AUTH]))
+            await writer.drain()
+            return bytes([SOCKS_VERSION, 1, NO_AUTH]), NO_AUTH, b""
+        writer.write(bytes([SOCKS_VERSION, NO_ACCEPTABLE_METHODS]))
+        await writer.drain()
+        return b"", None, b""
+
+    async def read_address(self, reader, atyp: int) -> Tuple[str, bytes]:
+        if atyp == ATYP_IPV4:
+            raw = await reader.readexactly(4)
+            return str(ipaddress.IPv4Address(raw)), raw
+        if atyp == ATYP_IPV6:
+            raw = await reader.readexactly(16)
+            return str(ipaddress.IPv6Address(raw)), raw
+        if atyp == ATYP_DOMAIN:
+            length = await reader.readexactly(1)
+            name = await reader.readexactly(length[0])
+            return name.decode(errors="replace"), length + name
+        raise ConnectionError(f"unsupported address type {atyp}")
+
+    async def read_reply(self, reader) -> bytes:
+        header = await reader.readexactly(4)
+        _, raw_address = await self.read_address(reader, header[3])
+        return header + raw_address + await reader.readexactly(2)
+
+    async def reply(self, writer, code: int):
+        writer.write(bytes([SOCKS_VERSION, code, 0x00, ATYP_IPV4, 0, 0, 0, 0, 0, 0]))
+        await writer.drain()
+
+    async def open_upstream(self, backend, greeting, method, auth, request):
+        """a connected upstream and its success reply, anything short of that raises"""
+        host, _, port = backend.rpartition(':')
+        reader, writer = await asyncio.open_connection(host, int(port))
+        try:
+            writer.write(greeting)
+            await writer.drain()
+            version, chosen = await reader.readexactly(2)
+            if chosen != method:
+                raise ConnectionError(f"upstream refused auth method {method}")
+            if auth:
+                writer.write(auth)
+                await writer.drain()
+                _, status = await reader.readexactly(2)
+                if status != 0x00:
+                    raise ConnectionError("upstream rejected credentials")
+            writer.write(request)
+            await writer.drain()
+            reply = await self.read_reply(reader)
+            if reply[1] != 0x00:
+                raise UpstreamRefused(reply[1])
+        except BaseException:
+            # a timeout cancels us mid-read, the socket still has to go
+            writer.close()
+            raise
+        return reader, writer, reply
+
+    async def pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        finally:
+            if writer.can_write_eof():
+                try:
+                    writer.write_eof()
+                except OSError:
+                    pass
+
+async def refresh_backends(router: Router):
+    while True:
+        try:
+            router.update_backends(await asyncio.to_thread(get_tor_backends))
+        except Exception as e:
+            logging.error(f"could not list tor backends: {e}")
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+async def report_stats(router: Router):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        hot = sorted(router.destinations.items(), key=lambda item: -item[1])[:5]
+        logging.info(f"routed {router.routed} connections, {router.failures} backend failures, {sum(router.active.values())} active, hottest {hot}")
+
+async def main():
+    router = Router()
+    asyncio.create_task(refresh_backends(router))
+    asyncio.create_task(report_stats(router))
+    server = await asyncio.start_server(router.handle, "0.0.0.0", ROUTER_PORT)
+    logging.info(f"socks5 router listening on :{ROUTER_PORT}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    asyncio.run(main())
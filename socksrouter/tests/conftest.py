@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the router is a single script, imported the way the image runs it from socksrouter/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
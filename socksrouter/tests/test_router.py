@@ -0,0 +1,139 @@
+import asyncio
+import bisect
+
+import router
+from router import HashRing, affinity_key, ring_hash
+
+KEYS = [f"{i:056x}.onion" for i in range(20000)]
+
+def backends(count):
+    return [f"tor-{n}:9050" for n in range(1, count + 1)]
+
+def test_collapsed_ring_maps_keys_like_the_full_ring():
+    ring_backends = backends(10)
+    ring = HashRing(ring_backends, vnodes=16)
+    points = sorted((ring_hash(f"{backend}#{i}"), backend) for backend in ring_backends for i in range(16))
+    hashes = [point for point, _ in points]
+    for key in KEYS:
+        expected = points[bisect.bisect(hashes, ring_hash(key)) % len(points)][1]
+        assert ring.successors(key, 1) == [expected]
+
+def test_adding_a_backend_only_moves_keys_onto_it():
+    before = HashRing(backends(10))
+    after = HashRing(backends(11))
+    moved = 0
+    for key in KEYS:
+        old, new = before.successors(key, 1)[0], after.successors(key, 1)[0]
+        if old != new:
+            assert new == "tor-11:9050"
+            moved += 1
+    # about a share of the keyspace, not a reshuffle
+    assert 0 < moved < len(KEYS) * 2 / 11
+
+def test_successors_are_distinct_and_skip():
+    ring = HashRing(backends(5), vnodes=8)
+    found = ring.successors("example.onion", 10)
+    assert sorted(found) == backends(5)
+    skipped = ring.successors("example.onion", 2, {found[0]})
+    assert skipped == found[1:3]
+
+def test_single_backend_ring():
+    ring = HashRing(backends(1), vnodes=8)
+    assert ring.successors("example.onion", 3) == ["tor-1:9050"]
+    assert HashRing([]).successors("example.onion", 1) == []
+
+def test_affinity_key_folds_onion_subdomains():
+    assert affinity_key("www.Example.onion.") == "example.onion"
+    assert affinity_key("a.b.example.onion") == "example.onion"
+    assert affinity_key("example.onion") == "example.onion"
+    assert affinity_key("www.Example.com") == "www.example.com"
+    assert affinity_key("10.0.0.1") == "10.0.0.1"
+
+def test_candidates_skip_failed_backends():
+    proxy = router.Router()
+    proxy.update_backends(backends(6))
+    preferred = proxy.candidates("www.example.onion")
+    assert preferred == proxy.candidates("example.onion")
+    assert len(preferred) == router.FANOUT + router.FALLBACKS
+    proxy.failed_until[preferred[0]] = router.time.monotonic() + 60
+    assert proxy.candidates("example.onion") == preferred[1:] + [b for b in proxy.ring.successors("example.onion", 6) if b not in preferred][:1]
+
+def test_candidates_forget_expired_failures_and_ignore_a_fully_failed_ring():
+    proxy = router.Router()
+    proxy.update_backends(backends(3))
+    preferred = proxy.candidates("example.onion")
+    proxy.failed_until[preferred[0]] = router.time.monotonic() - 1
+    assert proxy.candidates("example.onion") == preferred
+    assert not proxy.failed_until
+    proxy.failed_until = {b: router.time.monotonic() + 60 for b in backends(3)}
+    assert proxy.candidates("example.onion") == preferred
+
+def test_clearnet_candidates_prefer_idle_backends():
+    proxy = router.Router()
+    proxy.update_backends(backends(3))
+    proxy.active = {"tor-1:9050": 5, "tor-2:9050": 0, "tor-3:9050": 2}
+    assert proxy.candidates("example.com") == ["tor-2:9050", "tor-3:9050", "tor-1:9050"]
+    proxy.failed_until["tor-2:9050"] = router.time.monotonic() + 60
+    assert proxy.candidates("example.com") == ["tor-3:9050", "tor-1:9050"]
+
+async def fake_tor(reply_code=None):
+    """a socksport that answers no-auth and the connect with reply_code, or stalls when that's None"""
+    async def serve(reader, writer):
+        await reader.readexactly(3)
+        writer.write(bytes([5, 0]))
+        header = await reader.readexactly(5)
+        await reader.readexactly(header[4] + 2)
+        if reply_code is None:
+            await asyncio.sleep(60)
+        writer.write(bytes([5, reply_code, 0, 1, 0, 0, 0, 0, 0, 0]))
+        await writer.drain()
+        if reply_code == 0:
+            writer.write(await reader.read(100))
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    return server, f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+async def socks_connect(port, host=b"example.onion"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(bytes([5, 1, 0]))
+    assert await reader.readexactly(2) == bytes([5, 0])
+    writer.write(bytes([5, 1, 0, 3, len(host)]) + host + b"\x00\x50")
+    return reader, writer, await reader.readexactly(10)
+
+def test_stalled_and_refusing_backends_fall_through(monkeypatch):
+    monkeypatch.setattr(router, "CONNECT_TIMEOUT", 0.2)
+
+    async def run():
+        stalled, stalled_addr = await fake_tor(None)
+        refusing, refusing_addr = await fake_tor(0x04)
+        working, working_addr = await fake_tor(0x00)
+        proxy = router.Router()
+        proxy.candidates = lambda host: [stalled_addr, refusing_addr, working_addr]
+        server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+        reader, writer, reply = await socks_connect(server.sockets[0].getsockname()[1])
+        writer.write(b"ping")
+        echoed = await reader.readexactly(4)
+        writer.close()
+        for s in (server, stalled, refusing, working):
+            s.close()
+        return proxy, reply, echoed, (stalled_addr, refusing_addr, working_addr)
+
+    proxy, reply, echoed, (stalled_addr, refusing_addr, working_addr) = asyncio.run(run())
+    assert reply[1] == 0x00 and echoed == b"ping"
+    assert set(proxy.failed_until) == {stalled_addr, refusing_addr}
+
+def test_every_backend_refusing_passes_the_last_reply_on():
+    async def run():
+        refusing, refusing_addr = await fake_tor(0x05)
+        proxy = router.Router()
+        proxy.candidates = lambda host: [refusing_addr]
+        server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+        _, writer, reply = await socks_connect(server.sockets[0].getsockname()[1])
+        writer.close()
+        server.close()
+        refusing.close()
+        return reply
+
+    assert asyncio.run(run())[1] == 0x05
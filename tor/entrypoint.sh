@@ -0,0 +1,46 @@
+#!/bin/sh
+# opens TOR_SOCKS_PORTS socks listeners - 9050, then 9052 upwards (9051 is the controlport)
+# tor never shares a circuit between listeners, so each port is its own isolated pool of circuits
+set -e
+DATA=/var/lib/tor
+SEED=${TOR_SEED_DIR:-/seed}
+CACHE_FILES="cached-certs cached-microdesc-consensus cached-microdescs cached-microdescs.new"
+
+if [ -n "${TOR_SEED_EXPORT:-}" ]; then
+  # seed mode - keep a bootstrapped directory cache and republish it for the replicas every TOR_SEED_INTERVAL
+  tor -f /etc/tor/torrc "$@" &
+  pid=$!
+  interval=10
+  while kill -0 "$pid" 2>/dev/null; do
+    sleep "$interval"
+    [ -f "$DATA/cached-microdesc-consensus" ] || continue
+    for file in $CACHE_FILES; do
+      # copy then rename so a replica starting mid-export never reads a torn file
+      if [ -f "$DATA/$file" ]; then
+        cp "$DATA/$file" "$SEED/.$file.tmp" && mv "$SEED/.$file.tmp" "$SEED/$file"
+      fi
+    done
+    interval=${TOR_SEED_INTERVAL:-300}
+  done
+  wait "$pid"
+  exit $?
+fi
+
+if [ -f "$SEED/cached-microdesc-consensus" ] && [ ! -f "$DATA/cached-microdesc-consensus" ]; then
+  # a fresh replica starts from the shared cache instead of fetching the consensus and microdescriptors itself
+  for file in $CACHE_FILES; do
+    if [ -f "$SEED/$file" ]; then
+      cp "$SEED/$file" "$DATA/$file"
+    fi
+  done
+  echo "seeded $DATA from $SEED"
+fi
+
+ports=${TOR_SOCKS_PORTS:-1}
+set -- -f /etc/tor/torrc "$@" SocksPort "0.0.0.0:9050 ${TOR_SOCKS_ISOLATION:-}"
+i=1
+while [ "$i" -lt "$ports" ]; do
+  set -- "$@" +SocksPort "0.0.0.0:$((9051 + i)) ${TOR_SOCKS_ISOLATION:-}"
+  i=$((i + 1))
+done
+exec tor "$@"